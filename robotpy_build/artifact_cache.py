@@ -0,0 +1,169 @@
+"""
+    Cache of complete extension modules, keyed on a fingerprint of
+    everything that goes into building them. When a matching extension is
+    found, it is restored and the extension isn't compiled or linked.
+"""
+
+import filecmp
+import hashlib
+import os
+from os.path import abspath, basename, dirname, exists, isdir, join, relpath, splitext
+import shutil
+from typing import Dict, List, Optional
+
+import pkg_resources
+
+from .cache import (
+    default_max_size,
+    evict_lru,
+    get_user_cache_dir,
+    hash_file,
+    store_file,
+)
+from .compiler_probe import get_compiler_command
+from .object_cache import codegen_args
+
+
+def _hash_tree(h, root: str):
+    # relative paths, so that other checkouts have the same fingerprint
+    for dirpath, dirnames, files in os.walk(root):
+        dirnames.sort()
+        for fname in sorted(files):
+            path = join(dirpath, fname)
+            h.update(relpath(path, root).encode("utf-8") + b"\0")
+            try:
+                hash_file(path, h)
+            except OSError:
+                pass
+
+
+def _dependency_versions(wrapper) -> List[str]:
+    versions = []
+    deps = sorted(wrapper.all_deps(), key=lambda d: d.name)
+    for dep in [wrapper] + deps:
+        version = ""
+        cfg = getattr(dep, "cfg", None)
+        if cfg is not None and cfg.maven_lib_download:
+            # built as part of this project
+            version = cfg.maven_lib_download.version
+        elif dep.pypi_package:
+            try:
+                version = pkg_resources.get_distribution(dep.pypi_package).version
+            except pkg_resources.DistributionNotFound:
+                pass
+        versions.append(f"{dep.name}={version}")
+    return versions
+
+
+class ArtifactCache:
+    """
+        :param compiler_id: Identifies the compiler executable and version
+        :param path: Cache directory, defaults to the user cache directory
+        :param max_size: Size limit in bytes
+    """
+
+    def __init__(
+        self,
+        compiler_id: str,
+        path: Optional[str] = None,
+        max_size: int = default_max_size * 1024 * 1024,
+    ):
+        self.compiler_id = compiler_id
+        self.path = path or get_user_cache_dir("extensions")
+        self.max_size = max_size
+
+        self.restored = 0
+        self.stored = 0
+
+        # extensions of the same build share most of their include
+        # directories, so each one is only hashed once per build
+        self._tree_hashes: Dict[str, bytes] = {}
+
+    def fingerprint(self, compiler, ext) -> str:
+        """
+            Hashes the sources, include directories, dependency versions,
+            compiler and flags used to build an extension
+        """
+        h = hashlib.sha256()
+
+        def _add(*items: str):
+            h.update("\0".join(items).encode("utf-8") + b"\0")
+
+        _add(self.compiler_id, ext.name)
+        _add(*codegen_args(get_compiler_command(compiler) or []))
+        _add(*(getattr(compiler, "linker_so", None) or []))
+        _add(*codegen_args(ext.extra_compile_args or []))
+        _add(*(ext.extra_link_args or []))
+        _add(*[" ".join(str(v) for v in m if v is not None) for m in ext.define_macros])
+        _add(*ext.undef_macros)
+        _add(*ext.libraries)
+
+        wrapper = getattr(ext, "rpybuild_wrapper", None)
+        if wrapper:
+            _add(*_dependency_versions(wrapper))
+
+        for src in ext.sources:
+            _add(basename(src))
+            hash_file(src, h)
+
+        seen = set()
+        for incdir in ext.include_dirs + compiler.include_dirs:
+            incdir = abspath(incdir)
+            if incdir in seen or not isdir(incdir):
+                continue
+            seen.add(incdir)
+            _add("include")
+            h.update(self._tree_hash(incdir))
+
+        return h.hexdigest()
+
+    def _tree_hash(self, root: str) -> bytes:
+        digest = self._tree_hashes.get(root)
+        if digest is None:
+            th = hashlib.sha256()
+            _hash_tree(th, root)
+            digest = self._tree_hashes[root] = th.digest()
+        return digest
+
+    def _entry(self, key: str, ext_path: str) -> str:
+        return join(self.path, key[:2], key + splitext(ext_path)[1])
+
+    def is_current(self, key: str, ext_path: str) -> bool:
+        """Returns True if ext_path is the same as the cached extension"""
+        entry = self._entry(key, ext_path)
+        try:
+            if not filecmp.cmp(entry, ext_path, shallow=False):
+                return False
+            os.utime(entry)
+        except OSError:
+            return False
+        return True
+
+    def restore(self, key: str, ext_path: str) -> bool:
+        """Copies the cached extension to ext_path if it exists"""
+        entry = self._entry(key, ext_path)
+        try:
+            os.makedirs(dirname(ext_path), exist_ok=True)
+            shutil.copyfile(entry, ext_path)
+            # mtime is used to find the least recently used entries
+            os.utime(entry)
+        except OSError:
+            return False
+        self.restored += 1
+        return True
+
+    def store(self, key: str, ext_path: str):
+        entry = self._entry(key, ext_path)
+        if exists(entry) or not exists(ext_path):
+            return
+        try:
+            store_file(ext_path, entry)
+        except OSError:
+            return
+        self.stored += 1
+
+    def evict(self):
+        evict_lru(self.path, self.max_size)
+
+    def print_summary(self):
+        print("Extension cache: %d restored, %d stored" % (self.restored, self.stored))
@@ -0,0 +1,137 @@
+import contextlib
+import os
+from os.path import dirname, expanduser, join
+import shutil
+import threading
+from typing import Callable, List, Tuple
+
+#: Default size limit of each cache (MiB)
+default_max_size = 5 * 1024
+
+
+def get_user_cache_dir(*subdirs: str) -> str:
+    """
+        Returns a per-user directory for robotpy-build caches that persist
+        across builds and projects, creating it if needed.
+
+        Set RPYBUILD_CACHE_DIR to override the location, otherwise it is
+        $XDG_CACHE_HOME/robotpy-build (~/.cache/robotpy-build)
+    """
+    root = os.environ.get("RPYBUILD_CACHE_DIR")
+    if not root:
+        if os.name == "nt":
+            base = os.environ.get("LOCALAPPDATA") or expanduser("~")
+        else:
+            base = os.environ.get("XDG_CACHE_HOME") or join(expanduser("~"), ".cache")
+        root = join(base, "robotpy-build")
+
+    path = join(root, *subdirs)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def store_file(src: str, dst: str):
+    """
+        Atomically copies a file into a cache, so that concurrent builds
+        never see a partially written entry
+    """
+    os.makedirs(dirname(dst), exist_ok=True)
+    tmp = f"{dst}.{os.getpid()}.{threading.get_ident()}.tmp"
+    shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+@contextlib.contextmanager
+def file_lock(fname: str):
+    """
+        Holds an exclusive lock on fname (created if needed) while in the
+        context, so that only one process at a time modifies whatever it
+        protects. Blocks until the lock is available.
+    """
+    os.makedirs(dirname(fname), exist_ok=True)
+    with open(fname, "a+b") as fp:
+        if os.name == "nt":
+            import msvcrt
+
+            fp.seek(0)
+            while True:
+                try:
+                    # gives up after 10 seconds
+                    msvcrt.locking(fp.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass
+            try:
+                yield
+            finally:
+                fp.seek(0)
+                msvcrt.locking(fp.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+
+            fcntl.flock(fp.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fp.fileno(), fcntl.LOCK_UN)
+
+
+def hash_file(fname: str, *hashes):
+    """Updates each of the hash objects with the contents of fname"""
+    with open(fname, "rb") as fp:
+        for chunk in iter(lambda: fp.read(1024 * 1024), b""):
+            for h in hashes:
+                h.update(chunk)
+
+
+def list_files(path: str) -> List[Tuple[float, int, str]]:
+    """Returns (mtime, size, path) for every file in a cache directory"""
+    entries = []
+    for root, _, files in os.walk(path):
+        for fname in files:
+            fpath = join(root, fname)
+            try:
+                st = os.stat(fpath)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, fpath))
+    return entries
+
+
+def _unlink(fpath: str) -> bool:
+    try:
+        os.unlink(fpath)
+    except OSError:
+        return False
+    return True
+
+
+def evict_lru(
+    path: str,
+    max_size: int,
+    entries: List[Tuple[float, int, str]] = None,
+    remove: Callable[[str], bool] = _unlink,
+):
+    """
+        Removes the least recently used entries (by modification time) of a
+        cache until it is smaller than max_size bytes
+
+        :param entries: (mtime, size, path) of each entry, defaults to
+                        every file in the cache directory
+        :param remove:  Removes an entry, returning False if it couldn't be
+    """
+    if entries is None:
+        entries = list_files(path)
+
+    total = sum(size for _, size, _ in entries)
+    if total <= max_size:
+        return
+
+    # leave some room so that every build doesn't need to evict
+    target = max_size * 0.9
+    for _, size, fpath in sorted(entries):
+        if not remove(fpath):
+            continue
+        total -= size
+        if total <= target:
+            break
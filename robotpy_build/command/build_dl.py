@@ -1,7 +1,13 @@
+import concurrent.futures
+import contextlib
 from distutils.core import Command
+from distutils.errors import DistutilsError, DistutilsOptionError
 import os.path
 
+from ..download_cache import get_download_cache
+from ..http_pool import OfflineError, get_http_pool
 from ..platforms import get_platform
+from ..taskgraph import TaskGraph
 from .util import get_install_root
 
 
@@ -13,13 +19,22 @@ class BuildDl(Command):
         ("build-base=", "b", "base directory for build library"),
         ("build-cache=", None, "build directory to cache downloaded objects"),
         ("src-unpack-to=", None, "build directory to unpack sources to"),
+        ("jobs=", "j", "number of files to download at once (default 4)"),
+        (
+            "offline",
+            None,
+            "fail instead of downloading files that aren't cached or in a local maven repository",
+        ),
     ]
+    boolean_options = ["offline"]
     wrappers = []
 
     def initialize_options(self):
         self.build_base = None
         self.build_cache = None
         self.src_unpack_to = None
+        self.jobs = None
+        self.offline = None
 
     def finalize_options(self):
         self.set_undefined_options("build", ("build_base", "build_base"))
@@ -28,10 +43,64 @@ class BuildDl(Command):
         if self.src_unpack_to is None:
             self.src_unpack_to = os.path.join(self.build_base, "dlsrc")
 
+        if self.jobs is None:
+            self.jobs = os.environ.get("RPYBUILD_DL_JOBS", "4")
+        try:
+            self.jobs = int(self.jobs)
+        except ValueError:
+            raise DistutilsOptionError("--jobs must be an integer")
+        if self.jobs < 1:
+            raise DistutilsOptionError("--jobs must be at least 1")
+
+        if self.offline:
+            get_http_pool().offline = True
+
+        self.executor = None
+
+    @contextlib.contextmanager
+    def downloading(self):
+        """
+            Wrappers downloaded while this is active share one pool of jobs
+            threads, so that jobs limits the total number of downloads
+        """
+        with concurrent.futures.ThreadPoolExecutor(self.jobs) as executor:
+            self.executor = executor
+            try:
+                yield
+            finally:
+                self.executor = None
+
     def run(self):
+        # wrappers are downloaded at the same time; each one is extracted as
+        # soon as its files have been downloaded
+        graph = TaskGraph()
         for wrapper in self.wrappers:
-            wrapper.on_build_dl(self.build_cache, self.src_unpack_to)
+            graph.add(wrapper.name, lambda wrapper=wrapper: self.download(wrapper))
+        with self.downloading():
+            graph.run()
+
+        for wrapper in self.wrappers:
+            self.relink(wrapper)
+
+        self.evict()
+
+    def download(self, wrapper):
+        try:
+            wrapper.on_build_dl(self.build_cache, self.src_unpack_to, self.executor)
+        except OfflineError as e:
+            raise DistutilsError(str(e))
+
+    def evict(self):
+        """Keeps the shared download cache within its size limit"""
+        cache = get_download_cache()
+        if cache:
+            cache.evict()
 
+    def relink(self, wrapper):
+        """
+            Must be called once the wrapper and the wrappers it depends on
+            have been downloaded
+        """
         # On OSX, fix library loader paths for embedded libraries
         # -> this happens here so that the libs are modified before build_py
         #    copies them. Extensions are fixed after build
@@ -40,5 +109,4 @@ class BuildDl(Command):
             from ..relink_libs import relink_libs
 
             install_root = get_install_root(self)
-            for wrapper in self.wrappers:
-                relink_libs(install_root, wrapper, self.rpybuild_pkgcfg)
+            relink_libs(install_root, wrapper, self.rpybuild_pkgcfg)
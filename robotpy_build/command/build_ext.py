@@ -1,39 +1,51 @@
 import os
-from os.path import dirname, join
+from os.path import basename, dirname, join
+import functools
+import threading
+import time
+from distutils.dep_util import newer_group
+from distutils.errors import DistutilsOptionError
 from setuptools import setup, Extension
 from setuptools.command.build_ext import build_ext
-import setuptools
-import tempfile
 
 from .util import get_install_root
+from ..artifact_cache import ArtifactCache
+from ..cache import default_max_size
+from ..compiler_cache import CompilerCache
+from ..compiler_probe import CompilerProbe
+from ..compile_pool import (
+    CompilePool,
+    JobServer,
+    default_jobs,
+    measure_compile_memory,
+    pooled_compile,
+)
+from ..incremental import DependencyTracker, ObjectDb
+from ..linker import select_linker
+from ..memusage import get_available_memory
+from ..object_cache import ObjectCache
+from ..pch import build_pch
+from ..pipeline import GenPipeline
+from ..taskgraph import TaskGraph
 from ..platforms import get_platform
+from ..profiles import get_profile, get_profile_flags
+from ..time_trace import TimeTraceReport, capture_gcc_time_report, time_trace_flags
 
-# As of Python 3.6, CCompiler has a `has_flag` method.
-# cf http://bugs.python.org/issue26689
-def has_flag(compiler, flagname):
-    """Return a boolean indicating whether a flag name is supported on
-    the specified compiler.
-    """
-    with tempfile.TemporaryDirectory() as tmpdir:
-        fname = join(tmpdir, "test.cpp")
-        with open(fname, "w") as fp:
-            fp.write("int main (int argc, char **argv) { return 0; }")
-        try:
-            compiler.compile([fname], output_dir=tmpdir, extra_postargs=[flagname])
-        except setuptools.distutils.errors.CompileError:
-            return False
-    return True
+
+def cpp_flags(pfx, sep="="):
+    return [f"{pfx}std{sep}c++17", f"{pfx}std{sep}c++14", f"{pfx}std{sep}c++11"]
 
 
-def cpp_flag(compiler, pfx, sep="="):
+def cpp_flag(probe: CompilerProbe, pfx, sep="="):
     """Return the -std=c++[11/14/17] compiler flag.
     The newer version is prefered over c++11 (when it is available).
     """
 
-    flags = [f"{pfx}std{sep}c++17", f"{pfx}std{sep}c++14", f"{pfx}std{sep}c++11"]
+    flags = cpp_flags(pfx, sep)
+    supported = probe.has_flags(flags)
 
     for flag in flags:
-        if has_flag(compiler, flag):
+        if supported[flag]:
             return flag
 
     raise RuntimeError("Unsupported compiler -- at least C++11 support is needed!")
@@ -55,25 +67,228 @@ def get_opts(typ):
 class BuildExt(build_ext):
     """A custom build extension for adding compiler-specific options."""
 
+    rpybuild_profiles = {}
+
+    user_options = build_ext.user_options + [
+        (
+            "jobs=",
+            None,
+            "number of files to compile in parallel across all extensions",
+        ),
+        ("pch", None, "use a precompiled header for robotpy_build.h and casters"),
+        (
+            "compiler-cache=",
+            None,
+            "compile through a compiler cache: auto, ccache, sccache or none",
+        ),
+        ("time-trace", None, "report where compile time is spent (implies --force)"),
+        ("profile=", None, "build profile to use (release, dev, or from pyproject)"),
+        ("linker=", None, "linker to use: auto, default, mold, lld or gold"),
+        ("object-cache", None, "reuse object files compiled by any earlier build"),
+        (
+            "artifact-cache",
+            None,
+            "reuse extensions built from identical inputs by any earlier build",
+        ),
+        ("pipeline", None, "compile generated files while the rest are generated"),
+    ]
+    boolean_options = build_ext.boolean_options + [
+        "pch",
+        "time-trace",
+        "object-cache",
+        "artifact-cache",
+        "pipeline",
+    ]
+
+    def initialize_options(self):
+        build_ext.initialize_options(self)
+        self.jobs = None
+        self.pch = None
+        self.compiler_cache = None
+        self.time_trace = None
+        self.profile = None
+        self.linker = None
+        self.object_cache = None
+        self.artifact_cache = None
+        self.pipeline = None
+
+    def finalize_options(self):
+        build_ext.finalize_options(self)
+
+        self.jobserver = JobServer.from_environ()
+
+        if self.jobs is None:
+            if isinstance(self.parallel, int) and self.parallel > 1:
+                self.jobs = self.parallel
+            elif os.environ.get("RPYBUILD_PARALLEL") == "1" or self.jobserver:
+                # the jobserver limits concurrency to what make allows
+                self.jobs = default_jobs()
+            else:
+                self.jobs = 1
+        else:
+            try:
+                self.jobs = int(self.jobs)
+            except ValueError:
+                raise DistutilsOptionError("--jobs must be an integer")
+            if self.jobs < 1:
+                self.jobs = default_jobs()
+
+        if self.compiler_cache is None:
+            self.compiler_cache = os.environ.get("RPYBUILD_COMPILER_CACHE")
+
+        if self.profile is None:
+            self.profile = os.environ.get("RPYBUILD_PROFILE")
+
+        profile = None
+        if self.profile:
+            try:
+                profile = get_profile(self.profile, self.rpybuild_profiles)
+            except ValueError as e:
+                raise DistutilsOptionError(str(e))
+        self.build_profile = profile
+
+        if self.linker is None:
+            self.linker = os.environ.get("RPYBUILD_LINKER")
+        if self.linker is None and profile:
+            self.linker = profile.linker
+
+        if self.object_cache is None:
+            self.object_cache = os.environ.get("RPYBUILD_OBJECT_CACHE") == "1"
+        if self.artifact_cache is None:
+            self.artifact_cache = os.environ.get("RPYBUILD_ARTIFACT_CACHE") == "1"
+        if self.pipeline is None:
+            self.pipeline = os.environ.get("RPYBUILD_PIPELINE") == "1"
+        # set by run when generation is deferred to build_extensions
+        self.gen_pending = False
+
+        # traces only exist for files that are actually compiled
+        if self.time_trace:
+            self.force = True
+
     def build_extensions(self):
         ct = self.compiler.compiler_type
+
+        # only the pooled build can compile while generating
+        pipelined = self.gen_pending and ct == "unix"
+        if self.gen_pending and not pipelined:
+            self._generate()
+        if pipelined and (self.pch or self.artifact_cache):
+            print("--pch and --artifact-cache are not used with --pipeline")
         opts, link_opts = get_opts(ct)
 
+        self.probe = CompilerProbe(self.compiler)
+
         if ct == "unix":
-            opts.append("-s")  # strip
-            opts.append("-g0")  # remove debug symbols
-            opts.append(cpp_flag(self.compiler, "-"))
-            if has_flag(self.compiler, "-fvisibility=hidden"):
+            # probe everything we might need at once
+            self.probe.has_flags(cpp_flags("-") + ["-fvisibility=hidden"])
+
+            if not self.build_profile:
+                opts.append("-s")  # strip
+                opts.append("-g0")  # remove debug symbols
+            opts.append(cpp_flag(self.probe, "-"))
+            if self.probe.has_flag("-fvisibility=hidden"):
                 opts.append("-fvisibility=hidden")
+            opts += DependencyTracker.flags
         elif ct == "msvc":
-            opts.append(cpp_flag(self.compiler, "/", ":"))
+            opts.append(cpp_flag(self.probe, "/", ":"))
+
+        if self.build_profile:
+            profile_opts, profile_link_opts = get_profile_flags(
+                self.build_profile, self.probe, get_platform().os
+            )
+            opts += profile_opts
+            link_opts += profile_link_opts
+
+        self.linker_flag = None
+        if ct == "unix":
+            try:
+                self.linker_flag = select_linker(self.probe, self.linker, link_opts)
+            except ValueError as e:
+                raise DistutilsOptionError(str(e))
+            if self.linker_flag:
+                link_opts.append(self.linker_flag)
+
+        trace = None
+        if self.time_trace and ct == "unix":
+            trace = TimeTraceReport(self.probe.is_clang)
+            opts += time_trace_flags(trace.is_clang)
+            if not trace.is_clang:
+                capture_gcc_time_report(self.compiler)
+
         for ext in self.extensions:
             ext.extra_compile_args = opts
             ext.extra_link_args = link_opts
 
-        # self._gather_global_includes()
+        cache = None
+        # cache hits wouldn't produce any traces
+        if ct == "unix" and not trace:
+            try:
+                cache = CompilerCache.find(
+                    self.compiler_cache, os.getcwd(), self.build_temp
+                )
+            except ValueError as e:
+                raise DistutilsOptionError(str(e))
+
+        if cache:
+            cache.apply(self.compiler, self.extensions, bool(self.pch))
+
+        self.obj_cache = None
+        if self.object_cache and ct == "unix" and not trace and self.probe.identity:
+            max_size = int(
+                os.environ.get("RPYBUILD_OBJECT_CACHE_SIZE", default_max_size)
+            )
+            self.obj_cache = ObjectCache(
+                self.probe.identity, max_size=max_size * 1024 * 1024
+            )
+
+        self.object_db = ObjectDb(self.build_temp)
+        self.tracker = None
+        if ct == "unix":
+            self.tracker = DependencyTracker(self.object_db, self.force)
+            if not pipelined:
+                self._add_extension_depends()
+
+        self.artifacts = None
+        self.artifact_keys = {}
+        self.restored = set()
+        if self.artifact_cache and not pipelined and not trace and self.probe.identity:
+            max_size = int(
+                os.environ.get("RPYBUILD_ARTIFACT_CACHE_SIZE", default_max_size)
+            )
+            self.artifacts = ArtifactCache(
+                self.probe.identity, max_size=max_size * 1024 * 1024
+            )
+            self._restore_artifacts()
 
-        build_ext.build_extensions(self)
+        try:
+            if self.pch and ct == "unix" and not pipelined:
+                self._build_pchs()
+
+            # self._gather_global_includes()
+
+            # The default compile implementation is the only one that can be
+            # split into separate jobs, msvc compiles everything itself
+            if ct == "unix":
+                self._build_extensions_pooled(pipelined)
+            else:
+                build_ext.build_extensions(self)
+        finally:
+            self.object_db.save()
+            if cache:
+                cache.restore()
+            if trace and not trace.is_clang:
+                del self.compiler.spawn
+
+        if cache:
+            cache.print_summary(self.extensions)
+        if self.obj_cache:
+            self.obj_cache.print_summary()
+            self.obj_cache.evict()
+
+        if trace:
+            for ext in self.extensions:
+                trace.add_extension(self.compiler, ext, self.build_temp)
+            trace.write(join(self.build_temp, "time-trace.txt"))
 
         # Fix Libraries on macOS
         # Uses @loader_path, is compatible with macOS >= 10.4
@@ -93,55 +308,267 @@ class BuildExt(build_ext):
                     self.rpybuild_pkgcfg,
                 )
 
-    def run(self):
-
-        # files need to be generated before building can occur
-        self.run_command("build_gen")
-
-        build_ext.run(self)
-
-
-if os.environ.get("RPYBUILD_PARALLEL") == "1":
-    # don't enable this hack by default, because not really sure of the
-    # ramifications -- however, it's really useful for development
-    #
-    # .. the real answer to this is cmake o_O
-
-    # monkey-patch for parallel compilation
-    # -> https://stackoverflow.com/questions/11013851/speeding-up-build-process-with-distutils/13176803#13176803
-    def parallelCCompile(
-        self,
-        sources,
-        output_dir=None,
-        macros=None,
-        include_dirs=None,
-        debug=0,
-        extra_preargs=None,
-        extra_postargs=None,
-        depends=None,
-    ):
-        # those lines are copied from distutils.ccompiler.CCompiler directly
-        macros, objects, extra_postargs, pp_opts, build = self._setup_compile(
-            output_dir, macros, include_dirs, sources, depends, extra_postargs
+        # stored once they're relinked, so that an extension that is up to
+        # date matches its cache entry
+        if self.artifacts:
+            self._store_artifacts()
+            self.artifacts.print_summary()
+            self.artifacts.evict()
+
+    def build_extension(self, ext):
+        if ext.name in self.restored:
+            return
+
+        # distutils only looks at timestamps to decide whether to build an
+        # extension, so force it when the flags changed (new profile, etc)
+        force = self.force
+        if (
+            not force
+            and self.tracker
+            and self.tracker.flags_changed(
+                self.compiler,
+                ext,
+                self.build_temp,
+                self.debug,
+                self.get_ext_fullpath(ext.name),
+            )
+        ):
+            self.force = True
+        try:
+            build_ext.build_extension(self, ext)
+        finally:
+            self.force = force
+
+    def _add_extension_depends(self, extensions=None):
+        # distutils only rebuilds an extension if something it depends
+        # on is newer, so tell it about the headers
+        for ext in extensions or self.extensions:
+            ext.depends = ext.depends + self.tracker.extension_depends(
+                self.compiler, ext, self.build_temp
+            )
+
+    def _generate(self):
+        self.run_command("build_dl")
+        self.get_finalized_command("build_gen").generate()
+        self.distribution.have_run["build_gen"] = 1
+        self.gen_pending = False
+
+    def _compile_generated(self, wrapper, src: str):
+        # the same arguments that build_extension compiles the sources with
+        ext = wrapper.extension
+        macros = ext.define_macros[:]
+        for undef in ext.undef_macros:
+            macros.append((undef,))
+
+        self.compiler.compile(
+            [src],
+            output_dir=self.build_temp,
+            macros=macros,
+            include_dirs=ext.include_dirs,
+            debug=self.debug,
+            extra_postargs=ext.extra_compile_args or [],
+            depends=ext.depends,
         )
-        cc_args = self._get_cc_args(pp_opts, debug, extra_preargs)
-        # parallel code
-        import multiprocessing
-        import multiprocessing.pool
 
-        N = multiprocessing.cpu_count()
+    def _restore_artifacts(self):
+        for ext in self.extensions:
+            key = self.artifacts.fingerprint(self.compiler, ext)
+            self.artifact_keys[ext.name] = key
+            if self.force:
+                continue
+
+            # leave an extension that is already up to date alone
+            ext_path = self.get_ext_fullpath(ext.name)
+            if self.artifacts.is_current(key, ext_path):
+                self.restored.add(ext.name)
+            elif self.artifacts.restore(key, ext_path):
+                print(f"restored {ext.name} from the extension cache")
+                self.restored.add(ext.name)
+
+    def _store_artifacts(self):
+        for ext in self.extensions:
+            if ext.name not in self.restored:
+                self.artifacts.store(
+                    self.artifact_keys[ext.name], self.get_ext_fullpath(ext.name)
+                )
 
-        def _single_compile(obj):
-            try:
-                src, ext = build[obj]
-            except KeyError:
-                return
-            self._compile(obj, src, ext, cc_args, extra_postargs, pp_opts)
+    def _build_pchs(self):
+        is_clang = self.probe.is_clang
 
-        # convert to list, imap is evaluated on-demand
-        list(multiprocessing.pool.ThreadPool(N).imap(_single_compile, objects))
-        return objects
+        for ext in self.extensions:
+            # don't bother if the extension won't be rebuilt
+            if ext.name in self.restored:
+                continue
+            ext_path = self.get_ext_fullpath(ext.name)
+            # depends includes headers from earlier builds, which may be gone
+            if not (
+                self.force
+                or newer_group(ext.sources + ext.depends, ext_path, missing="newer")
+            ):
+                continue
+
+            wrapper = getattr(ext, "rpybuild_wrapper", None)
+            casters = wrapper._all_casters() if wrapper else None
+
+            pch_args = build_pch(
+                self.compiler,
+                ext,
+                self.build_temp,
+                is_clang,
+                self.debug,
+                casters,
+                self.tracker,
+            )
+            ext.extra_compile_args = ext.extra_compile_args + pch_args
+
+    def _build_extensions_pooled(self, generate: bool = False):
+        """
+            Queues the sources of every extension on one shared pool, and
+            links the extensions once all of the objects are compiled
+
+            :param generate: Download and generate the wrappers too, as a
+                             graph of tasks (see _build_graph)
+        """
+        self.check_extensions_list(self.extensions)
+
+        compiler = self.compiler
+        link_shared_object = compiler.link_shared_object
+        links = {}
+
+        def _deferred_link(*args, **kwargs):
+            # args are (objects, output_filename, ...)
+            links[args[1]] = (args, kwargs)
+
+        # measure how much memory each compile uses, so that the next build
+        # can avoid running out of memory
+        memory_budget = get_available_memory() if self.jobs > 1 else None
+        measuring = measure_compile_memory(compiler)
+
+        graph = None
+        try:
+            with CompilePool(
+                self.jobs, self.jobserver, memory_budget, self.object_db
+            ) as pool:
+                compiler.compile = pooled_compile(
+                    pool, compiler, self.tracker, self.obj_cache
+                )
+                compiler.link_shared_object = _deferred_link
+                try:
+                    if generate:
+                        pool.start()
+                        graph = self._build_graph(pool, links, link_shared_object)
+                        gen = self.get_finalized_command("build_gen")
+                        dl = self.get_finalized_command("build_dl")
+                        with gen.memory_monitor(), dl.downloading():
+                            graph.run()
+                        dl.evict()
+                        self.distribution.have_run["build_dl"] = 1
+                        self.distribution.have_run["build_gen"] = 1
+                        self.gen_pending = False
+                    else:
+                        for ext in self.extensions:
+                            self.build_extension(ext)
+                finally:
+                    del compiler.compile
+                    del compiler.link_shared_object
+
+                pool.wait()
+        finally:
+            if measuring:
+                del compiler.spawn
+
+        pool.print_report()
+
+        for args, kwargs in links.values():
+            self._link(link_shared_object, args, kwargs)
+
+        if graph:
+            graph.print_timeline()
+
+    def _build_graph(self, pool, links, link_shared_object) -> TaskGraph:
+        """
+            Each wrapper is downloaded, generated, then compiled and linked.
+            A wrapper is generated once the wrappers that it depends on have
+            been generated, and compiled once it has been generated, so
+            independent wrappers make progress at the same time. Generated
+            sources are queued as soon as they are written (see GenPipeline),
+            and sources written by the user (which include
+            rpygen_wrapper.hpp) are compiled once their wrapper is generated.
+        """
+        dl = self.get_finalized_command("build_dl")
+        gen = self.get_finalized_command("build_gen")
+        pipeline = GenPipeline(self._compile_generated, gen.wrappers)
+
+        downloaded = self.distribution.have_run.get("build_dl")
+        in_tree = {wrapper.name for wrapper in gen.wrappers}
+
+        # generation is pure python, so running it on several threads at
+        # once wouldn't be any faster
+        gen_lock = threading.Lock()
+        # build_extension isn't reentrant
+        ext_lock = threading.Lock()
+
+        def _download(wrapper):
+            if not downloaded:
+                dl.download(wrapper)
+
+        def _generate(wrapper):
+            if not downloaded:
+                dl.relink(wrapper)
+            with gen_lock:
+                gen.generate_wrapper(wrapper, pipeline)
+
+        def _build(ext):
+            with ext_lock:
+                self._add_extension_depends([ext])
+                self.build_extension(ext)
+
+            link = links.pop(self.get_ext_fullpath(ext.name), None)
+            if link:
+                args, kwargs = link
+                pool.wait_for(args[0])
+                self._link(link_shared_object, args, kwargs)
+
+        graph = TaskGraph()
+        for wrapper in gen.wrappers:
+            deps = [dep for dep in wrapper.cfg.depends if dep in in_tree]
+            graph.add(f"download {wrapper.name}", functools.partial(_download, wrapper))
+            graph.add(
+                f"generate {wrapper.name}",
+                functools.partial(_generate, wrapper),
+                [f"download {wrapper.name}"] + [f"generate {dep}" for dep in deps],
+            )
+
+        all_generated = [f"generate {wrapper.name}" for wrapper in gen.wrappers]
+        for ext in self.extensions:
+            wrapper = getattr(ext, "rpybuild_wrapper", None)
+            if wrapper is not None and wrapper.name in in_tree:
+                depends = [f"generate {wrapper.name}"]
+            else:
+                depends = all_generated
+            graph.add(f"build {ext.name}", functools.partial(_build, ext), depends)
+
+        return graph
+
+    def _link(self, link_shared_object, args, kwargs):
+        linker = self.linker_flag[len("-fuse-ld=") :] if self.linker_flag else "ld"
+        start = time.monotonic()
+        link_shared_object(*args, **kwargs)
+        elapsed = time.monotonic() - start
+        if self.tracker:
+            # (objects, output_filename, ...) from build_extension
+            self.tracker.record_link(
+                self.compiler, args[1], kwargs.get("extra_postargs")
+            )
+        print("Linked %s in %.1fs (%s)" % (basename(args[1]), elapsed, linker))
+
+    def run(self):
 
-    import distutils.ccompiler
+        # files need to be generated before building can occur, unless they
+        # are generated while compiling
+        if self.pipeline and not self.distribution.have_run.get("build_gen"):
+            self.gen_pending = True
+        else:
+            self.run_command("build_gen")
 
-    distutils.ccompiler.CCompiler.compile = parallelCCompile
+        build_ext.run(self)
@@ -1,5 +1,12 @@
 from distutils.core import Command
+from distutils.errors import DistutilsOptionError
+import contextlib
+import functools
 import os.path
+from typing import Optional
+
+from ..memusage import GenMemoryMonitor
+from ..pipeline import GenPipeline
 
 
 class BuildGen(Command):
@@ -10,13 +17,19 @@ class BuildGen(Command):
         ("build-base=", "b", "base directory for build library"),
         ("build-temp=", "t", "temporary build directory"),
         ("cxx-gen-dir=", "b", "Directory to write generated C++ files"),
+        ("max-rss=", None, "Abort generation if process RSS exceeds this many MiB"),
+        ("memory-report", None, "Print memory usage for each generated header"),
     ]
+    boolean_options = ["memory-report"]
     wrappers = []
 
     def initialize_options(self):
         self.build_base = None
         self.build_temp = None
         self.cxx_gen_dir = None
+        self.max_rss = None
+        self.memory_report = None
+        self.memory = None
 
     def finalize_options(self):
         self.set_undefined_options(
@@ -24,10 +37,46 @@ class BuildGen(Command):
         )
         if self.cxx_gen_dir is None:
             self.cxx_gen_dir = os.path.join(self.build_temp, "gensrc")
+        if self.max_rss is not None:
+            try:
+                self.max_rss = int(self.max_rss) * 1024 * 1024
+            except ValueError:
+                raise DistutilsOptionError("--max-rss must be an integer (MiB)")
 
     def run(self):
         # files need to be downloaded before building can occur
         self.run_command("build_dl")
+        self.generate()
+
+    def generate(self, pipeline: Optional[GenPipeline] = None):
+        """
+            Generates the sources of all wrappers. If a pipeline is given,
+            it is notified of each source as it is generated.
+        """
+        with self.memory_monitor():
+            for wrapper in self.wrappers:
+                self.generate_wrapper(wrapper, pipeline)
+
+        if pipeline:
+            pipeline.finish()
 
-        for wrapper in self.wrappers:
-            wrapper.on_build_gen(self.cxx_gen_dir)
+    @contextlib.contextmanager
+    def memory_monitor(self):
+        """Wrappers can only be generated while this is active"""
+        self.memory = GenMemoryMonitor(self.max_rss, bool(self.memory_report))
+        self.memory.start()
+        try:
+            yield
+        finally:
+            self.memory.stop()
+            self.memory = None
+
+    def generate_wrapper(self, wrapper, pipeline: Optional[GenPipeline] = None):
+        on_generated = None
+        if pipeline:
+            on_generated = functools.partial(pipeline.generated, wrapper)
+        wrapper.on_build_gen(
+            self.cxx_gen_dir, memory=self.memory, on_generated=on_generated
+        )
+        if pipeline:
+            pipeline.wrapper_done(wrapper)
@@ -0,0 +1,654 @@
+"""
+    Runs compile jobs for all extensions on a single shared pool of workers,
+    cooperating with a GNU make jobserver when one is available, and
+    limiting the number of compiles that run at once to what fits in memory
+"""
+
+import os
+import queue
+import re
+import select
+import subprocess
+import sys
+import sysconfig
+import threading
+import time
+import warnings
+from typing import Callable, Dict, List, Optional, Tuple
+
+from distutils import log
+from distutils.errors import DistutilsExecError
+from distutils.spawn import find_executable
+
+from .incremental import DependencyTracker, ObjectDb
+from .memusage import maxrss_bytes
+from .object_cache import ObjectCache
+
+#: Memory assumed to be used by a compile when nothing is known about it
+default_job_memory = 1024 * 1024 * 1024
+
+# peak RSS of the last compile spawned by each thread
+_spawn_rss = threading.local()
+
+
+def _spawn_env() -> Dict[str, str]:
+    # the environment that distutils.spawn gives each process
+    env = dict(os.environ)
+    if sys.platform == "darwin":
+        try:
+            from distutils.util import MACOSX_VERSION_VAR, get_macosx_target_ver
+        except ImportError:
+            # older distutils
+            target = sysconfig.get_config_var("MACOSX_DEPLOYMENT_TARGET")
+            if target:
+                env.setdefault("MACOSX_DEPLOYMENT_TARGET", str(target))
+        else:
+            target = get_macosx_target_ver()
+            if target:
+                env[MACOSX_VERSION_VAR] = target
+    return env
+
+
+def spawn_command(
+    cmd: List[str],
+    dry_run: bool = False,
+    stderr_handler: Optional[Callable[[List[str], str], None]] = None,
+):
+    """
+        Runs a command the same way that distutils.spawn does, recording the
+        peak RSS of the process if possible (see measure_compile_memory)
+
+        :param stderr_handler: If given, stderr is captured and passed to
+                               it along with the command, even if it failed
+    """
+    cmd = list(cmd)
+    log.info(subprocess.list2cmdline(cmd))
+    if dry_run:
+        return
+
+    executable = find_executable(cmd[0])
+    if executable is not None:
+        cmd[0] = executable
+
+    try:
+        proc = subprocess.Popen(
+            cmd,
+            env=_spawn_env(),
+            stderr=subprocess.PIPE if stderr_handler else None,
+            universal_newlines=stderr_handler is not None,
+        )
+    except OSError as e:
+        raise DistutilsExecError(f"command {cmd[0]!r} failed: {e}")
+
+    stderr = None
+    if stderr_handler:
+        with proc.stderr:
+            stderr = proc.stderr.read()
+
+    if hasattr(os, "wait4"):
+        # unlike Popen.wait, wait4 returns the resource usage of the compiler
+        # (and the processes that it waited for)
+        _, status, rusage = os.wait4(proc.pid, 0)
+        if os.WIFSIGNALED(status):
+            proc.returncode = -os.WTERMSIG(status)
+        else:
+            proc.returncode = os.WEXITSTATUS(status)
+
+        _spawn_rss.value = max(
+            getattr(_spawn_rss, "value", None) or 0, maxrss_bytes(rusage)
+        )
+    else:
+        proc.wait()
+
+    if stderr_handler:
+        stderr_handler(cmd, stderr)
+
+    if proc.returncode != 0:
+        raise DistutilsExecError(
+            f"command {cmd[0]!r} failed with exit code {proc.returncode}"
+        )
+
+
+def measure_compile_memory(compiler) -> bool:
+    """
+        Replaces the spawn method of the compiler with one that measures the
+        peak RSS of each compile. Returns False if that isn't possible on
+        this platform, or spawn was already replaced.
+    """
+    if not hasattr(os, "wait4") or "spawn" in vars(compiler):
+        return False
+
+    def spawn(cmd, **kwargs):
+        spawn_command(cmd, compiler.dry_run)
+
+    compiler.spawn = spawn
+    return True
+
+
+class JobServer:
+    """
+        Client for the GNU make jobserver protocol. Each compile beyond the
+        first one requires a token read from the jobserver, which must be
+        written back when the compile finishes.
+    """
+
+    _auth_re = re.compile(r"--jobserver-(?:auth|fds)=(\S+)")
+
+    def __init__(self, rfd: int, wfd: int):
+        self.rfd = rfd
+        self.wfd = wfd
+
+    @classmethod
+    def from_environ(cls) -> Optional["JobServer"]:
+        """
+            Returns a jobserver client if MAKEFLAGS describes a usable
+            jobserver, otherwise None
+        """
+        m = cls._auth_re.search(os.environ.get("MAKEFLAGS", ""))
+        if not m:
+            return None
+
+        auth = m.group(1)
+        try:
+            if auth.startswith("fifo:"):
+                fd = os.open(auth[5:], os.O_RDWR)
+                return cls(fd, fd)
+
+            rfd, wfd = (int(fd) for fd in auth.split(","))
+            # make only passes the descriptors to recipes marked with '+'
+            os.fstat(rfd)
+            os.fstat(wfd)
+        except (OSError, ValueError):
+            warnings.warn(
+                f"ignoring unusable make jobserver '{auth}' "
+                "(prefix the make recipe with '+' to use it)"
+            )
+            return None
+
+        return cls(rfd, wfd)
+
+    def acquire(self) -> bytes:
+        while True:
+            try:
+                token = os.read(self.rfd, 1)
+            except (BlockingIOError, InterruptedError):
+                # newer versions of make give recipes a non-blocking read
+                # end, so wait until a token is available
+                select.select([self.rfd], [], [])
+                continue
+            if not token:
+                raise DistutilsExecError("make jobserver closed unexpectedly")
+            return token
+
+    def release(self, token: bytes):
+        os.write(self.wfd, token)
+
+
+class CompileJob:
+    """
+        A single translation unit to be compiled by a distutils compiler. The
+        arguments are those computed by CCompiler.compile
+    """
+
+    def __init__(
+        self,
+        compiler,
+        obj,
+        src,
+        ext,
+        cc_args,
+        extra_postargs,
+        pp_opts,
+        tracker: Optional[DependencyTracker] = None,
+        object_cache: Optional[ObjectCache] = None,
+    ):
+        self.compiler = compiler
+        self.obj = obj
+        self.src = src
+        self.ext = ext
+        self.cc_args = cc_args
+        self.extra_postargs = extra_postargs
+        self.pp_opts = pp_opts
+        self.tracker = tracker
+        self.object_cache = object_cache
+
+        info = tracker.db.get(obj) if tracker else {}
+
+        #: Compile time of this object in the previous build
+        self.history: Optional[float] = info.get("time")
+
+        #: Peak RSS of the compile of this object in the previous build
+        self.rss_history: Optional[int] = info.get("rss")
+
+        #: Estimated cost, used to start the most expensive jobs first
+        self.cost = 0.0
+
+        #: Estimated memory used by the compile
+        self.memory = 0
+
+        #: Peak RSS of the compile, if it was compiled and measured
+        self.rss: Optional[int] = None
+
+    def size(self) -> int:
+        try:
+            return os.path.getsize(self.src)
+        except OSError:
+            return 0
+
+    def is_up_to_date(self) -> bool:
+        return self.tracker is not None and self.tracker.is_up_to_date(
+            self.compiler, self.obj, self.src, self.cc_args, self.extra_postargs
+        )
+
+    def run(self):
+        if self.tracker:
+            self.tracker.invalidate(self.obj)
+
+        key = None
+        if self.object_cache:
+            key = self.object_cache.key_for(
+                self.compiler, self.obj, self.src, self.cc_args, self.extra_postargs
+            )
+
+        elapsed = None
+        rss = None
+        if key is None or not self.object_cache.fetch(key, self.obj):
+            _spawn_rss.value = None
+            start = time.monotonic()
+            self.compiler._compile(
+                self.obj,
+                self.src,
+                self.ext,
+                self.cc_args,
+                self.extra_postargs,
+                self.pp_opts,
+            )
+            elapsed = time.monotonic() - start
+            rss = self.rss = _spawn_rss.value
+            if key is not None:
+                self.object_cache.store(key, self.obj)
+
+        if self.tracker:
+            self.tracker.record(
+                self.compiler,
+                self.obj,
+                self.src,
+                self.cc_args,
+                self.extra_postargs,
+                elapsed,
+                rss,
+            )
+
+
+def default_jobs() -> int:
+    return os.cpu_count() or 1
+
+
+class CompilePool:
+    """
+        Shared pool of worker threads that compile queued jobs. Each job
+        spawns a compiler process, so threads are sufficient.
+
+        Jobs submitted before the pool is started are run longest first,
+        based on how long each object took to compile in the previous build.
+        Otherwise the largest sources come first. This keeps a huge file
+        from starting last while the other workers sit idle.
+
+        If a memory budget is given, jobs wait to start until the memory
+        that they used in the previous build is available, so that large
+        translation units don't exhaust memory when compiled together.
+
+        The estimates for files without history are derived from the
+        objects in db, so that they are comparable with the files that
+        have history even when jobs are submitted after the pool started.
+
+        Usage::
+
+            with CompilePool(jobs) as pool:
+                pool.submit(job)
+                ...
+                pool.wait()
+    """
+
+    def __init__(
+        self,
+        jobs: int,
+        jobserver: Optional[JobServer] = None,
+        memory_budget: Optional[int] = None,
+        db: Optional[ObjectDb] = None,
+    ):
+        self.jobs = max(1, jobs)
+        self.jobserver = jobserver
+        self.memory_budget = memory_budget
+
+        self._memory_cond = threading.Condition()
+        self._memory_used = 0
+        self._default_memory = default_job_memory
+        # peak RSS of the compiles that ran so far, when there is no history
+        self._measured_rss: Optional[List[int]] = []
+        self._throttled = False
+
+        self._queue = queue.PriorityQueue()
+        self._seq = 0
+        self._pending: List[CompileJob] = []
+        self._started = False
+        self._seconds_per_byte = None
+        self._lock = threading.Lock()
+        self._implicit_slot_free = True
+        self._threads = []
+        self._error = None
+        self._cancelled = False
+
+        self._submitted = 0
+        self._completed = 0
+        # set when the job for an object finishes (or it is up to date)
+        self._done: Dict[str, threading.Event] = {}
+        self._failed: Dict[str, Exception] = {}
+
+        #: (source, seconds) for each completed job
+        self.timings: List[Tuple[str, float]] = []
+
+        if db is not None:
+            with db.lock:
+                history = [
+                    (info.get("time"), info.get("size"), info.get("rss"))
+                    for info in db.objects.values()
+                ]
+            self._learn(history)
+
+    def _learn(
+        self, history: List[Tuple[Optional[float], Optional[int], Optional[int]]]
+    ):
+        # scale sizes to seconds so that they're comparable with history
+        known = [(t, size) for t, size, _ in history if t and size]
+        known_size = sum(size for _, size in known)
+        if known_size:
+            self._seconds_per_byte = sum(t for t, _ in known) / known_size
+
+        # new files probably use about as much memory as the others
+        rss = [rss for _, _, rss in history if rss]
+        if rss:
+            self._default_memory = sum(rss) // len(rss)
+            self._measured_rss = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        # don't bother compiling anything else that was queued if the
+        # caller is bailing out
+        if exc_type is not None:
+            self._cancelled = True
+        for _ in self._threads:
+            self._put(float("inf"), None)
+        for t in self._threads:
+            t.join()
+        self._threads = []
+
+    def _put(self, priority: float, job: Optional[CompileJob]):
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+        self._queue.put((priority, seq, job))
+
+    def _estimate(self, job: CompileJob) -> float:
+        if job.history is not None:
+            return job.history
+        # without history, the size of the source is a good proxy: generated
+        # sources grow with the number of bindings in them
+        size = job.size()
+        if self._seconds_per_byte:
+            return size * self._seconds_per_byte
+        return float(size)
+
+    def _estimate_memory(self, job: CompileJob) -> int:
+        if job.rss_history:
+            return job.rss_history
+        return self._default_memory
+
+    def claim(self, obj: str) -> bool:
+        """
+            Returns True the first time an object is claimed, so that an
+            object that is already queued isn't compiled again
+        """
+        with self._lock:
+            if obj in self._done:
+                return False
+            self._done[obj] = threading.Event()
+            return True
+
+    def finished(self, obj: str):
+        """Marks a claimed object that didn't need to be compiled as done"""
+        self._done[obj].set()
+
+    def wait_for(self, objects: List[str]):
+        """
+            Waits for the jobs that compile the given objects to complete,
+            raising an error if any of them failed
+        """
+        for obj in objects:
+            with self._lock:
+                done = self._done.get(obj)
+            if done is not None:
+                done.wait()
+
+        with self._lock:
+            for obj in objects:
+                if obj in self._failed:
+                    raise self._failed[obj]
+
+    def submit(self, job: CompileJob):
+        with self._lock:
+            self._submitted += 1
+            started = self._started
+            if not started:
+                self._pending.append(job)
+        if started:
+            job.cost = self._estimate(job)
+            job.memory = self._estimate_memory(job)
+            self._put(-job.cost, job)
+
+    def start(self):
+        """
+            Starts compiling. Jobs that were submitted so far are ordered
+            longest first.
+        """
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            pending = self._pending
+            self._pending = []
+
+        # objects recorded by older versions don't have their size
+        if self._seconds_per_byte is None:
+            self._learn([(job.history, job.size(), job.rss_history) for job in pending])
+
+        for job in pending:
+            job.cost = self._estimate(job)
+            job.memory = self._estimate_memory(job)
+            self._put(-job.cost, job)
+
+        for _ in range(self.jobs):
+            t = threading.Thread(target=self._worker, daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def wait(self):
+        """
+            Waits for all submitted jobs to complete. If any job failed, the
+            first error is raised once the jobs already running finish.
+        """
+        self.start()
+        self._queue.join()
+        if self._error is not None:
+            err = self._error
+            self._error = None
+            raise err
+
+    def _acquire_slot(self) -> Optional[bytes]:
+        # make gives every process one implicit token, so only jobs running
+        # beyond the first one need a token from the jobserver
+        with self._lock:
+            if self._implicit_slot_free or self.jobserver is None:
+                self._implicit_slot_free = False
+                return None
+        return self.jobserver.acquire()
+
+    def _release_slot(self, token: Optional[bytes]):
+        if token is None:
+            with self._lock:
+                self._implicit_slot_free = True
+        else:
+            self.jobserver.release(token)
+
+    def _worker(self):
+        while True:
+            _, _, job = self._queue.get()
+            if job is None:
+                self._queue.task_done()
+                return
+
+            try:
+                # once something failed, drain the queue without compiling
+                if self._error is None and not self._cancelled:
+                    self._run_job(job)
+                elif self._error is not None:
+                    with self._lock:
+                        self._failed[job.obj] = self._error
+            except Exception as e:
+                with self._lock:
+                    if self._error is None:
+                        self._error = e
+                    self._failed[job.obj] = e
+            finally:
+                done = self._done.get(job.obj)
+                if done is not None:
+                    done.set()
+                self._queue.task_done()
+
+    def _acquire_memory(self, job: CompileJob):
+        if self.memory_budget is None:
+            return
+
+        with self._memory_cond:
+            job.memory = self._estimate_memory(job)
+            # one job always runs, even if it doesn't fit
+            while (
+                self._memory_used
+                and self._memory_used + job.memory > self.memory_budget
+            ):
+                if not self._throttled:
+                    self._throttled = True
+                    print(
+                        "limiting parallel compiles to fit in %.1fGiB of available memory"
+                        % (self.memory_budget / (1024 ** 3))
+                    )
+                self._memory_cond.wait()
+            self._memory_used += job.memory
+
+    def _release_memory(self, job: CompileJob):
+        if self.memory_budget is None:
+            return
+
+        with self._memory_cond:
+            self._memory_used -= job.memory
+            # on the first build, estimate from the compiles so far
+            if job.rss and self._measured_rss is not None:
+                self._measured_rss.append(job.rss)
+                self._default_memory = sum(self._measured_rss) // len(
+                    self._measured_rss
+                )
+            self._memory_cond.notify_all()
+
+    def _run_job(self, job: CompileJob):
+        # wait for memory first, so a jobserver token isn't held meanwhile
+        self._acquire_memory(job)
+        try:
+            token = self._acquire_slot()
+            try:
+                start = time.monotonic()
+                job.run()
+                elapsed = time.monotonic() - start
+            finally:
+                self._release_slot(token)
+        finally:
+            self._release_memory(job)
+
+        with self._lock:
+            self._completed += 1
+            self.timings.append((job.src, elapsed))
+            print(
+                "[%d/%d] %.1fs %s"
+                % (self._completed, self._submitted, elapsed, job.src)
+            )
+
+    def print_report(self, limit: int = 10):
+        if not self.timings:
+            return
+
+        total = sum(t for _, t in self.timings)
+        print(f"Compiled {len(self.timings)} files ({total:.1f}s of compile time)")
+        print("Slowest files:")
+        for src, elapsed in sorted(self.timings, key=lambda t: t[1], reverse=True)[
+            :limit
+        ]:
+            print("  %7.1fs %s" % (elapsed, src))
+
+
+def pooled_compile(
+    pool: CompilePool,
+    compiler,
+    tracker: Optional[DependencyTracker] = None,
+    object_cache: Optional[ObjectCache] = None,
+):
+    """
+        Returns a replacement for compiler.compile that queues each
+        translation unit on the pool instead of compiling it immediately.
+        If a tracker is given, objects that are up to date are skipped.
+        Objects are retrieved from the object cache when possible.
+    """
+
+    def compile(
+        sources,
+        output_dir=None,
+        macros=None,
+        include_dirs=None,
+        debug=0,
+        extra_preargs=None,
+        extra_postargs=None,
+        depends=None,
+    ):
+        # same setup that distutils.ccompiler.CCompiler.compile does
+        macros, objects, extra_postargs, pp_opts, build = compiler._setup_compile(
+            output_dir, macros, include_dirs, sources, depends, extra_postargs
+        )
+        cc_args = compiler._get_cc_args(pp_opts, debug, extra_preargs)
+
+        for obj in objects:
+            try:
+                src, ext = build[obj]
+            except KeyError:
+                continue
+            if not pool.claim(obj):
+                continue
+            job = CompileJob(
+                compiler,
+                obj,
+                src,
+                ext,
+                cc_args,
+                extra_postargs,
+                pp_opts,
+                tracker,
+                object_cache,
+            )
+            if job.is_up_to_date():
+                log.debug("skipping %s (up-to-date)", src)
+                pool.finished(obj)
+            else:
+                pool.submit(job)
+
+        return objects
+
+    return compile
@@ -0,0 +1,199 @@
+"""
+    Support for launching compiles through ccache or sccache
+"""
+
+import json
+import os
+from os.path import abspath, basename, join, normpath, relpath, sep
+import shutil
+import subprocess
+from typing import Dict, List, Optional, Tuple
+
+_known = ("sccache", "ccache")
+
+
+class CompilerCache:
+    """
+        Wraps a distutils compiler with a compiler cache launcher
+
+        :param name: ccache or sccache
+        :param exe: Path to the launcher executable
+        :param basedir: Paths under this directory are rewritten to be
+                        relative so that different checkouts share hits
+        :param build_temp: Where per-compile statistics are written
+    """
+
+    def __init__(self, name: str, exe: str, basedir: str, build_temp: str):
+        self.name = name
+        self.exe = exe
+        self.basedir = abspath(basedir)
+        self.stats_log = join(abspath(build_temp), f"{name}-stats.log")
+
+        self._old_environ = {}
+        self._sccache_before = None
+
+    @classmethod
+    def find(
+        cls, which: str, basedir: str, build_temp: str
+    ) -> Optional["CompilerCache"]:
+        """
+            :param which: 'auto', 'ccache', 'sccache' or 'none'
+        """
+        if which in (None, "none"):
+            return None
+
+        if which == "auto":
+            candidates = _known
+        elif which in _known:
+            candidates = (which,)
+        else:
+            raise ValueError(
+                f"unknown compiler cache '{which}' (use auto, ccache, sccache or none)"
+            )
+
+        for name in candidates:
+            exe = shutil.which(name)
+            if exe:
+                return cls(name, exe, basedir, build_temp)
+
+        if which != "auto":
+            raise ValueError(f"compiler cache '{which}' was not found in PATH")
+        return None
+
+    def apply(self, compiler, extensions, pch: bool = False):
+        """
+            Launch each compile through the cache, and normalize paths of
+            the extensions so that hits are more likely
+        """
+        cmd = list(compiler.compiler_so)
+        if basename(cmd[0]) not in _known:
+            compiler.set_executable("compiler_so", [self.exe] + cmd)
+
+        for ext in extensions:
+            ext.include_dirs = [self._normalize(p) for p in ext.include_dirs]
+            ext.sources = [self._normalize(p) for p in ext.sources]
+
+        env = {}
+        if self.name == "ccache":
+            env["CCACHE_BASEDIR"] = self.basedir
+            env["CCACHE_STATSLOG"] = self.stats_log
+            # generated files are rewritten on each build, so the mtime
+            # is not a useful indicator of whether they changed
+            sloppiness = ["include_file_mtime", "include_file_ctime"]
+            if pch:
+                sloppiness += ["pch_defines", "time_macros"]
+            # keep whatever the user has configured
+            user = os.environ.get("CCACHE_SLOPPINESS", "")
+            user = [v.strip() for v in user.split(",") if v.strip()]
+            sloppiness = user + [v for v in sloppiness if v not in user]
+            env["CCACHE_SLOPPINESS"] = ",".join(sloppiness)
+
+            try:
+                os.unlink(self.stats_log)
+            except OSError:
+                pass
+        else:
+            self._sccache_before = self._sccache_stats()
+
+        for k, v in env.items():
+            self._old_environ[k] = os.environ.get(k)
+            os.environ[k] = v
+
+    def restore(self):
+        for k, v in self._old_environ.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+        self._old_environ = {}
+
+    def _normalize(self, path: str) -> str:
+        full = abspath(path)
+        if full == self.basedir or full.startswith(self.basedir + sep):
+            return normpath(relpath(full, os.getcwd()))
+        return path
+
+    #
+    # Statistics
+    #
+
+    def _ccache_stats(self) -> Dict[str, Tuple[int, int]]:
+        return _parse_ccache_stats_log(self.stats_log)
+
+    def _sccache_stats(self) -> Tuple[int, int]:
+        try:
+            output = subprocess.check_output(
+                [self.exe, "--show-stats", "--stats-format=json"],
+                stderr=subprocess.DEVNULL,
+                universal_newlines=True,
+            )
+            stats = json.loads(output)["stats"]
+            hits = sum(stats["cache_hits"]["counts"].values())
+            misses = sum(stats["cache_misses"]["counts"].values())
+        except (OSError, subprocess.CalledProcessError, ValueError, KeyError):
+            return (0, 0)
+        return (hits, misses)
+
+    def print_summary(self, extensions):
+        if self.name == "ccache":
+            stats = self._ccache_stats()
+            print("ccache summary:")
+            for ext in extensions:
+                hits = misses = 0
+                for src in ext.sources:
+                    h, m = stats.get(abspath(src), (0, 0))
+                    hits += h
+                    misses += m
+                _print_line(ext.name, hits, misses)
+        else:
+            # sccache only has server-wide statistics
+            if self._sccache_before is None:
+                return
+            hits, misses = self._sccache_stats()
+            print("sccache summary:")
+            _print_line(
+                "all extensions",
+                hits - self._sccache_before[0],
+                misses - self._sccache_before[1],
+            )
+
+
+def _print_line(name: str, hits: int, misses: int):
+    total = hits + misses
+    rate = (100.0 * hits / total) if total else 0.0
+    print("  %s: %d hits, %d misses (%.0f%%)" % (name, hits, misses, rate))
+
+
+def _parse_ccache_stats_log(fname: str) -> Dict[str, Tuple[int, int]]:
+    """
+        Returns (hits, misses) for each source in a ccache stats log, which
+        is a series of '# srcfile' lines each followed by the counters that
+        the compile incremented
+    """
+    records: List[Tuple[str, List[str]]] = []
+    try:
+        with open(fname) as fp:
+            for line in fp:
+                line = line.strip()
+                if line.startswith("#"):
+                    records.append((abspath(line[1:].strip()), []))
+                elif records and line:
+                    records[-1][1].append(line)
+    except OSError:
+        pass
+
+    # a compile increments several counters (direct_cache_miss and
+    # preprocessed_cache_hit, local_storage_*, ...), but is only one hit
+    # or miss. ccache 3 names them cache_hit_direct, etc.
+    stats: Dict[str, Tuple[int, int]] = {}
+    for src, counters in records:
+        hits, misses = stats.get(src, (0, 0))
+        if any(c.endswith("cache_hit") or c.startswith("cache_hit") for c in counters):
+            hits += 1
+        elif "cache_miss" in counters:
+            misses += 1
+        else:
+            # uncacheable, failed, etc
+            continue
+        stats[src] = (hits, misses)
+    return stats
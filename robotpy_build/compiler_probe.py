@@ -0,0 +1,197 @@
+"""
+    Determines what the compiler supports. Probing a flag requires compiling
+    a test program, so results are cached on disk keyed by the compiler
+    command, its version output and the flag.
+"""
+
+import concurrent.futures
+import hashlib
+import json
+import os
+from os.path import basename, join
+import shutil
+import subprocess
+import tempfile
+from typing import Dict, List, Optional
+
+import setuptools
+
+from .cache import get_user_cache_dir
+
+_launchers = {"ccache", "sccache"}
+
+
+# As of Python 3.6, CCompiler has a `has_flag` method.
+# cf http://bugs.python.org/issue26689
+def has_flag(compiler, flagname):
+    """Return a boolean indicating whether a flag name is supported on
+    the specified compiler.
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fname = join(tmpdir, "test.cpp")
+        with open(fname, "w") as fp:
+            fp.write("int main (int argc, char **argv) { return 0; }")
+        try:
+            compiler.compile([fname], output_dir=tmpdir, extra_postargs=[flagname])
+        except setuptools.distutils.errors.CompileError:
+            return False
+    return True
+
+
+def has_link_flag(compiler, flagname):
+    """Return a boolean indicating whether a flag is supported when
+    compiling and linking a program with the specified compiler. Flags
+    that only work together can be probed as a single space separated
+    string.
+    """
+    flags = flagname.split()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fname = join(tmpdir, "test.cpp")
+        with open(fname, "w") as fp:
+            fp.write("int main (int argc, char **argv) { return 0; }")
+        try:
+            objects = compiler.compile([fname], output_dir=tmpdir, extra_postargs=flags)
+            compiler.link_executable(
+                objects, "test", output_dir=tmpdir, extra_postargs=flags
+            )
+        except (
+            setuptools.distutils.errors.CompileError,
+            setuptools.distutils.errors.LinkError,
+        ):
+            return False
+    return True
+
+
+def get_compiler_command(compiler) -> Optional[List[str]]:
+    """
+        Returns the command used to compile sources, without any compiler
+        launchers such as ccache. Returns None for compilers that don't
+        expose their command (msvc)
+    """
+    cmd = getattr(compiler, "compiler_so", None)
+    if not cmd:
+        return None
+    cmd = list(cmd)
+    while cmd and basename(cmd[0]) in _launchers:
+        cmd.pop(0)
+    return cmd or None
+
+
+class CompilerProbe:
+    """
+        Caching wrapper around has_flag for a single compiler
+    """
+
+    cache_name = "compiler-probes.json"
+
+    def __init__(self, compiler, cache_dir: Optional[str] = None):
+        self.compiler = compiler
+        self._results: Dict[str, bool] = {}
+        self._version = None
+
+        self._key = None
+        self._cache_fname = None
+
+        cmd = get_compiler_command(compiler)
+        if cmd is not None:
+            exe = shutil.which(cmd[0]) or cmd[0]
+            linker = list(getattr(compiler, "linker_exe", None) or [])
+            ident = "\0".join(
+                [os.path.realpath(exe)] + cmd[1:] + linker + [self.version]
+            )
+            self._key = hashlib.sha256(ident.encode("utf-8")).hexdigest()
+
+            if cache_dir is None:
+                try:
+                    cache_dir = get_user_cache_dir()
+                except OSError:
+                    cache_dir = None
+            if cache_dir is not None:
+                self._cache_fname = join(cache_dir, self.cache_name)
+                self._results.update(self._load().get(self._key, {}))
+
+    @property
+    def version(self) -> str:
+        """Version output of the compiler executable"""
+        if self._version is None:
+            self._version = ""
+            cmd = get_compiler_command(self.compiler)
+            if cmd is not None:
+                try:
+                    self._version = subprocess.check_output(
+                        [cmd[0], "--version"],
+                        stderr=subprocess.STDOUT,
+                        universal_newlines=True,
+                    )
+                except (OSError, subprocess.CalledProcessError):
+                    pass
+        return self._version
+
+    @property
+    def identity(self) -> Optional[str]:
+        """Hash that identifies the compiler, or None if it is unknown"""
+        return self._key
+
+    @property
+    def is_clang(self) -> bool:
+        return "clang" in self.version
+
+    def has_flag(self, flag: str) -> bool:
+        return self.has_flags([flag])[flag]
+
+    def has_flags(self, flags: List[str]) -> Dict[str, bool]:
+        """
+            Returns whether each flag is supported. Flags that aren't
+            cached yet are probed concurrently.
+        """
+        return self._probe(flags, "", has_flag)
+
+    def has_link_flag(self, flag: str) -> bool:
+        return self.has_link_flags([flag])[flag]
+
+    def has_link_flags(self, flags: List[str]) -> Dict[str, bool]:
+        """
+            Returns whether each flag is supported when passed to both the
+            compiler and the linker
+        """
+        return self._probe(flags, "link:", has_link_flag)
+
+    def _probe(self, flags: List[str], pfx: str, fn) -> Dict[str, bool]:
+        missing = [f for f in flags if pfx + f not in self._results]
+        if missing:
+            # msvc initializes itself on first use, so don't race it
+            if len(missing) == 1 or self._key is None:
+                for flag in missing:
+                    self._results[pfx + flag] = fn(self.compiler, flag)
+            else:
+                with concurrent.futures.ThreadPoolExecutor(len(missing)) as pool:
+                    for flag, ok in zip(
+                        missing, pool.map(lambda f: fn(self.compiler, f), missing)
+                    ):
+                        self._results[pfx + flag] = ok
+            self._save()
+
+        return {f: self._results[pfx + f] for f in flags}
+
+    def _load(self) -> Dict[str, Dict[str, bool]]:
+        try:
+            with open(self._cache_fname) as fp:
+                data = json.load(fp)
+        except (OSError, ValueError):
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    def _save(self):
+        if self._cache_fname is None:
+            return
+
+        # other builds may be writing too, so merge and replace atomically
+        data = self._load()
+        data[self._key] = self._results
+        tmp_fname = f"{self._cache_fname}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_fname, "w") as fp:
+                json.dump(data, fp, indent=1, sort_keys=True)
+            os.replace(tmp_fname, self._cache_fname)
+        except OSError:
+            pass
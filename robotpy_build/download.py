@@ -1,34 +1,698 @@
 import atexit
+import concurrent.futures
+import hashlib
+import http.client
+import io
+import json
 import os
-from os.path import exists, join
+from os.path import abspath, basename, dirname, exists, getsize, join, splitext
 import posixpath
+import re
 import shutil
 import sys
 import tempfile
+import threading
+import time
+import warnings
+from typing import Dict, List, Optional, Tuple
 import zipfile
+import zlib
 
 
-from urllib.request import urlretrieve, urlcleanup
+from urllib.error import HTTPError
+from urllib.parse import urlsplit
+from urllib.request import url2pathname
 
+from .cache import hash_file
+from .download_cache import get_download_cache, link_file
+from .http_pool import get_http_pool
+from .unzip import extract_zip
 
-def _download(url):
+# only one thread downloads a given url into the cache
+_url_locks = {}
+_url_locks_lock = threading.Lock()
+
+_content_range_re = re.compile(r"bytes (\d+)-\d+/(\d+|\*)")
+
+
+def _url_lock(url) -> threading.Lock:
+    with _url_locks_lock:
+        return _url_locks.setdefault(url, threading.Lock())
+
+
+def _read_part_info(info_fname: str) -> dict:
+    try:
+        with open(info_fname) as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return {}
+
+
+def _discard_part(part: str):
+    for fname in (part, part + ".json"):
+        try:
+            os.unlink(fname)
+        except OSError:
+            pass
+
+
+class _Interrupted(IOError):
+    """The connection was lost part way through a download"""
+
+
+def _fetch(url: str, part: str, progress: bool):
+    """
+        Downloads url to part, which is kept if the download is interrupted.
+        If the server supports range requests the next download continues
+        from the end of it, as long as the file on the server hasn't changed.
+    """
+    info_fname = part + ".json"
+
+    info = _read_part_info(info_fname)
+    offset = getsize(part) if exists(part) else 0
+    validator = info.get("etag") or info.get("last_modified")
+
+    headers = {}
+    if offset and info.get("url") == url and validator:
+        headers["Range"] = f"bytes={offset}-"
+        # servers send the whole file if it has changed
+        headers["If-Range"] = validator
+    else:
+        offset = 0
+
+    try:
+        rsp = get_http_pool().request(url, headers)
+    except HTTPError as e:
+        if e.code != 416 or not offset:
+            raise
+        # the partial file is no good, start over
+        _discard_part(part)
+        return _fetch(url, part, progress)
+
+    with rsp:
+        total = None
+        resumed = False
+        if rsp.status == 206:
+            m = _content_range_re.match(rsp.headers.get("Content-Range", ""))
+            etag = rsp.headers.get("ETag")
+            if (
+                m
+                and int(m.group(1)) == offset
+                and m.group(2) == str(info.get("length"))
+                and (not info.get("etag") or etag == info["etag"])
+            ):
+                resumed = True
+                total = int(m.group(2))
+
+        if resumed:
+            print("Resuming download at %.1f MiB" % (offset / (1024 * 1024)))
+            mode = "ab"
+        else:
+            if rsp.status == 206:
+                # can't tell whether the partial file is the same file, and
+                # the response only contains part of it
+                rsp.close()
+                _discard_part(part)
+                return _fetch(url, part, progress)
+
+            offset = 0
+            mode = "wb"
+            length = rsp.headers.get("Content-Length")
+            total = int(length) if length is not None else None
+            with open(info_fname, "w") as fp:
+                json.dump(
+                    {
+                        "url": url,
+                        "etag": rsp.headers.get("ETag"),
+                        "last_modified": rsp.headers.get("Last-Modified"),
+                        "length": total,
+                    },
+                    fp,
+                )
+
+        size = offset
+        with open(part, mode) as fp:
+            while True:
+                try:
+                    chunk = rsp.read(64 * 1024)
+                except (OSError, http.client.HTTPException) as e:
+                    raise _Interrupted(f"{url}: {e or type(e).__name__}") from e
+                if not chunk:
+                    break
+                fp.write(chunk)
+                size += len(chunk)
+                if progress and total:
+                    sys.stdout.write("\r%02d%%" % int(size * 100 / total))
+                    sys.stdout.flush()
+
+    if progress:
+        sys.stdout.write("\n")
+
+    if total is not None and size != total:
+        # keep the partial file, the next attempt will resume it
+        raise _Interrupted(f"{url}: downloaded {size} bytes, expected {total}")
+
+
+def _hexdigests(fname: str, *algorithms: str) -> List[str]:
+    hashes = [hashlib.new(algorithm) for algorithm in algorithms]
+    hash_file(fname, *hashes)
+    return [h.hexdigest() for h in hashes]
+
+
+def _published_checksum(url: str) -> Optional[Tuple[str, str]]:
+    """
+        Returns (algorithm, hexdigest) from the checksum file that maven
+        repositories publish next to each artifact, or None
+    """
+    for algorithm in ("sha256", "sha1"):
+        try:
+            with get_http_pool().request(f"{url}.{algorithm}") as rsp:
+                text = rsp.read().decode("utf-8", "replace")
+        except HTTPError as e:
+            if e.code == 404:
+                continue
+            raise
+        # some tools write "<hash>  <filename>"
+        words = text.split()
+        if words:
+            return algorithm, words[0].lower()
+    return None
+
+
+def _verify(url: str, fname: str) -> str:
     """
-        Downloads a file to a temporary directory
+        Checks fname against the checksum published for url, and returns the
+        sha256 of fname
+    """
+    sha256, sha1 = _hexdigests(fname, "sha256", "sha1")
+    if get_http_pool().offline:
+        warnings.warn(f"{url} not verified, the checksum can't be downloaded offline")
+        return sha256
+
+    published = _published_checksum(url)
+    if published is None:
+        warnings.warn(f"no checksum published for {url}, not verified")
+    else:
+        _compare(url, published, sha256, sha1)
+    return sha256
+
+
+def _compare(name: str, published: Tuple[str, str], sha256: str, sha1: str):
+    algorithm, expected = published
+    actual = sha256 if algorithm == "sha256" else sha1
+    if actual != expected:
+        raise ValueError(
+            f"{name}: {algorithm} checksum mismatch (expected {expected}, got {actual})"
+        )
+
+
+def _verify_local(fname: str):
+    """
+        Checks a file in a local maven repository against the checksum file
+        that maven wrote next to it
+    """
+    for algorithm in ("sha256", "sha1"):
+        try:
+            with open(f"{fname}.{algorithm}") as fp:
+                words = fp.read().split()
+        except OSError:
+            continue
+        if words:
+            sha256, sha1 = _hexdigests(fname, "sha256", "sha1")
+            _compare(fname, (algorithm, words[0].lower()), sha256, sha1)
+            return
+
+    warnings.warn(f"no checksum file next to {fname}, not verified")
+
+
+def _download(url, fname, progress=True) -> str:
+    """
+        Downloads a file and verifies it, then moves it to fname. Returns
+        the sha256 of the file.
+
+        :param progress: Show the percent downloaded. When several files are
+                         downloaded at once, a line is printed when each
+                         download is complete instead.
     """
 
     print("Downloading", url)
 
-    def _reporthook(count, blocksize, totalsize):
-        percent = int(count * blocksize * 100 / totalsize)
-        sys.stdout.write("\r%02d%%" % percent)
-        sys.stdout.flush()
+    part = fname + ".part"
+    start = time.monotonic()
+    pool = get_http_pool()
+    # the pool retries requests that fail, this only retries downloads
+    # that stop part way through
+    for attempt in range(pool.retries + 1):
+        try:
+            _fetch(url, part, progress)
+            break
+        except _Interrupted as e:
+            if attempt == pool.retries:
+                raise
+            # the partial file is kept, so the next attempt resumes it
+            delay = pool.retry_delay(attempt)
+            print(f"{url}: download interrupted ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+    try:
+        sha256 = _verify(url, part)
+    except ValueError:
+        # corrupted, don't resume it
+        _discard_part(part)
+        raise
+
+    # fname either doesn't exist or is complete
+    os.replace(part, fname)
+    _discard_part(part)
 
-    filename, _ = urlretrieve(url, reporthook=_reporthook)
-    atexit.register(urlcleanup)
-    return filename
+    if not progress:
+        print(
+            "Downloaded %s (%.1f MiB in %.1fs)"
+            % (url, getsize(fname) / (1024 * 1024), time.monotonic() - start)
+        )
+    return sha256
 
 
-def download_and_extract_zip(url, to=None, cache=None):
+class ArtifactLock:
+    """
+        Records the url, size and sha256 of each artifact downloaded into a
+        cache directory, so that cached files can be checked on later builds
+        without network access
+    """
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    @classmethod
+    def for_cache(cls, cache: str) -> "ArtifactLock":
+        fname = abspath(join(cache, "rpybuild-lock.json"))
+        with cls._instances_lock:
+            lock = cls._instances.get(fname)
+            if lock is None:
+                lock = cls._instances[fname] = cls(fname)
+            return lock
+
+    def __init__(self, fname: str):
+        self.fname = fname
+        self.lock = threading.Lock()
+        try:
+            with open(fname) as fp:
+                self.artifacts = json.load(fp)["artifacts"]
+        except (OSError, ValueError, KeyError):
+            self.artifacts = {}
+
+    def is_recorded(self, url: str) -> bool:
+        with self.lock:
+            return url in self.artifacts
+
+    def sha256(self, url: str) -> Optional[str]:
+        with self.lock:
+            entry = self.artifacts.get(url)
+        return entry["sha256"] if entry else None
+
+    def is_valid(self, url: str, fname: str) -> bool:
+        """Returns True if fname is the artifact that was downloaded from url"""
+        with self.lock:
+            entry = self.artifacts.get(url)
+        if not entry:
+            return False
+        try:
+            st = os.stat(fname)
+        except OSError:
+            return False
+        if st.st_size != entry["size"]:
+            return False
+        if st.st_mtime_ns == entry.get("mtime_ns"):
+            return True
+
+        # modified since it was recorded, check the contents
+        if _hexdigests(fname, "sha256")[0] != entry["sha256"]:
+            return False
+        self.record(url, fname, entry["sha256"])
+        return True
+
+    def record(self, url: str, fname: str, sha256: str):
+        st = os.stat(fname)
+        with self.lock:
+            self.artifacts[url] = {
+                "file": basename(fname),
+                "sha256": sha256,
+                "size": st.st_size,
+                "mtime_ns": st.st_mtime_ns,
+            }
+            tmp = f"{self.fname}.{os.getpid()}.tmp"
+            with open(tmp, "w") as fp:
+                json.dump({"artifacts": self.artifacts}, fp, indent=2, sort_keys=True)
+            os.replace(tmp, self.fname)
+
+
+def _cached_download(url: str, cache: str, progress: bool) -> str:
+    """
+        Downloads url unless it is already cached, and returns the name of
+        the cached file. Partial downloads are kept in cache, so that they
+        can be resumed.
+    """
+    os.makedirs(cache, exist_ok=True)
+    local_fname = join(cache, posixpath.basename(url))
+    lock = ArtifactLock.for_cache(cache)
+    shared = get_download_cache()
+
+    with _url_lock(url):
+        if lock.is_valid(url, local_fname):
+            if shared is None:
+                return local_fname
+            # downloaded before the shared cache was used
+            sha256 = lock.sha256(url)
+            with shared.lock(url):
+                fname = shared.store(url, local_fname, sha256)
+            lock.record(url, fname, sha256)
+            return fname
+
+        sha256 = None
+        if lock.is_recorded(url) and exists(local_fname):
+            print("Discarding corrupted", local_fname)
+            os.unlink(local_fname)
+        elif exists(local_fname):
+            # downloaded before the lockfile existed, check it against the
+            # published checksum instead of downloading it again
+            try:
+                sha256 = _verify(url, local_fname)
+            except ValueError:
+                print("Discarding corrupted", local_fname)
+                os.unlink(local_fname)
+
+        if shared is None:
+            if sha256 is None:
+                sha256 = _download(url, local_fname, progress)
+            lock.record(url, local_fname, sha256)
+            return local_fname
+
+        with shared.lock(url):
+            # another project or build may have downloaded it already
+            fname = shared.lookup(url, lock.sha256(url))
+            if fname is None:
+                if sha256 is None:
+                    sha256 = _download(url, local_fname, progress)
+                fname = shared.store(url, local_fname, sha256)
+            elif exists(local_fname):
+                os.unlink(local_fname)
+
+        # shared files are named by their hash
+        lock.record(url, fname, splitext(basename(fname))[0])
+        return fname
+
+
+def _local_file(url: str) -> Optional[str]:
+    """Returns the path of a file:// url, or None for other urls"""
+    parts = urlsplit(url)
+    if parts.scheme != "file":
+        return None
+    fname = url2pathname(parts.path)
+    if not exists(fname):
+        raise FileNotFoundError(f"{url} does not exist")
+    return fname
+
+
+def _find_cached(url: str, cache: str) -> Optional[str]:
+    """Returns the cached file for url without downloading it, or None"""
+    lock = ArtifactLock.for_cache(cache)
+    local_fname = join(cache, posixpath.basename(url))
+    if lock.is_valid(url, local_fname):
+        return local_fname
+    shared = get_download_cache()
+    if shared:
+        return shared.lookup(url, lock.sha256(url))
+    return None
+
+
+class _RangeError(Exception):
+    pass
+
+
+class _HttpRangeFile(io.RawIOBase):
+    """
+        Read-only file that reads a remote file with HTTP range requests, so
+        that zipfile can read parts of a remote zipfile. Data is fetched in
+        blocks and kept in memory.
+
+        Raises _RangeError if the server doesn't support range requests, or
+        the file changes while it is being read.
+    """
+
+    min_fetch = 64 * 1024
+
+    def __init__(self, url: str):
+        super().__init__()
+        self.url = url
+        self.validator = None
+        self.segments: List[Tuple[int, bytes]] = []
+        self.pos = 0
+        self.fetched = 0
+
+        #: checksums of the whole file reported by the server (Artifactory
+        #: and Nexus send these)
+        self.checksums: Dict[str, str] = {}
+
+        # the end of central directory record (and the central directory
+        # itself, for small zipfiles) is at the end of the file
+        start, self.size, data = self._get(f"bytes=-{self.min_fetch + 22}")
+        self.segments.append((start, data))
+
+    def _get(self, rng: str) -> Tuple[int, int, bytes]:
+        headers = {"Range": rng}
+        if self.validator:
+            headers["If-Range"] = self.validator
+        try:
+            rsp = get_http_pool().request(self.url, headers)
+        except HTTPError as e:
+            if e.code == 416:
+                raise _RangeError(str(e))
+            raise
+
+        with rsp:
+            if rsp.status != 206:
+                raise _RangeError(f"server responded with {rsp.status}")
+            m = _content_range_re.match(rsp.headers.get("Content-Range", ""))
+            if not m or m.group(2) == "*":
+                raise _RangeError("invalid Content-Range")
+            if self.validator is None:
+                self.validator = rsp.headers.get("ETag") or rsp.headers.get(
+                    "Last-Modified"
+                )
+                for algorithm in ("sha256", "sha1"):
+                    checksum = rsp.headers.get(f"X-Checksum-{algorithm.title()}")
+                    if checksum:
+                        self.checksums[algorithm] = checksum.strip().lower()
+            data = rsp.read()
+
+        self.fetched += len(data)
+        return int(m.group(1)), int(m.group(2)), data
+
+    def _read_at(self, pos: int, n: int) -> bytes:
+        for start, data in self.segments:
+            if start <= pos and pos + n <= start + len(data):
+                return data[pos - start : pos - start + n]
+
+        end = min(pos + max(n, self.min_fetch), self.size) - 1
+        start, _, data = self._get(f"bytes={pos}-{end}")
+        self.segments.append((start, data))
+        return data[pos - start : pos - start + n]
+
+    def prefetch(self, pos: int, n: int):
+        """Fetches a range that is about to be read with one request"""
+        n = min(n, self.size - pos)
+        if n > 0:
+            self._read_at(pos, n)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.pos = offset
+        elif whence == io.SEEK_CUR:
+            self.pos += offset
+        else:
+            self.pos = self.size + offset
+        return self.pos
+
+    def readinto(self, b):
+        n = min(len(b), self.size - self.pos)
+        if n <= 0:
+            return 0
+        data = self._read_at(self.pos, n)
+        b[: len(data)] = data
+        self.pos += len(data)
+        return len(data)
+
+
+def _member_url(url: str, src: str) -> str:
+    # identifies a file inside a zipfile in the lock file and shared cache
+    return f"{url}!/{src}"
+
+
+def _member_fname(url: str, src: str, cache: str) -> str:
+    name = splitext(posixpath.basename(url))[0]
+    return join(cache, name, *src.split("/"))
+
+
+def _find_cached_members(
+    url: str, to: Dict[str, str], cache: str
+) -> Optional[Dict[str, str]]:
+    """
+        Returns {src: cached file} if all of the files that are needed from
+        a remote zipfile were fetched by an earlier build, or None
+    """
+    lock = ArtifactLock.for_cache(cache)
+    shared = get_download_cache()
+    found = {}
+    for src in to:
+        member_url = _member_url(url, src)
+        fname = _member_fname(url, src, cache)
+        if not lock.is_valid(member_url, fname):
+            fname = None
+            if shared:
+                fname = shared.lookup(member_url, lock.sha256(member_url))
+            if fname is None:
+                return None
+        found[src] = fname
+    return found
+
+
+def _store_member(url: str, src: str, part: str, sha256: str, cache: str) -> str:
+    """Moves a file fetched from a remote zipfile into the cache"""
+    member_url = _member_url(url, src)
+    shared = get_download_cache()
+    if shared:
+        with shared.lock(member_url):
+            fname = shared.store(member_url, part, sha256)
+    else:
+        fname = _member_fname(url, src, cache)
+        os.replace(part, fname)
+    ArtifactLock.for_cache(cache).record(member_url, fname, sha256)
+    return fname
+
+
+def _check_remote(url: str, checksums: Dict[str, str]) -> bool:
+    """
+        Checks the checksum that the server reports for a remote zipfile
+        against the checksum published for it. Returns False if they can't
+        be compared, and the zipfile should be downloaded and verified
+        instead.
+    """
+    published = _published_checksum(url)
+    if published is None:
+        warnings.warn(f"no checksum published for {url}, not verified")
+        return True
+
+    algorithm, expected = published
+    actual = checksums.get(algorithm)
+    if actual is None:
+        return False
+    if actual != expected:
+        raise ValueError(
+            f"{url}: {algorithm} checksum mismatch (expected {expected}, got {actual})"
+        )
+    return True
+
+
+def _extract_remote_members(
+    url: str, to: Dict[str, str], cache: Optional[str] = None
+) -> bool:
+    """
+        Extracts some files from a remote zipfile without downloading all of
+        it: reads the central directory, then fetches just the requested
+        files. Returns False if this isn't possible or isn't worth it, and
+        the zipfile should be downloaded instead.
+
+        The checksum that the server reports for the zipfile must match the
+        published checksum, and zipfile checks the CRC of each extracted
+        file. The fetched files are recorded in the lock file and stored in
+        the cache, so that later builds don't fetch them again.
+    """
+    written = []
+    try:
+        rfp = _HttpRangeFile(url)
+        with zipfile.ZipFile(rfp) as z:
+            infos = [z.getinfo(src) for src in to]
+            needed = sum(info.compress_size for info in infos)
+            # downloading everything puts it in the cache for next time
+            if needed > rfp.size / 2:
+                return False
+            if not _check_remote(url, rfp.checksums):
+                return False
+
+            print(
+                "Fetching %d files (%.1f MiB of %.1f MiB) from %s"
+                % (len(infos), needed / (1024 * 1024), rfp.size / (1024 * 1024), url)
+            )
+            for info, (src, dst) in zip(infos, to.items()):
+                # local header, which may have a different extra field
+                header = 30 + len(info.filename.encode("utf-8")) + len(info.extra)
+                rfp.prefetch(info.header_offset, header + info.compress_size + 1024)
+
+                out = dst
+                if cache:
+                    out = _member_fname(url, src, cache) + ".part"
+                    os.makedirs(dirname(out), exist_ok=True)
+                written.append(out)
+
+                h = hashlib.sha256()
+                with z.open(info) as zfp, open(out, "wb") as fp:
+                    for chunk in iter(lambda: zfp.read(1024 * 1024), b""):
+                        h.update(chunk)
+                        fp.write(chunk)
+
+                if cache:
+                    fname = _store_member(url, src, out, h.hexdigest(), cache)
+                    written.append(dst)
+                    link_file(fname, dst, hardlink=False)
+    except (
+        _RangeError,
+        zipfile.BadZipFile,
+        zlib.error,
+        KeyError,
+        ValueError,
+        OSError,
+        http.client.HTTPException,
+    ) as e:
+        # don't leave partial files behind
+        for fname in written:
+            try:
+                os.unlink(fname)
+            except OSError:
+                pass
+        if not isinstance(e, _RangeError):
+            print(f"{url}: could not fetch just the needed files ({e})")
+        return False
+
+    return True
+
+
+def _extract_members(url: str, to: Dict[str, str], cache: Optional[str]) -> bool:
+    """
+        Extracts some files from a zipfile that hasn't been downloaded,
+        from the files cached by an earlier build or from the remote
+        zipfile. Returns False if the zipfile should be downloaded instead.
+    """
+    with _url_lock(url):
+        if cache:
+            if _find_cached(url, cache) is not None:
+                return False
+            members = _find_cached_members(url, to, cache)
+            if members is not None:
+                for src, dst in to.items():
+                    link_file(members[src], dst, hardlink=False)
+                return True
+        return _extract_remote_members(url, to, cache)
+
+
+def download_and_extract_zip(url, to=None, cache=None, progress=True):
     """
         Utility method intended to be useful for downloading/extracting
         third party source zipfiles
@@ -42,23 +706,64 @@ def download_and_extract_zip(url, to=None, cache=None):
         to = tod.name
         atexit.register(tod.cleanup)
 
-    zip_fname = None
-    if cache:
-        os.makedirs(cache, exist_ok=True)
-        cache_fname = join(cache, posixpath.basename(url))
-        if not exists(cache_fname):
-            zip_fname = _download(url)
-            shutil.copy(zip_fname, cache_fname)
-        zip_fname = cache_fname
+    local_fname = _local_file(url)
+    if local_fname is not None:
+        # already on this machine, no need to copy it
+        print("Using", local_fname)
+        _verify_local(local_fname)
+        zip_fname = local_fname
+    elif isinstance(to, dict) and _extract_members(url, to, cache):
+        # only a few files were needed, and just those were fetched
+        return
+    elif cache:
+        zip_fname = _cached_download(url, cache, progress)
+        shared = get_download_cache()
+        if shared and shared.owns(zip_fname):
+            shared.materialize(zip_fname, to)
+            if isinstance(to, str):
+                return to
+            return
     else:
-        zip_fname = _download(url)
+        tmpdir = tempfile.TemporaryDirectory()
+        atexit.register(tmpdir.cleanup)
+        zip_fname = join(tmpdir.name, posixpath.basename(url))
+        _download(url, zip_fname, progress)
+
+    if isinstance(to, str):
+        extract_zip(zip_fname, to)
+        return to
 
     with zipfile.ZipFile(zip_fname) as z:
-        if isinstance(to, str):
-            z.extractall(to)
-            return to
-        else:
-            for src, dst in to.items():
-                with z.open(src, "r") as zfp:
-                    with open(dst, "wb") as fp:
-                        shutil.copyfileobj(zfp, fp)
+        # raises KeyError before anything is written
+        infos = {src: z.getinfo(src) for src in to}
+        for src, dst in to.items():
+            with z.open(infos[src], "r") as zfp:
+                with open(dst, "wb") as fp:
+                    shutil.copyfileobj(zfp, fp)
+
+
+def download_and_extract_zips(
+    zips: List[Tuple[str, object]],
+    cache: Optional[str] = None,
+    executor: Optional[concurrent.futures.Executor] = None,
+):
+    """
+        Downloads several zipfiles at once, and extracts each one as soon as
+        it has been downloaded
+
+        :param zips: list of (url, to), see download_and_extract_zip
+        :param executor: Runs the downloads, so that the number of downloads
+                         can be limited across several calls. If not
+                         specified, the zipfiles are downloaded one at a time.
+    """
+    if executor is None:
+        for url, to in zips:
+            download_and_extract_zip(url, to, cache)
+        return
+
+    futures = [
+        executor.submit(download_and_extract_zip, url, to, cache, False)
+        for url, to in zips
+    ]
+    for future in futures:
+        future.result()
@@ -0,0 +1,292 @@
+"""
+    Cache of downloaded artifacts, shared by every project and checkout
+    built by the same user, so that each artifact is only downloaded and
+    stored once.
+
+    Files are stored by the sha256 of their contents, and an index maps the
+    url of each artifact to the hash of its contents. Parallel builds use
+    file locks so that only one of them downloads a given url. The cache is
+    limited in size, and the least recently used files are removed first.
+
+    Zipfiles are also extracted once into the cache, and their contents are
+    hardlinked into each project instead of being extracted again.
+"""
+
+import errno
+import glob
+import hashlib
+import json
+import os
+from os.path import basename, dirname, exists, getsize, join, splitext
+import posixpath
+import shutil
+import threading
+from typing import Dict, Optional, Union
+import zipfile
+
+from .cache import (
+    default_max_size,
+    evict_lru,
+    file_lock,
+    get_user_cache_dir,
+    list_files,
+    store_file,
+)
+from .unzip import extract_zip
+
+
+def _url_key(url: str) -> str:
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+
+# linux ioctl that makes dst share the blocks of src (btrfs, xfs)
+_FICLONE = 0x40049409
+
+
+def _reflink(src: str, dst: str):
+    import fcntl
+
+    with open(src, "rb") as sfp, open(dst, "wb") as dfp:
+        try:
+            fcntl.ioctl(dfp.fileno(), _FICLONE, sfp.fileno())
+        except OSError:
+            dfp.close()
+            os.unlink(dst)
+            raise
+
+
+def link_file(src: str, dst: str, hardlink: bool = True):
+    """
+        Makes dst have the same contents as src without copying them if
+        possible: hardlinks, then reflinks, then falls back to copying
+
+        :param hardlink: If False, dst may be modified in place later, so it
+                         must not share its contents with src
+    """
+    try:
+        os.unlink(dst)
+    except FileNotFoundError:
+        pass
+
+    if hardlink:
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+
+    if hasattr(os, "uname") and os.uname().sysname == "Linux":
+        try:
+            _reflink(src, dst)
+            return
+        except OSError:
+            pass
+
+    shutil.copyfile(src, dst)
+
+
+def link_tree(src: str, dst: str):
+    """Recreates the files in src under dst with link_file"""
+    for dirpath, dirnames, files in os.walk(src):
+        dstpath = join(dst, os.path.relpath(dirpath, src))
+        os.makedirs(dstpath, exist_ok=True)
+        for fname in files:
+            link_file(join(dirpath, fname), join(dstpath, fname))
+
+
+class DownloadCache:
+    """
+        :param path: Cache directory, defaults to the user cache directory
+        :param max_size: Size limit in bytes
+    """
+
+    def __init__(
+        self, path: Optional[str] = None, max_size: int = default_max_size * 1024 * 1024
+    ):
+        self.path = path or get_user_cache_dir("downloads")
+        self.max_size = max_size
+
+    def _file(self, sha256: str, url: str) -> str:
+        ext = splitext(posixpath.basename(url))[1]
+        return join(self.path, "files", sha256[:2], sha256 + ext)
+
+    def _index(self, url: str) -> str:
+        key = _url_key(url)
+        return join(self.path, "urls", key[:2], key + ".json")
+
+    def _lock(self, key: str):
+        return file_lock(join(self.path, "locks", key[:2], key + ".lock"))
+
+    def lock(self, url: str):
+        """Context manager that serializes downloads of url across processes"""
+        return self._lock(_url_key(url))
+
+    def owns(self, fname: str) -> bool:
+        return os.path.abspath(fname).startswith(
+            os.path.abspath(join(self.path, "files")) + os.sep
+        )
+
+    def materialize(self, fname: str, to: Union[str, Dict[str, str]]):
+        """
+            Extracts the contents of the cached zipfile fname to a directory,
+            or extracts the files in a {member: dst} dict. The zipfile is only
+            extracted once, and its contents are linked to the destination.
+
+            Directories are hardlinked, so their files share their contents
+            with the cache and must be replaced instead of modified in place.
+            Individual files (libraries, which are patched on macOS) are only
+            reflinked or copied.
+        """
+        sha256 = splitext(basename(fname))[0]
+        root = join(self.path, "extracted", sha256[:2], sha256)
+        stamp = root + ".json"
+
+        # eviction removes trees with the same lock held
+        with self._lock(sha256):
+            if exists(stamp):
+                # mtime is used to find the least recently used entries
+                os.utime(stamp)
+            else:
+                # left over from an interrupted extraction
+                shutil.rmtree(root, ignore_errors=True)
+                tmp = f"{root}.{os.getpid()}.{threading.get_ident()}.tmp"
+                shutil.rmtree(tmp, ignore_errors=True)
+                extract_zip(fname, tmp)
+                with zipfile.ZipFile(fname) as z:
+                    size = sum(info.file_size for info in z.infolist())
+                os.replace(tmp, root)
+                with open(stamp, "w") as fp:
+                    json.dump({"size": size}, fp)
+
+            if isinstance(to, str):
+                link_tree(root, to)
+            else:
+                paths = {src: join(root, *src.split("/")) for src in to}
+                for src, path in paths.items():
+                    if not exists(path):
+                        raise KeyError(f"There is no item named '{src}' in the archive")
+                for src, dst in to.items():
+                    link_file(paths[src], dst, hardlink=False)
+
+    def lookup(self, url: str, sha256: Optional[str] = None) -> Optional[str]:
+        """
+            Returns the cached file for url, or None
+
+            :param sha256: Expected hash of the file, if known. Otherwise the
+                           hash recorded in the index is used.
+        """
+        size = None
+        try:
+            with open(self._index(url)) as fp:
+                entry = json.load(fp)
+            if sha256 is None or sha256 == entry["sha256"]:
+                sha256 = entry["sha256"]
+                size = entry["size"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+        if sha256 is None:
+            return None
+
+        fname = self._file(sha256, url)
+        try:
+            if size is not None and getsize(fname) != size:
+                return None
+            # mtime is used to find the least recently used entries
+            os.utime(fname)
+        except OSError:
+            return None
+        return fname
+
+    def store(self, url: str, fname: str, sha256: str) -> str:
+        """
+            Moves a downloaded and verified file into the cache, and returns
+            its new name
+        """
+        dst = self._file(sha256, url)
+        if exists(dst):
+            os.unlink(fname)
+        else:
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            try:
+                os.replace(fname, dst)
+            except OSError:
+                # different filesystem
+                store_file(fname, dst)
+                os.unlink(fname)
+
+        index = self._index(url)
+        os.makedirs(os.path.dirname(index), exist_ok=True)
+        tmp = f"{index}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w") as fp:
+            json.dump({"url": url, "sha256": sha256, "size": getsize(dst)}, fp)
+        os.replace(tmp, index)
+        return dst
+
+    def evict(self):
+        """
+            Removes the least recently used downloads and extracted trees
+            until the cache is smaller than max_size. Files that were linked
+            into projects stay valid.
+        """
+        entries = list_files(join(self.path, "files"))
+
+        # only stamps (extracted/xx/<sha256>.json), not files in the trees
+        stamps = glob.glob(join(self.path, "extracted", "??", "*.json"))
+        for stamp in stamps:
+            try:
+                mtime = os.stat(stamp).st_mtime
+                with open(stamp) as fp:
+                    size = json.load(fp)["size"]
+            except (OSError, ValueError, KeyError, TypeError):
+                continue
+            entries.append((mtime, size, stamp))
+
+        stamps = set(stamps)
+
+        def _remove(path: str) -> bool:
+            if path not in stamps:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    return False
+                return True
+
+            # a tree is removed along with its stamp, while nothing else
+            # is extracting or linking it
+            sha256 = splitext(basename(path))[0]
+            with self._lock(sha256):
+                try:
+                    os.unlink(path)
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        return False
+                shutil.rmtree(join(dirname(path), sha256), ignore_errors=True)
+            return True
+
+        evict_lru(self.path, self.max_size, entries, _remove)
+
+
+_download_cache = None
+_download_cache_lock = threading.Lock()
+
+
+def get_download_cache() -> Optional[DownloadCache]:
+    """
+        Returns the shared download cache, or None if it is disabled by
+        setting RPYBUILD_DL_CACHE=0 or the cache directory isn't writable
+    """
+    global _download_cache
+    with _download_cache_lock:
+        if _download_cache is None:
+            if os.environ.get("RPYBUILD_DL_CACHE") == "0":
+                _download_cache = False
+            else:
+                max_size = int(
+                    os.environ.get("RPYBUILD_DL_CACHE_SIZE", default_max_size)
+                )
+                try:
+                    _download_cache = DownloadCache(max_size=max_size * 1024 * 1024)
+                except OSError:
+                    _download_cache = False
+        return _download_cache or None
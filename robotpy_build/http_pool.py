@@ -0,0 +1,269 @@
+"""
+    Persistent HTTP connections for downloads. Artifacts usually all come
+    from the same maven repository, so connections are kept open and reused
+    instead of paying for a new TCP and TLS handshake for every file.
+"""
+
+import http.client
+import os
+import ssl
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from urllib.error import HTTPError
+from urllib.parse import urljoin, urlsplit
+from urllib.request import Request, getproxies, proxy_bypass, urlopen
+
+#: Default timeout for connecting and for each read (seconds)
+default_timeout = 30.0
+
+#: Default number of times that a failed request is retried
+default_retries = 3
+
+_retry_statuses = {429, 500, 502, 503, 504}
+_redirect_statuses = {301, 302, 303, 307, 308}
+
+_user_agent = "robotpy-build"
+
+_ConnKey = Tuple[str, str, Optional[int]]
+
+
+class OfflineError(Exception):
+    """Raised instead of making a request when offline"""
+
+
+class PooledResponse:
+    """
+        Response returned by HttpPool.request. Closing it returns the
+        connection to the pool if the response was read completely.
+    """
+
+    def __init__(self, url: str, rsp, pool=None, key=None, conn=None):
+        self.url = url
+        self.status = rsp.status
+        self.reason = rsp.reason
+        self.headers = rsp.headers
+        self._rsp = rsp
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+
+    def read(self, n: int = -1) -> bytes:
+        if n < 0:
+            return self._rsp.read()
+        return self._rsp.read(n)
+
+    def close(self):
+        rsp, self._rsp = self._rsp, None
+        if rsp is None:
+            return
+
+        if self._conn is None:
+            rsp.close()
+            return
+
+        # small bodies (errors, checksums) are cheaper to read than a new
+        # connection
+        if not rsp.isclosed() and rsp.length is not None and rsp.length <= 65536:
+            try:
+                rsp.read()
+            except (OSError, http.client.HTTPException):
+                pass
+
+        if rsp.isclosed() and not rsp.will_close:
+            self._pool._release(self._key, self._conn)
+        else:
+            rsp.close()
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class HttpPool:
+    """
+        Makes GET requests over persistent connections, with timeouts and
+        retries. Safe to use from several threads; each connection is only
+        used by one request at a time.
+
+        Requests that fail to connect, time out or get a 429/5xx response are
+        retried with exponential backoff. Other error responses raise
+        urllib.error.HTTPError, like urlopen. Requests that go through a proxy
+        (or aren't http/https) are made with urlopen instead.
+
+        When offline is set, every request raises OfflineError.
+
+        :param timeout: Timeout for connecting and for each read (seconds)
+        :param retries: Number of times that a failed request is retried
+        :param backoff: Delay before the first retry (seconds), doubled for
+                        each retry after that
+        :param offline: Don't make any requests
+    """
+
+    max_redirects = 5
+    max_idle_per_host = 8
+
+    def __init__(
+        self,
+        timeout: float = default_timeout,
+        retries: int = default_retries,
+        backoff: float = 1.0,
+        offline: bool = False,
+    ):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.offline = offline
+
+        self._lock = threading.Lock()
+        self._idle: Dict[_ConnKey, List[http.client.HTTPConnection]] = {}
+        self._ssl_context = None
+
+    def request(self, url: str, headers: Optional[Dict[str, str]] = None):
+        """Returns a PooledResponse for a successful or partial response"""
+        if self.offline:
+            raise OfflineError(
+                f"{url} is needed, but it isn't in the download cache or a local"
+                " maven repository (see RPYBUILD_MAVEN_MIRRORS), and downloads"
+                " are disabled (--offline or RPYBUILD_OFFLINE)"
+            )
+
+        headers = dict(headers or {})
+        headers.setdefault("User-Agent", _user_agent)
+
+        for _ in range(self.max_redirects + 1):
+            rsp = self._request_with_retries(url, headers)
+            location = rsp.headers.get("Location")
+            if rsp.status in _redirect_statuses and location:
+                rsp.close()
+                url = urljoin(url, location)
+                continue
+
+            if rsp.status >= 400:
+                rsp.close()
+                raise HTTPError(url, rsp.status, rsp.reason, rsp.headers, None)
+            return rsp
+
+        raise HTTPError(url, rsp.status, "too many redirects", rsp.headers, None)
+
+    def retry_delay(self, attempt: int) -> float:
+        return self.backoff * (2 ** attempt)
+
+    def _request_with_retries(self, url: str, headers: Dict[str, str]):
+        for attempt in range(self.retries + 1):
+            last = attempt == self.retries
+            delay = self.retry_delay(attempt)
+            try:
+                rsp = self._request(url, headers)
+            except HTTPError as e:
+                # only from urlopen
+                if e.code not in _retry_statuses or last:
+                    raise
+                error = f"{e.code} {e.reason}"
+            except (OSError, http.client.HTTPException) as e:
+                if last:
+                    raise
+                error = str(e) or type(e).__name__
+            else:
+                if rsp.status not in _retry_statuses or last:
+                    return rsp
+                error = f"{rsp.status} {rsp.reason}"
+                retry_after = rsp.headers.get("Retry-After", "")
+                if retry_after.isdigit():
+                    delay = min(float(retry_after), 60.0)
+                rsp.close()
+
+            print(f"{url}: {error}, retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+    def _request(self, url: str, headers: Dict[str, str]) -> PooledResponse:
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or self._use_proxy(parts):
+            rsp = urlopen(Request(url, headers=headers), timeout=self.timeout)
+            return PooledResponse(url, rsp)
+
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+
+        conn, reused = self._acquire(key)
+        try:
+            rsp = self._send(conn, path, headers)
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            if not reused:
+                raise
+            # the server closed the idle connection, which isn't an error
+            conn = self._connect(key)
+            try:
+                rsp = self._send(conn, path, headers)
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                raise
+
+        return PooledResponse(url, rsp, self, key, conn)
+
+    def _send(self, conn, path: str, headers: Dict[str, str]):
+        conn.request("GET", path, headers=headers)
+        return conn.getresponse()
+
+    def _use_proxy(self, parts) -> bool:
+        return parts.scheme in getproxies() and not proxy_bypass(parts.hostname)
+
+    def _acquire(self, key: _ConnKey) -> Tuple[http.client.HTTPConnection, bool]:
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+        return self._connect(key), False
+
+    def _release(self, key: _ConnKey, conn: http.client.HTTPConnection):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def _connect(self, key: _ConnKey) -> http.client.HTTPConnection:
+        scheme, host, port = key
+        if scheme == "https":
+            with self._lock:
+                if self._ssl_context is None:
+                    self._ssl_context = ssl.create_default_context()
+            return http.client.HTTPSConnection(
+                host, port, timeout=self.timeout, context=self._ssl_context
+            )
+        return http.client.HTTPConnection(host, port, timeout=self.timeout)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+
+_http_pool = None
+_http_pool_lock = threading.Lock()
+
+
+def get_http_pool() -> HttpPool:
+    """
+        Returns the pool shared by all downloads. The timeout and number of
+        retries can be set with RPYBUILD_DL_TIMEOUT (seconds) and
+        RPYBUILD_DL_RETRIES, and RPYBUILD_OFFLINE=1 disables downloads.
+    """
+    global _http_pool
+    with _http_pool_lock:
+        if _http_pool is None:
+            _http_pool = HttpPool(
+                timeout=float(os.environ.get("RPYBUILD_DL_TIMEOUT", default_timeout)),
+                retries=int(os.environ.get("RPYBUILD_DL_RETRIES", default_retries)),
+                offline=os.environ.get("RPYBUILD_OFFLINE") == "1",
+            )
+        return _http_pool
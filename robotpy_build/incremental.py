@@ -0,0 +1,219 @@
+"""
+    Object level incremental builds. Each object is compiled with -MMD so
+    the compiler writes the headers that it depends on, and the command
+    used to compile each object is recorded so that objects are rebuilt
+    when their flags change.
+"""
+
+import hashlib
+import json
+import os
+from os.path import join, splitext
+import threading
+from typing import Dict, List, Optional
+
+from distutils.dep_util import newer_group
+
+from .compiler_probe import get_compiler_command
+
+
+def depfile_for(obj: str) -> str:
+    # gcc/clang replace the suffix of the -o argument
+    return splitext(obj)[0] + ".d"
+
+
+def parse_depfile(fname: str) -> Optional[List[str]]:
+    """
+        Returns the prerequisites listed in a make-style dependency file,
+        or None if it cannot be read
+    """
+    try:
+        with open(fname) as fp:
+            contents = fp.read()
+    except OSError:
+        return None
+
+    # only the first rule matters, -MP adds phony rules after it
+    contents = contents.replace("\\\n", " ")
+    rule = contents.split("\n", 1)[0]
+    _, sep, prereqs = rule.partition(": ")
+    if not sep:
+        return None
+
+    deps = []
+    current = ""
+    escaped = False
+    for c in prereqs:
+        if escaped:
+            current += c
+            escaped = False
+        elif c == "\\":
+            escaped = True
+        elif c.isspace():
+            if current:
+                deps.append(current)
+                current = ""
+        else:
+            current += c
+    if current:
+        deps.append(current)
+    return deps
+
+
+class ObjectDb:
+    """
+        Information about each compiled object that persists between builds,
+        stored in the build directory
+    """
+
+    fname = "rpybuild-objects.json"
+
+    def __init__(self, build_temp: str):
+        self.path = join(build_temp, self.fname)
+        self.lock = threading.Lock()
+        try:
+            with open(self.path) as fp:
+                self.objects: Dict[str, Dict] = json.load(fp)
+        except (OSError, ValueError):
+            self.objects = {}
+
+    def get(self, obj: str) -> Dict:
+        with self.lock:
+            return dict(self.objects.get(obj, {}))
+
+    def update(self, obj: str, **kwargs):
+        with self.lock:
+            self.objects.setdefault(obj, {}).update(kwargs)
+
+    def discard(self, obj: str, key: str):
+        with self.lock:
+            self.objects.get(obj, {}).pop(key, None)
+
+    def save(self):
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w") as fp:
+                json.dump(self.objects, fp, indent=1, sort_keys=True)
+            os.replace(tmp, self.path)
+
+
+class DependencyTracker:
+    """
+        Decides which objects need to be recompiled
+    """
+
+    #: Compile flags needed to emit dependency files
+    flags = ["-MMD"]
+
+    def __init__(self, db: ObjectDb, force: bool = False):
+        self.db = db
+        self.force = force
+
+    def _command_hash(self, compiler, src, cc_args, extra_postargs) -> str:
+        # launchers such as ccache don't change the output
+        cmd = (get_compiler_command(compiler) or []) + cc_args + extra_postargs
+        h = hashlib.sha256("\0".join(cmd + [src]).encode("utf-8"))
+        return h.hexdigest()
+
+    def is_up_to_date(self, compiler, obj, src, cc_args, extra_postargs) -> bool:
+        if self.force:
+            return False
+
+        if self.db.get(obj).get("cmd") != self._command_hash(
+            compiler, src, cc_args, extra_postargs
+        ):
+            return False
+
+        deps = parse_depfile(depfile_for(obj))
+        if not deps:
+            return False
+
+        return not newer_group([src] + deps, obj, missing="newer")
+
+    def invalidate(self, obj: str):
+        # if the compile fails, the object must be rebuilt next time
+        self.db.discard(obj, "cmd")
+
+    def record(
+        self,
+        compiler,
+        obj,
+        src,
+        cc_args,
+        extra_postargs,
+        elapsed: Optional[float] = None,
+        rss: Optional[int] = None,
+    ):
+        """
+            Records a successful compile. elapsed is how long the compile
+            took and rss is the peak memory it used, which are None if the
+            object wasn't actually compiled (or it wasn't measured).
+        """
+        info = {"cmd": self._command_hash(compiler, src, cc_args, extra_postargs)}
+        if elapsed is not None:
+            info["time"] = round(elapsed, 3)
+            # lets the next build estimate files that it has no history for
+            try:
+                info["size"] = os.path.getsize(src)
+            except OSError:
+                pass
+        if rss:
+            info["rss"] = rss
+        self.db.update(obj, **info)
+
+    def _link_hash(self, compiler, extra_postargs) -> str:
+        cmd = list(compiler.linker_so) + list(extra_postargs or [])
+        return hashlib.sha256("\0".join(cmd).encode("utf-8")).hexdigest()
+
+    def record_link(self, compiler, output: str, extra_postargs):
+        """Records the linker and link flags that output was linked with"""
+        self.db.update(output, link=self._link_hash(compiler, extra_postargs))
+
+    def flags_changed(
+        self, compiler, ext, build_temp: str, debug: bool, output: str
+    ) -> bool:
+        """
+            Returns True if any object of the extension was compiled with
+            different flags than it would be now, or if the extension
+            (output) was linked with a different linker or link flags
+        """
+        recorded = self.db.get(output).get("link")
+        if recorded is not None and recorded != self._link_hash(
+            compiler, ext.extra_link_args
+        ):
+            return True
+
+        macros = ext.define_macros[:]
+        for undef in ext.undef_macros:
+            macros.append((undef,))
+
+        _, objects, extra_postargs, pp_opts, build = compiler._setup_compile(
+            build_temp,
+            macros,
+            ext.include_dirs,
+            ext.sources,
+            ext.depends,
+            ext.extra_compile_args or [],
+        )
+        cc_args = compiler._get_cc_args(pp_opts, debug, None)
+
+        for obj in objects:
+            recorded = self.db.get(obj).get("cmd")
+            if recorded is not None and recorded != self._command_hash(
+                compiler, build[obj][0], cc_args, extra_postargs
+            ):
+                return True
+        return False
+
+    def extension_depends(self, compiler, ext, build_temp: str) -> List[str]:
+        """
+            Returns the headers that the objects of an extension depended on
+            when they were last compiled
+        """
+        depends = set()
+        for obj in compiler.object_filenames(ext.sources, output_dir=build_temp):
+            deps = parse_depfile(depfile_for(obj))
+            if deps:
+                depends.update(deps)
+        return sorted(depends)
@@ -0,0 +1,67 @@
+"""
+    Selects a faster linker than the system default when one is available
+"""
+
+import shutil
+from typing import List, Optional
+
+from .compiler_probe import CompilerProbe
+
+# fastest first, with the executables that the compiler driver looks for
+_linkers = {
+    "mold": ["ld.mold", "mold"],
+    "lld": ["ld.lld", "ld64.lld"],
+    "gold": ["ld.gold"],
+}
+
+
+def select_linker(
+    probe: CompilerProbe, which: Optional[str], link_args: List[str]
+) -> Optional[str]:
+    """
+        Returns the -fuse-ld flag for the linker to use, or None to use the
+        compiler's default linker
+
+        :param which: 'auto' to use the fastest linker that works, 'default'
+                      to use the compiler default, or the name of a linker
+        :param link_args: Other link arguments. The linker must work with
+                          these too (LTO, for example, needs plugin support)
+    """
+    if which is None:
+        which = "auto"
+
+    if which in ("default", "none"):
+        return None
+
+    if which == "auto":
+        candidates = [
+            name
+            for name, exes in _linkers.items()
+            if any(shutil.which(exe) for exe in exes)
+        ]
+    elif which in _linkers:
+        # probe results are cached, so the linker may have been uninstalled
+        if not any(shutil.which(exe) for exe in _linkers[which]):
+            print(f"WARNING: linker {which} was not found, using default linker")
+            return None
+        candidates = [which]
+    else:
+        raise ValueError(
+            f"unknown linker '{which}' (use auto, default, {', '.join(_linkers)})"
+        )
+
+    if not candidates:
+        return None
+
+    # probe the linker with the other arguments at the same time
+    extra = " ".join(link_args)
+    flags = {name: f"-fuse-ld={name} {extra}".strip() for name in candidates}
+    supported = probe.has_link_flags(list(flags.values()))
+
+    for name in candidates:
+        if supported[flags[name]]:
+            return f"-fuse-ld={name}"
+
+    if which != "auto":
+        print(f"WARNING: compiler cannot link with {which}, using default linker")
+    return None
@@ -0,0 +1,43 @@
+"""
+    Finds maven artifacts in local maven repositories before downloading
+    them, so that builds work without network access
+"""
+
+import glob
+import os
+from os.path import abspath, exists, expanduser, isdir, join
+import pathlib
+from typing import List
+
+
+def get_local_repos() -> List[str]:
+    """
+        Local maven repositories that are checked for artifacts before they
+        are downloaded: the directories in RPYBUILD_MAVEN_MIRRORS (separated
+        by os.pathsep), the maven local repository (~/.m2/repository), and
+        the maven repositories installed by the WPILib installer
+        (~/wpilib/YEAR/maven, newest first)
+    """
+    repos = []
+    mirrors = os.environ.get("RPYBUILD_MAVEN_MIRRORS")
+    if mirrors:
+        repos += [expanduser(m) for m in mirrors.split(os.pathsep) if m]
+
+    home = expanduser("~")
+    repos.append(join(home, ".m2", "repository"))
+    repos += sorted(glob.glob(join(home, "wpilib", "*", "maven")), reverse=True)
+    return [repo for repo in repos if isdir(repo)]
+
+
+def resolve_artifact(repo_url: str, path: str) -> str:
+    """
+        Returns the URL of a maven artifact: a file:// URL if it is in a
+        local repository, otherwise the URL in repo_url
+
+        :param path: Path of the artifact in the repository
+    """
+    for repo in get_local_repos():
+        fname = join(repo, *path.split("/"))
+        if exists(fname):
+            return pathlib.Path(abspath(fname)).as_uri()
+    return f"{repo_url}/{path}"
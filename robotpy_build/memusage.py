@@ -0,0 +1,219 @@
+"""
+    Memory accounting used while generating wrappers and compiling them.
+    Generating bindings for very large headers can use a lot of memory, so
+    this allows the user to put a ceiling on it and see which headers are
+    expensive.
+"""
+
+import contextlib
+import ctypes
+import os
+import sys
+import threading
+import tracemalloc
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def get_peak_rss() -> Optional[int]:
+    """
+        Returns the peak resident set size of this process in bytes, or
+        None if it cannot be determined on this platform
+    """
+    if resource is None:
+        return None
+
+    return maxrss_bytes(resource.getrusage(resource.RUSAGE_SELF))
+
+
+def maxrss_bytes(rusage) -> int:
+    """Returns ru_maxrss of a resource usage structure in bytes"""
+    # linux reports kilobytes, macOS reports bytes
+    if sys.platform == "darwin":
+        return rusage.ru_maxrss
+    return rusage.ru_maxrss * 1024
+
+
+def get_available_memory() -> Optional[int]:
+    """
+        Returns how many bytes of memory can be used without swapping, or
+        None if it cannot be determined on this platform
+    """
+    try:
+        with open("/proc/meminfo") as fp:
+            for line in fp:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def get_current_rss() -> Optional[int]:
+    """
+        Returns the current resident set size of this process in bytes. Falls
+        back to the peak RSS when the current value isn't available.
+    """
+    try:
+        with open("/proc/self/statm") as fp:
+            pages = int(fp.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return get_peak_rss()
+
+    return pages * os.sysconf("SC_PAGE_SIZE")
+
+
+def _mib(v: Optional[int]) -> str:
+    if v is None:
+        return "?"
+    return "%.1f" % (v / (1024 * 1024))
+
+
+class GenMemoryMonitor:
+    """
+        Tracks memory used while each header is processed
+
+        :param max_rss: If the RSS of the process exceeds this many bytes
+                        while processing a header, generation is aborted
+        :param report: If True, use tracemalloc to record python allocations
+                       for each header and print a report at the end
+    """
+
+    #: How often the RSS is checked while a header is processed (seconds)
+    poll_interval = 0.05
+
+    def __init__(self, max_rss: Optional[int] = None, report: bool = False):
+        self.max_rss = max_rss
+        self.report = report
+
+        # name, peak traced, retained traced, peak rss
+        self.results: List[Tuple[str, Optional[int], int, Optional[int]]] = []
+        self._started_tracing = False
+
+        # thread id: [header name, peak rss seen by the poller]
+        self._active: Dict[int, list] = {}
+        self._lock = threading.Lock()
+        self._exceeded: Optional[str] = None
+        self._stopping: Optional[threading.Event] = None
+        self._poller: Optional[threading.Thread] = None
+
+    def start(self):
+        if self.report and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+        if (
+            self.max_rss is not None
+            and get_current_rss() is not None
+            and hasattr(ctypes, "pythonapi")
+        ):
+            self._stopping = threading.Event()
+            self._poller = threading.Thread(
+                target=self._poll, name="rpybuild-max-rss", daemon=True
+            )
+            self._poller.start()
+
+    def stop(self):
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+        if self._poller is not None:
+            self._stopping.set()
+            self._poller.join()
+            self._poller = None
+
+    def _poll(self):
+        # checking only after each header is too late: a single large header
+        # can use all of the memory on its own
+        while not self._stopping.wait(self.poll_interval):
+            rss = get_current_rss()
+            if rss is None:
+                continue
+            with self._lock:
+                for state in self._active.values():
+                    state[1] = max(state[1] or 0, rss)
+                if rss <= self.max_rss or not self._active:
+                    continue
+
+                names = ", ".join(f"'{state[0]}'" for state in self._active.values())
+                self._exceeded = (
+                    f"generation of {names} exceeded --max-rss: "
+                    f"{_mib(rss)} MiB > {_mib(self.max_rss)} MiB"
+                )
+                # interrupt the threads that are generating headers, the
+                # exception is raised at their next python instruction
+                for ident in self._active:
+                    ctypes.pythonapi.PyThreadState_SetAsyncExc(
+                        ctypes.c_ulong(ident), ctypes.py_object(MemoryError)
+                    )
+                self._active.clear()
+
+    @contextlib.contextmanager
+    def header(self, name: str):
+        """
+            Wrap the processing of a single header with this. Any per-header
+            state should be released before the context exits, so that the
+            retained memory reflects what leaks into the next header.
+        """
+        # reset_peak is python 3.9+, without it the peak of earlier headers
+        # would be reported
+        trace_peak = hasattr(tracemalloc, "reset_peak")
+        if self.report:
+            before = tracemalloc.get_traced_memory()[0]
+            if trace_peak:
+                tracemalloc.reset_peak()
+
+        state = [name, None]
+        ident = threading.get_ident()
+        with self._lock:
+            self._active[ident] = state
+
+        try:
+            try:
+                yield
+            finally:
+                with self._lock:
+                    self._active.pop(ident, None)
+        except MemoryError:
+            if self._exceeded:
+                raise MemoryError(self._exceeded) from None
+            raise
+
+        rss = get_current_rss()
+        if state[1] is not None and (rss is None or state[1] > rss):
+            rss = state[1]
+
+        if self.report:
+            current, peak = tracemalloc.get_traced_memory()
+            self.results.append(
+                (name, peak - before if trace_peak else None, current - before, rss)
+            )
+
+        if self.max_rss is not None and rss is not None and rss > self.max_rss:
+            raise MemoryError(
+                f"generation of '{name}' exceeded --max-rss: "
+                f"{_mib(rss)} MiB > {_mib(self.max_rss)} MiB"
+            )
+
+    def print_report(self, title: str):
+        if not self.results:
+            return
+
+        print(f"Memory usage per header for {title} (MiB):")
+        print("  %10s %10s %10s  %s" % ("peak", "retained", "peak rss", "header"))
+        for name, peak, retained, rss in sorted(
+            self.results,
+            key=lambda r: r[1] if r[1] is not None else r[2],
+            reverse=True,
+        ):
+            print(
+                "  %10s %10s %10s  %s" % (_mib(peak), _mib(retained), _mib(rss), name)
+            )
+
+        print("  peak process RSS:", _mib(get_peak_rss()), "MiB")
+        self.results = []
@@ -0,0 +1,150 @@
+"""
+    Content addressed cache of compiled object files, shared by every
+    project and checkout built by the same user.
+
+    Objects are keyed on the preprocessed source, the compiler identity and
+    the flags that affect code generation, so paths to the sources and
+    include directories don't matter. The cache is limited in size, and the
+    least recently used objects are removed first.
+"""
+
+import hashlib
+import os
+from os.path import dirname, exists, join
+import shutil
+import subprocess
+import threading
+from typing import List, Optional
+
+from .cache import default_max_size, evict_lru, get_user_cache_dir, store_file
+from .compiler_probe import get_compiler_command
+from .incremental import depfile_for
+
+
+# preprocessor arguments that take a value as the next argument
+_pp_args_with_value = {"-include", "-imacros", "-isystem", "-iquote", "-MF", "-MT"}
+_pp_prefixes = ("-I", "-D", "-U", "-M")
+
+
+def codegen_args(args: List[str]) -> List[str]:
+    """Arguments that change the output, once preprocessing is done"""
+    result = []
+    skip = False
+    for arg in args:
+        if skip:
+            skip = False
+        elif arg in _pp_args_with_value:
+            skip = True
+        elif not arg.startswith(_pp_prefixes):
+            result.append(arg)
+    return result
+
+
+def _strip_line_markers(text: bytes) -> bytes:
+    # line markers contain the paths of the source and headers, which only
+    # end up in the object when there is debug info
+    return b"\n".join(line for line in text.split(b"\n") if not line.startswith(b"# "))
+
+
+class ObjectCache:
+    """
+        :param compiler_id: Identifies the compiler executable and version
+        :param path: Cache directory, defaults to the user cache directory
+        :param max_size: Size limit in bytes
+    """
+
+    def __init__(
+        self,
+        compiler_id: str,
+        path: Optional[str] = None,
+        max_size: int = default_max_size * 1024 * 1024,
+    ):
+        self.compiler_id = compiler_id
+        self.path = path or get_user_cache_dir("objects")
+        self.max_size = max_size
+
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _entry(self, key: str) -> str:
+        return join(self.path, key[:2], key + ".o")
+
+    def key_for(self, compiler, obj, src, cc_args, extra_postargs) -> Optional[str]:
+        """
+            Preprocesses the source and returns the cache key for it, or None
+            if the object can't be cached. When the compile emits a dependency
+            file, the preprocessor writes it instead so that it is correct
+            for the object even when the compile is skipped.
+        """
+        cmd = get_compiler_command(compiler)
+        if cmd is None:
+            return None
+
+        args = cc_args + extra_postargs
+        # clang doesn't expand a PCH when preprocessing
+        if "-include-pch" in args:
+            return None
+
+        pp_cmd = cmd + args + [src, "-E"]
+        if "-MMD" in args:
+            pp_cmd += ["-MF", depfile_for(obj), "-MT", obj]
+
+        os.makedirs(dirname(obj) or ".", exist_ok=True)
+        try:
+            proc = subprocess.run(
+                pp_cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+            )
+        except OSError:
+            return None
+        if proc.returncode != 0:
+            # the compile will report the error
+            return None
+
+        codegen = codegen_args(cmd[1:] + args)
+        preprocessed = proc.stdout
+        # the last -g option wins
+        debug = [arg for arg in codegen if arg.startswith("-g")]
+        if not debug or debug[-1] == "-g0":
+            preprocessed = _strip_line_markers(preprocessed)
+
+        h = hashlib.sha256()
+        h.update("\0".join([self.compiler_id] + codegen).encode("utf-8"))
+        h.update(b"\0")
+        h.update(preprocessed)
+        return h.hexdigest()
+
+    def fetch(self, key: str, obj: str) -> bool:
+        """Copies the cached object to obj if it exists"""
+        entry = self._entry(key)
+        try:
+            shutil.copyfile(entry, obj)
+            # mtime is used to find the least recently used entries
+            os.utime(entry)
+        except OSError:
+            with self.lock:
+                self.misses += 1
+            return False
+
+        with self.lock:
+            self.hits += 1
+        return True
+
+    def store(self, key: str, obj: str):
+        entry = self._entry(key)
+        if not exists(entry):
+            try:
+                store_file(obj, entry)
+            except OSError:
+                pass
+
+    def evict(self):
+        evict_lru(self.path, self.max_size)
+
+    def print_summary(self):
+        total = self.hits + self.misses
+        if total:
+            print(
+                "Object cache: %d hits, %d misses (%.0f%%)"
+                % (self.hits, self.misses, 100.0 * self.hits / total)
+            )
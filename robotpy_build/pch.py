@@ -0,0 +1,136 @@
+"""
+    Precompiled header support for generated sources. Every generated file
+    starts by including robotpy_build.h (and therefore all of pybind11), so
+    parsing that once per extension instead of once per file saves a lot of
+    time.
+"""
+
+import os
+from os.path import join
+import re
+import warnings
+from typing import Dict, List, Optional, Set
+
+from distutils.errors import CompileError
+
+from .incremental import DependencyTracker
+
+_include_re = re.compile(r"^\s*#\s*include\s*<([^>]+)>", re.MULTILINE)
+
+
+def _common_includes(sources: List[str], candidates: Set[str]) -> List[str]:
+    # only include caster headers that most of the sources use anyway, so
+    # that the precompiled header doesn't pull in things the TUs don't need
+    counts = {}
+    for src in sources:
+        try:
+            with open(src) as fp:
+                contents = fp.read()
+        except OSError:
+            continue
+        for inc in set(_include_re.findall(contents)):
+            if inc in candidates:
+                counts[inc] = counts.get(inc, 0) + 1
+
+    threshold = len(sources) / 2
+    return sorted(inc for inc, count in counts.items() if count > threshold)
+
+
+def build_pch(
+    compiler,
+    ext,
+    build_temp: str,
+    is_clang: bool,
+    debug: bool = False,
+    casters: Optional[Dict[str, str]] = None,
+    tracker: Optional[DependencyTracker] = None,
+) -> List[str]:
+    """
+        Builds a precompiled header for an extension using the same flags
+        that its sources will be compiled with.
+
+        :param compiler: distutils unix compiler
+        :param ext: Extension that will use the precompiled header
+        :param build_temp: Build directory
+        :param is_clang: True if the compiler is clang (.pch) instead of gcc (.gch)
+        :param casters: type caster map for the extension's wrapper
+        :param tracker: If specified, the header is only rebuilt when it is
+                        out of date
+
+        :returns: Extra compile arguments needed to use the header, or an
+                  empty list if the compiler couldn't build or use it
+    """
+
+    pchdir = join(build_temp, "pch", ext.name)
+    os.makedirs(pchdir, exist_ok=True)
+
+    includes = ["robotpy_build.h"]
+    if casters:
+        includes += _common_includes(ext.sources, set(casters.values()) - {includes[0]})
+
+    contents = "// This file is autogenerated, DO NOT EDIT\n"
+    for inc in includes:
+        contents += f"#include <{inc}>\n"
+
+    # only touch the header if it changed, everything depends on it
+    pch_h = join(pchdir, "rpybuild_pch.h")
+    try:
+        with open(pch_h) as fp:
+            unchanged = fp.read() == contents
+    except OSError:
+        unchanged = False
+
+    if not unchanged:
+        with open(pch_h, "w") as fp:
+            fp.write(contents)
+
+    if is_clang:
+        pch_out = pch_h + ".pch"
+        pch_args = ["-include-pch", pch_out]
+        probe_args = pch_args
+    else:
+        # gcc silently ignores a .gch that doesn't match unless told otherwise
+        pch_out = pch_h + ".gch"
+        pch_args = ["-include", pch_h, "-Winvalid-pch"]
+        probe_args = pch_args + ["-Werror=invalid-pch"]
+
+    macros = ext.define_macros[:]
+    for undef in ext.undef_macros:
+        macros.append((undef,))
+
+    _, _, extra_postargs, pp_opts, _ = compiler._setup_compile(
+        pchdir, macros, ext.include_dirs, [], ext.depends, ext.extra_compile_args
+    )
+    cc_args = compiler._get_cc_args(pp_opts, debug, None)
+    pch_cc_args = cc_args + ["-x", "c++-header"]
+
+    if tracker and tracker.is_up_to_date(
+        compiler, pch_out, pch_h, pch_cc_args, extra_postargs
+    ):
+        return pch_args
+
+    # make sure the compiler actually uses the header before committing to it
+    probe_src = join(pchdir, "pch_probe.cpp")
+    with open(probe_src, "w") as fp:
+        fp.write("#include <robotpy_build.h>\nint rpybuild_pch_probe() { return 0; }\n")
+
+    try:
+        if tracker:
+            tracker.invalidate(pch_out)
+        compiler._compile(pch_out, pch_h, ".h", pch_cc_args, extra_postargs, pp_opts)
+        compiler._compile(
+            join(pchdir, "pch_probe.o"),
+            probe_src,
+            ".cpp",
+            cc_args,
+            extra_postargs + probe_args,
+            pp_opts,
+        )
+    except CompileError:
+        warnings.warn(f"precompiled header rejected for {ext.name}, not using it")
+        return []
+
+    if tracker:
+        tracker.record(compiler, pch_out, pch_h, pch_cc_args, extra_postargs)
+
+    return pch_args
@@ -0,0 +1,89 @@
+"""
+    Overlaps wrapper generation with compilation: each generated source is
+    compiled as soon as the headers that it includes have been generated
+"""
+
+from os.path import exists, join, normpath
+import re
+from typing import Callable, Dict, List, Set, Tuple
+
+_rpygen_include_re = re.compile(r"#include\s*<(rpygen/[^>]+)>")
+
+
+class GenPipeline:
+    """
+        Generated sources include the trampoline headers of their classes
+        and of the base classes of those, which may not have been generated
+        yet. Sources are held back until all of those headers exist.
+
+        :param submit: Called with (wrapper, source) when a source can be
+                       compiled
+        :param wrappers: All of the wrappers that will be generated
+    """
+
+    def __init__(self, submit: Callable, wrappers: List):
+        self.submit = submit
+
+        # trampoline directories that contain stale headers until their
+        # wrapper has been generated
+        self.pending_dirs: Set[str] = {
+            normpath(w.rpy_incdir) for w in wrappers if w.cfg.generate
+        }
+
+        self.deferred: List[Tuple[object, str]] = []
+        self._includes: Dict[str, List[str]] = {}
+
+    def _rpygen_includes(self, fname: str) -> List[str]:
+        includes = self._includes.get(fname)
+        if includes is None:
+            with open(fname) as fp:
+                includes = _rpygen_include_re.findall(fp.read())
+            self._includes[fname] = includes
+        return includes
+
+    def _is_ready(self, wrapper, src: str) -> bool:
+        include_dirs = wrapper.extension.include_dirs
+        own_dir = normpath(wrapper.rpy_incdir)
+        todo = [src]
+        seen = set()
+        while todo:
+            for inc in self._rpygen_includes(todo.pop()):
+                if inc in seen:
+                    continue
+                seen.add(inc)
+
+                for incdir in include_dirs:
+                    path = join(incdir, inc)
+                    if exists(path):
+                        if incdir in self.pending_dirs and incdir != own_dir:
+                            return False
+                        todo.append(path)
+                        break
+                else:
+                    return False
+        return True
+
+    def _flush(self):
+        deferred = []
+        for wrapper, src in self.deferred:
+            if self._is_ready(wrapper, src):
+                self.submit(wrapper, src)
+            else:
+                deferred.append((wrapper, src))
+        self.deferred = deferred
+
+    def generated(self, wrapper, src: str):
+        """Called when a source has been generated"""
+        self.deferred.append((wrapper, src))
+        self._flush()
+
+    def wrapper_done(self, wrapper):
+        """Called when all sources of a wrapper have been generated"""
+        self.pending_dirs.discard(normpath(wrapper.rpy_incdir))
+        self._flush()
+
+    def finish(self):
+        """Submits anything that is left once generation is complete"""
+        for wrapper, src in self.deferred:
+            self.submit(wrapper, src)
+        self.deferred = []
@@ -0,0 +1,127 @@
+"""
+    Build profiles select optimization related compiler and linker flags
+"""
+
+from typing import Dict, List, Tuple
+
+from .compiler_probe import CompilerProbe
+from .pyproject_configs import BuildProfile
+
+#: Profiles that are always available. Projects can override these in
+#: pyproject.toml
+default_profiles = {
+    "release": BuildProfile(
+        optimization="2", lto=True, no_semantic_interposition=True, gc_sections=True,
+    ),
+    "dev": BuildProfile(optimization="0", strip=False),
+}
+
+
+def get_profile(name: str, profiles: Dict[str, BuildProfile]) -> BuildProfile:
+    profile = profiles.get(name) or default_profiles.get(name)
+    if profile is None:
+        available = ", ".join(sorted(set(profiles) | set(default_profiles)))
+        raise ValueError(f"unknown build profile '{name}' (available: {available})")
+    return profile
+
+
+def _first_supported(candidates: List[str], supported: Dict[str, bool]):
+    for flag in candidates:
+        if supported[flag]:
+            return flag
+
+
+def get_profile_flags(
+    profile: BuildProfile, probe: CompilerProbe, os: str
+) -> Tuple[List[str], List[str]]:
+    """
+        Computes the compile and link flags for a profile, dropping any
+        that the compiler doesn't support
+
+        :param os: platform os (see platforms.py)
+        :returns: compile args, link args
+    """
+
+    ct = probe.compiler.compiler_type
+    if ct == "msvc":
+        return _get_msvc_flags(profile)
+
+    compile_args = ["-g" if profile.debug_symbols else "-g0"]
+    link_args = []
+
+    if profile.optimization is not None:
+        compile_args.append(f"-O{profile.optimization}")
+
+    if profile.no_semantic_interposition:
+        compile_args.append("-fno-semantic-interposition")
+
+    if profile.gc_sections:
+        compile_args += ["-ffunction-sections", "-fdata-sections"]
+        if os == "osx":
+            link_args.append("-Wl,-dead_strip")
+        else:
+            link_args.append("-Wl,--gc-sections")
+
+    if profile.strip and os != "osx":
+        link_args.append("-s")
+
+    # LTO flags need to be passed to the compiler and linker
+    lto_candidates = []
+    if profile.lto:
+        # ThinLTO for clang (which also accepts -flto=auto since clang 13),
+        # parallel LTO for gcc, then plain LTO
+        if probe.is_clang:
+            lto_candidates = ["-flto=thin", "-flto"]
+        else:
+            lto_candidates = ["-flto=auto", "-flto"]
+
+    compile_args += profile.extra_compile_args
+    link_args += profile.extra_link_args
+
+    # probe all of it at once
+    supported = probe.has_flags(compile_args)
+    link_supported = probe.has_link_flags(link_args + lto_candidates)
+
+    dropped = [f for f in compile_args if not supported[f]]
+    dropped += [f for f in link_args if not link_supported[f]]
+    compile_args = [f for f in compile_args if supported[f]]
+    link_args = [f for f in link_args if link_supported[f]]
+
+    if lto_candidates:
+        lto = _first_supported(lto_candidates, link_supported)
+        if lto:
+            compile_args.append(lto)
+            link_args.append(lto)
+        else:
+            dropped.append("-flto")
+
+    if dropped:
+        print("WARNING: compiler does not support", " ".join(dropped))
+
+    return compile_args, link_args
+
+
+def _get_msvc_flags(profile: BuildProfile) -> Tuple[List[str], List[str]]:
+    compile_args = []
+    link_args = []
+
+    if profile.debug_symbols:
+        compile_args.append("/Zi")
+        link_args.append("/DEBUG")
+
+    if profile.optimization is not None:
+        # msvc has no /O3
+        level = {"0": "d", "3": "2"}.get(profile.optimization, profile.optimization)
+        compile_args.append(f"/O{level}")
+
+    if profile.lto:
+        compile_args.append("/GL")
+        link_args.append("/LTCG")
+
+    if profile.gc_sections:
+        compile_args.append("/Gy")
+        link_args += ["/OPT:REF", "/OPT:ICF"]
+
+    compile_args += profile.extra_compile_args
+    link_args += profile.extra_link_args
+    return compile_args, link_args
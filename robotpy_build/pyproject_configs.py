@@ -112,6 +112,52 @@ class WrapperConfig(BaseModel):
     pp_defines: List[str] = []
 
 
+class BuildProfile(BaseModel):
+    """
+        Compiler and linker options used to build extensions. Select a
+        profile using ``build_ext --profile=name``. Any flags that the
+        compiler doesn't support are dropped.
+
+        [tool.robotpy-build.profiles."name"]
+    """
+
+    class Config:
+        extra = "forbid"
+
+    #: Optimization level (-O<level>). If None, the level that distutils
+    #: inherited from the python build is used
+    optimization: Optional[str] = None
+
+    #: Keep debug symbols in the extension
+    debug_symbols: bool = False
+
+    #: Strip symbols from the linked extension
+    strip: bool = True
+
+    #: Enable link time optimization
+    lto: bool = False
+
+    #: Compile with -fno-semantic-interposition, which allows calls to
+    #: functions in the same extension to be inlined
+    no_semantic_interposition: bool = False
+
+    #: Put each function and variable in its own section, and have the
+    #: linker discard sections that aren't used
+    gc_sections: bool = False
+
+    #: Linker to use: 'auto' selects the fastest available linker that
+    #: works (mold, lld, then gold), 'default' uses the compiler's default
+    #: linker, or the name of a specific linker. Overridden by
+    #: ``build_ext --linker`` or the RPYBUILD_LINKER environment variable
+    linker: Optional[str] = None
+
+    #: Additional arguments to pass to the compiler
+    extra_compile_args: List[str] = []
+
+    #: Additional arguments to pass to the linker
+    extra_link_args: List[str] = []
+
+
 class DistutilsMetadata(BaseModel):
     class Config:
         # allow passing in extra keywords to setuptools
@@ -159,3 +205,7 @@ class RobotpyBuildConfig(BaseModel):
 
     # [tool.robotpy-build.wrappers."XXX"]
     wrappers: Dict[str, WrapperConfig] = {}
+
+    # [tool.robotpy-build.profiles."XXX"]
+    # .. 'release' and 'dev' are predefined, but may be overridden
+    profiles: Dict[str, BuildProfile] = {}
@@ -106,6 +106,7 @@ class Setup:
         for cls in self.setup_kwargs["cmdclass"].values():
             cls.wrappers = self.wrappers
             cls.rpybuild_pkgcfg = self.pkgcfg
+            cls.rpybuild_profiles = self.project.profiles
 
         # We already know some of our packages, so collect those in addition
         # to using find_packages()
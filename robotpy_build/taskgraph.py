@@ -0,0 +1,96 @@
+"""
+    Runs the steps of a build as a graph of tasks, so that steps that don't
+    depend on each other run at the same time
+"""
+
+import concurrent.futures
+import time
+from typing import Callable, Dict, Iterable, List, Tuple
+
+import toposort
+
+
+class TaskGraph:
+    """
+        Each task is run on its own thread as soon as the tasks that it
+        depends on have finished. Tasks are expected to spend most of their
+        time waiting on I/O or other processes, or to serialize themselves
+        with locks.
+
+        If a task fails, tasks that haven't started yet are skipped and the
+        first error is raised by run().
+    """
+
+    def __init__(self):
+        self.tasks: Dict[str, Tuple[Callable[[], None], List[str]]] = {}
+
+        #: (name, start, end) of each task that ran, relative to the start
+        self.timings: List[Tuple[str, float, float]] = []
+
+    def add(self, name: str, fn: Callable[[], None], depends: Iterable[str] = ()):
+        if name in self.tasks:
+            raise ValueError(f"duplicate task '{name}'")
+        self.tasks[name] = (fn, list(depends))
+
+    def run(self):
+        for name, (_, depends) in self.tasks.items():
+            for dep in depends:
+                if dep not in self.tasks:
+                    raise ValueError(f"task '{name}' depends on unknown task '{dep}'")
+
+        # raises on cycles
+        toposort.toposort_flatten(
+            {name: set(depends) for name, (_, depends) in self.tasks.items()}
+        )
+
+        remaining = {name: set(depends) for name, (_, depends) in self.tasks.items()}
+        dependents: Dict[str, List[str]] = {name: [] for name in self.tasks}
+        for name, (_, depends) in self.tasks.items():
+            for dep in depends:
+                dependents[dep].append(name)
+
+        t0 = time.monotonic()
+        error = None
+
+        def _run(name: str):
+            start = time.monotonic() - t0
+            self.tasks[name][0]()
+            self.timings.append((name, start, time.monotonic() - t0))
+
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, len(self.tasks))
+        ) as executor:
+            running = {}
+
+            def _submit_ready():
+                for name in [n for n, deps in remaining.items() if not deps]:
+                    del remaining[name]
+                    running[executor.submit(_run, name)] = name
+
+            _submit_ready()
+            while running:
+                done, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    name = running.pop(future)
+                    exc = future.exception()
+                    if exc is not None:
+                        if error is None:
+                            error = exc
+                        continue
+                    for dependent in dependents[name]:
+                        remaining[dependent].discard(name)
+
+                if error is None:
+                    _submit_ready()
+
+        if error is not None:
+            raise error
+
+    def print_timeline(self):
+        if not self.timings:
+            return
+        print("Build timeline:")
+        for name, start, end in sorted(self.timings, key=lambda t: t[1]):
+            print("  %7.1fs - %7.1fs  %s" % (start, end, name))
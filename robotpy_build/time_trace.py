@@ -0,0 +1,238 @@
+"""
+    Collects compiler timing traces for each compiled file, and maps the
+    expensive parts back to the header, class and binding that generated
+    them.
+
+    clang writes a trace (-ftime-trace) next to each object file, which
+    includes each template instantiation and include. gcc only reports time
+    per compiler phase (-ftime-report), so it is captured from stderr and
+    can only be attributed to the file as a whole.
+"""
+
+import json
+from os.path import abspath, exists, splitext
+import re
+import sys
+from typing import Dict, List, Optional, Tuple
+
+from .compile_pool import spawn_command
+
+# clang trace events that we aggregate
+_clang_events = {
+    "InstantiateClass": "template",
+    "InstantiateFunction": "template",
+    "Source": "include",
+}
+
+_gcc_pct_re = re.compile(r"\(\s*\d+%\)")
+
+
+def time_trace_flags(is_clang: bool) -> List[str]:
+    if is_clang:
+        return ["-ftime-trace"]
+    return ["-ftime-report"]
+
+
+def gcc_report_fname(obj: str) -> str:
+    return obj + ".time-report"
+
+
+def clang_trace_fname(obj: str) -> str:
+    return splitext(obj)[0] + ".json"
+
+
+def capture_gcc_time_report(compiler):
+    """
+        gcc writes its time report to stderr, so this replaces the spawn
+        method of the compiler with one that saves stderr of each compile
+        next to the object file (and echos any diagnostics)
+    """
+
+    def _save_report(cmd, stderr):
+        idx = stderr.find("Time variable")
+        diagnostics = stderr if idx == -1 else stderr[:idx]
+        if diagnostics.strip():
+            sys.stderr.write(diagnostics)
+
+        if idx != -1 and "-o" in cmd:
+            obj = cmd[cmd.index("-o") + 1]
+            with open(gcc_report_fname(obj), "w") as fp:
+                fp.write(stderr[idx:])
+
+    def spawn(cmd, **kwargs):
+        spawn_command(cmd, compiler.dry_run, _save_report)
+
+    compiler.spawn = spawn
+
+
+def _parse_gcc_report(fname: str) -> Dict[str, float]:
+    # lines look like ' phase parsing   :   1.20 ( 40%)   0.10 ( 9%)   1.31 ( 38%)  52M ( 40%)'
+    # and the columns are usr, sys, wall
+    phases = {}
+    with open(fname) as fp:
+        for line in fp:
+            if ":" not in line:
+                continue
+            name, _, rest = line.partition(":")
+            values = _gcc_pct_re.sub("", rest).split()
+            try:
+                wall = float(values[2])
+            except (IndexError, ValueError):
+                continue
+            phases[name.strip()] = wall
+    return phases
+
+
+class _Source:
+    def __init__(self, src: str, origin: str, classes: List[str]):
+        self.src = src
+        self.origin = origin
+
+        # longest first so that Foo::Bar matches before Foo
+        self.class_res = [
+            (cls, re.compile(re.escape(cls) + r"(?:::(~?\w+))?\b"))
+            for cls in sorted(classes, key=len, reverse=True)
+        ]
+
+    def attribute(self, detail: str) -> Tuple[Optional[str], Optional[str]]:
+        """Returns (class, binding) that a trace detail refers to"""
+        for cls, cls_re in self.class_res:
+            found = False
+            for m in cls_re.finditer(detail):
+                found = True
+                member = m.group(1)
+                if member:
+                    return cls, f"{cls}::{member}"
+            if found:
+                return cls, None
+        return None, None
+
+
+class TimeTraceReport:
+    """
+        Aggregates the compiler traces of all compiled files
+    """
+
+    def __init__(self, is_clang: bool):
+        self.is_clang = is_clang
+        self.sources: List[Tuple[_Source, str]] = []
+
+    def add_extension(self, compiler, ext, build_temp: str):
+        wrapper = getattr(ext, "rpybuild_wrapper", None)
+        generated = wrapper.generated_sources if wrapper else {}
+
+        for src in ext.sources:
+            obj = compiler.object_filenames([src], output_dir=build_temp)[0]
+
+            classes = []
+            gen = generated.get(abspath(src))
+            if gen:
+                name, header, classdeps = gen
+                origin = f"{wrapper.name}: {name} ({header})"
+                try:
+                    with open(classdeps) as fp:
+                        classes = [c.split("<")[0] for c in json.load(fp)]
+                except (OSError, ValueError):
+                    pass
+            else:
+                origin = f"{ext.name}: {src}"
+
+            self.sources.append((_Source(src, origin, classes), obj))
+
+    def _collect(self):
+        files = []
+        items = {}
+        includes = {}
+        phases = {}
+
+        for source, obj in self.sources:
+            if self.is_clang:
+                fname = clang_trace_fname(obj)
+                if not exists(fname):
+                    continue
+                with open(fname) as fp:
+                    events = json.load(fp).get("traceEvents", [])
+
+                total = 0.0
+                for event in events:
+                    name = event.get("name")
+                    dur = event.get("dur", 0) / 1e6
+                    if name == "ExecuteCompiler":
+                        total = dur
+                    kind = _clang_events.get(name)
+                    if kind is None or event.get("ph") != "X":
+                        continue
+
+                    detail = event.get("args", {}).get("detail", "")
+                    if kind == "include":
+                        includes[detail] = includes.get(detail, 0.0) + dur
+                    else:
+                        cls, binding = source.attribute(detail)
+                        key = (source.origin, cls, binding, detail)
+                        items[key] = items.get(key, 0.0) + dur
+                files.append((total, source.origin, source.src))
+            else:
+                fname = gcc_report_fname(obj)
+                if not exists(fname):
+                    continue
+                tu_phases = _parse_gcc_report(fname)
+                total = tu_phases.pop("TOTAL", 0.0)
+                for phase, wall in tu_phases.items():
+                    key = (source.origin, phase)
+                    phases[key] = phases.get(key, 0.0) + wall
+                files.append((total, source.origin, source.src))
+
+        return files, items, includes, phases
+
+    def write(self, fname: str, limit: int = 15):
+        """
+            Writes the full report to a file, and prints the top entries
+        """
+        files, items, includes, phases = self._collect()
+        if not files:
+            print("time trace: no traces were found (were any files compiled?)")
+            return
+
+        sections = []
+
+        lines = ["%8.2fs  %s  %s" % f for f in sorted(files, reverse=True)]
+        sections.append(("Slowest files", lines))
+
+        if items:
+            lines = []
+            for (origin, cls, binding, detail), dur in sorted(
+                items.items(), key=lambda i: i[1], reverse=True
+            ):
+                what = binding or cls or "(unattributed)"
+                lines.append("%8.2fs  %s  [%s]  %s" % (dur, what, origin, detail))
+            sections.append(("Most expensive template instantiations", lines))
+
+        if includes:
+            lines = [
+                "%8.2fs  %s" % (dur, inc)
+                for inc, dur in sorted(
+                    includes.items(), key=lambda i: i[1], reverse=True
+                )
+            ]
+            sections.append(("Most expensive includes (all files)", lines))
+
+        if phases:
+            lines = [
+                "%8.2fs  %s  [%s]" % (dur, phase, origin)
+                for (origin, phase), dur in sorted(
+                    phases.items(), key=lambda i: i[1], reverse=True
+                )
+            ]
+            sections.append(("Most expensive compiler phases", lines))
+
+        with open(fname, "w") as fp:
+            for title, lines in sections:
+                fp.write(f"{title}:\n")
+                fp.write("\n".join(lines))
+                fp.write("\n\n")
+
+        for title, lines in sections:
+            print(f"{title}:")
+            for line in lines[:limit]:
+                print(line)
+        print("Full compile time report written to", fname)
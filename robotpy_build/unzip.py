@@ -0,0 +1,117 @@
+"""
+    Extracts zipfiles on several threads. Header zips contain thousands of
+    small files, and extracting them one at a time spends most of its time
+    waiting on decompression and on creating files, both of which release
+    the GIL.
+"""
+
+import concurrent.futures
+import os
+from os.path import basename, join
+import time
+from typing import List, Optional
+import zipfile
+
+#: Archives with fewer members than this are extracted on one thread
+min_parallel_members = 256
+
+
+def _shards(infos: List[zipfile.ZipInfo], count: int) -> List[List[zipfile.ZipInfo]]:
+    # contiguous runs of members, so that each thread reads its part of the
+    # archive in order, split so that each has about the same amount of data
+    total = sum(info.compress_size + 1 for info in infos)
+    shards: List[List[zipfile.ZipInfo]] = [[]]
+    size = 0
+    for info in infos:
+        if size >= total * len(shards) / count:
+            shards.append([])
+        shards[-1].append(info)
+        size += info.compress_size + 1
+    return shards
+
+
+# characters that ZipFile.extract replaces on Windows
+_unsafe_chars = set('<>:"|?*\\')
+
+
+def _member_dir(to: str, name: str) -> Optional[str]:
+    """
+        Returns the directory that a member is extracted to, or None if
+        ZipFile.extract would sanitize its name
+    """
+    parts = name.rstrip("/").split("/")
+    for part in parts:
+        if (
+            part in ("", ".", "..")
+            or part[-1] in ". "
+            or not _unsafe_chars.isdisjoint(part)
+        ):
+            return None
+    if name.endswith("/"):
+        return join(to, *parts)
+    return join(to, *parts[:-1])
+
+
+def _extract_shard(fname: str, infos: List[zipfile.ZipInfo], to: str):
+    with zipfile.ZipFile(fname) as z:
+        for info in infos:
+            z.extract(info, to)
+
+
+def extract_zip(fname: str, to: str, jobs: Optional[int] = None):
+    """
+        Extracts all of the files in a zipfile to a directory, like
+        ZipFile.extractall. Large archives are split between threads that
+        each open the zipfile themselves, and the time taken is printed.
+
+        :param jobs: Number of threads, defaults to the number of CPUs
+    """
+    if jobs is None:
+        jobs = min(os.cpu_count() or 1, 8)
+
+    with zipfile.ZipFile(fname) as z:
+        infos = z.infolist()
+        if jobs < 2 or len(infos) < min_parallel_members:
+            z.extractall(to)
+            return
+
+    # ZipFile.extract changes unusual names, so the directories that it
+    # would create can't be known up front
+    dirs = {_member_dir(to, info.filename) for info in infos}
+    if None in dirs:
+        with zipfile.ZipFile(fname) as z:
+            z.extractall(to)
+        return
+
+    start = time.monotonic()
+
+    # create every directory once, so that the threads don't need to
+    for d in sorted(dirs):
+        os.makedirs(d, exist_ok=True)
+
+    files = [info for info in infos if not info.is_dir()]
+    if not files:
+        return
+
+    shards = _shards(files, min(jobs, len(files)))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(shards)) as executor:
+        futures = [
+            executor.submit(_extract_shard, fname, shard, to) for shard in shards
+        ]
+        for future in futures:
+            future.result()
+
+    elapsed = max(time.monotonic() - start, 1e-6)
+    size = sum(info.file_size for info in files) / (1024 * 1024)
+    print(
+        "Extracted %d files (%.1f MiB) from %s in %.2fs (%.0f files/s, %.1f MiB/s, %d threads)"
+        % (
+            len(files),
+            size,
+            basename(fname),
+            elapsed,
+            len(files) / elapsed,
+            size / elapsed,
+            len(shards),
+        )
+    )
@@ -1,4 +1,9 @@
+import concurrent.futures
+import dataclasses
+import filecmp
+import gc
 import glob
+import hashlib
 import json
 import inspect
 import os
@@ -18,7 +23,7 @@ import posixpath
 import sys
 import shutil
 import toposort
-from typing import Optional, List
+from typing import Callable, Dict, Optional, List
 import yaml
 
 from header2whatever.config import Config
@@ -31,7 +36,9 @@ from .pyproject_configs import WrapperConfig, MavenLibDownload
 from .generator_data import MissingReporter
 from .hooks import Hooks
 from .hooks_datacfg import HooksDataYaml
-from .download import download_and_extract_zip
+from .memusage import GenMemoryMonitor
+from .download import download_and_extract_zips
+from .maven import resolve_artifact
 
 
 class Wrapper:
@@ -83,6 +90,10 @@ class Wrapper:
         # Files that are generated AND need to be in the final wheel. Used by build_py
         self.generated_files = []
 
+        # Generated C++ sources, used to map build statistics back to what
+        # generated them: {abspath: (generate name, header, classdeps json)}
+        self.generated_sources = {}
+
         self._all_deps = None
 
         self.extension = None
@@ -124,17 +135,15 @@ class Wrapper:
         self.dev_config = get_dev_config(self.name)
 
     def _dl_url(self, classifier):
-        # TODO: support development against locally installed things?
         dl = self.cfg.maven_lib_download
-        repo_url = dl.repo_url
         grp = dl.group_id.replace(".", "/")
         art = dl.artifact_id
         ver = dl.version
 
-        return f"{repo_url}/{grp}/{art}/{ver}/{art}-{ver}-{classifier}.zip"
-
-    def _extract_zip_to(self, thing, dst, cache):
-        download_and_extract_zip(self._dl_url(thing), to=dst, cache=cache)
+        # local maven repositories are checked first
+        return resolve_artifact(
+            dl.repo_url, f"{grp}/{art}/{ver}/{art}-{ver}-{classifier}.zip"
+        )
 
     def _add_generated_file(self, fullpath):
         if not isdir(fullpath):
@@ -245,32 +254,111 @@ class Wrapper:
             casters[k] = v
         return casters
 
-    def on_build_dl(self, cache: str, srcdir: str):
+    def on_build_dl(
+        self,
+        cache: str,
+        srcdir: str,
+        executor: Optional[concurrent.futures.Executor] = None,
+    ):
 
         pkgcfgpy = join(self.root, "pkgcfg.py")
         srcdir = join(srcdir, self.name)
 
-        try:
-            os.unlink(self.libinit_import_py)
-        except OSError:
-            pass
+        libnames_full = []
+        dlcfg = self.cfg.maven_lib_download
+        if dlcfg and not dlcfg.use_sources:
+            libnames_full = self.get_library_full_names()
+
+        libinit = self._libinit_py_contents(libnames_full)
+        pkgcfg = self._pkgcfg_py_contents(libnames_full)
+
+        # If nothing changed since the last download, leave everything alone
+        # so that anything depending on modification times isn't rebuilt
+        stamp = join(cache, "stamps", f"{self.name}.json")
+        stamp_key = self._dl_stamp_key(libinit, pkgcfg)
+        outputs = {self.libinit_import_py: libinit, pkgcfgpy: pkgcfg}
+        downloaded = self._dl_current_files(stamp, stamp_key, outputs, srcdir)
+        if downloaded is not None:
+            self.generated_files.extend(downloaded)
+            if dlcfg:
+                self._add_downloaded_sources(dlcfg, srcdir)
+            for fname in outputs:
+                self._add_generated_file(fname)
+            return
+
+        for fname in [stamp] + list(outputs):
+            try:
+                os.unlink(fname)
+            except OSError:
+                pass
+
+        first = len(self.generated_files)
+        if dlcfg:
+            self._clean_and_download(dlcfg, cache, srcdir, executor)
+        downloaded = self.generated_files[first:]
 
+        for fname, contents in outputs.items():
+            with open(fname, "w") as fp:
+                fp.write(contents)
+            self._add_generated_file(fname)
+
+        os.makedirs(dirname(stamp), exist_ok=True)
+        with open(stamp, "w") as fp:
+            json.dump({"key": stamp_key, "files": downloaded}, fp)
+
+    def _dl_stamp_key(self, libinit: str, pkgcfg: str) -> str:
+        dlcfg = self.cfg.maven_lib_download
+        stamp = {
+            "maven_lib_download": dlcfg.dict() if dlcfg else None,
+            "platform": dataclasses.asdict(self.platform),
+            "libinit": libinit,
+            "pkgcfg": pkgcfg,
+        }
+        return hashlib.sha256(
+            json.dumps(stamp, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+    def _dl_current_files(
+        self, stamp: str, stamp_key: str, outputs: Dict[str, str], srcdir: str
+    ) -> Optional[List[str]]:
+        """
+            If the last download used the same configuration and its files
+            are still there, returns the files that it downloaded
+        """
         try:
-            os.unlink(pkgcfgpy)
-        except OSError:
-            pass
+            with open(stamp) as fp:
+                data = json.load(fp)
+            if data["key"] != stamp_key:
+                return None
+            for fname, contents in outputs.items():
+                with open(fname) as fp:
+                    if fp.read() != contents:
+                        return None
+        except (OSError, ValueError, KeyError):
+            return None
 
-        libnames_full = []
         dlcfg = self.cfg.maven_lib_download
-        if dlcfg:
-            libnames_full = self._clean_and_download(dlcfg, cache, srcdir)
+        if dlcfg and dlcfg.use_sources and not isdir(srcdir):
+            return None
+
+        files = data["files"]
+        for fname in files:
+            if not exists(join(self.root, fname)):
+                return None
+        return files
 
-        self._write_libinit_py(libnames_full)
-        self._write_pkgcfg_py(pkgcfgpy, libnames_full)
+    def _add_downloaded_sources(self, dlcfg: MavenLibDownload, srcdir: str):
+        if dlcfg.use_sources and dlcfg.sources:
+            sources = [join(srcdir, normpath(s)) for s in dlcfg.sources]
+            self.extension.sources.extend(sources)
 
     def _clean_and_download(
-        self, dlcfg: MavenLibDownload, cache: str, srcdir: str
-    ) -> List[str]:
+        self,
+        dlcfg: MavenLibDownload,
+        cache: str,
+        srcdir: str,
+        executor: Optional[concurrent.futures.Executor],
+    ):
 
         libdir = join(self.root, "lib")
         incdir = join(self.root, "include")
@@ -281,14 +369,13 @@ class Wrapper:
         shutil.rmtree(srcdir, ignore_errors=True)
 
         # grab headers
-        self._extract_zip_to("headers", incdir, cache)
+        zips = [(self._dl_url("headers"), incdir)]
 
         if dlcfg.use_sources:
-            self._extract_zip_to(dlcfg.sources_classifier, srcdir, cache)
-            if dlcfg.sources:
-                sources = [join(srcdir, normpath(s)) for s in dlcfg.sources]
-                self.extension.sources.extend(sources)
-            return []
+            zips.append((self._dl_url(dlcfg.sources_classifier), srcdir))
+            download_and_extract_zips(zips, cache, executor)
+            self._add_downloaded_sources(dlcfg, srcdir)
+            return
         elif dlcfg.sources is not None:
             raise ValueError("sources must be None if use_sources is False!")
 
@@ -317,7 +404,9 @@ class Wrapper:
                 for libname in extract_names
             }
 
-            self._extract_zip_to(f"{self.platform.os}{self.platform.arch}", to, cache)
+            zips.append((self._dl_url(f"{self.platform.os}{self.platform.arch}"), to))
+
+        download_and_extract_zips(zips, cache, executor)
 
         for f in glob.glob(join(glob.escape(incdir), "**"), recursive=True):
             self._add_generated_file(f)
@@ -325,9 +414,7 @@ class Wrapper:
         for f in glob.glob(join(glob.escape(libdir), "**"), recursive=True):
             self._add_generated_file(f)
 
-        return libnames_full
-
-    def _write_libinit_py(self, libnames):
+    def _libinit_py_contents(self, libnames) -> str:
 
         # This file exists to ensure that any shared library dependencies
         # are loaded for the compiled extension
@@ -364,14 +451,9 @@ class Wrapper:
         else:
             imports = ""
 
-        init = init.replace("##IMPORTS##", imports)
+        return init.replace("##IMPORTS##", imports)
 
-        with open(self.libinit_import_py, "w") as fp:
-            fp.write(init)
-
-        self._add_generated_file(self.libinit_import_py)
-
-    def _write_pkgcfg_py(self, fname, libnames_full):
+    def _pkgcfg_py_contents(self, libnames_full) -> str:
 
         library_dirs = "[]"
         library_dirs_rel = []
@@ -430,10 +512,7 @@ class Wrapper:
                 f"    casters.update({repr(type_casters)})\n"
             )
 
-        with open(fname, "w") as fp:
-            fp.write(pkgcfg)
-
-        self._add_generated_file(fname)
+        return pkgcfg
 
     def _load_generation_data(self, datafile):
         with open(datafile) as fp:
@@ -445,8 +524,18 @@ class Wrapper:
         return HooksDataYaml(**data)
 
     def on_build_gen(
-        self, cxx_gen_dir, missing_reporter: Optional[MissingReporter] = None
+        self,
+        cxx_gen_dir,
+        missing_reporter: Optional[MissingReporter] = None,
+        memory: Optional[GenMemoryMonitor] = None,
+        on_generated: Optional[Callable[[str], None]] = None,
     ):
+        """
+            Generates the sources for this wrapper
+
+            :param on_generated: Called with the path of each generated
+                                 source as soon as it is written
+        """
 
         if not self.cfg.generate:
             return
@@ -469,16 +558,18 @@ class Wrapper:
 
         pp_includes = self._all_includes(False)
 
-        # TODO: only regenerate files if the generated files
-        #       have changed
-        if not report_only:
-
-            if self.dev_config.only_generate is None:
-                shutil.rmtree(cxx_gen_dir, ignore_errors=True)
-                shutil.rmtree(hppoutdir, ignore_errors=True)
+        # Everything is generated into a staging directory first, and files
+        # are only replaced if their contents changed, so that objects that
+        # depend on them aren't recompiled when nothing changed
+        stagedir = cxx_gen_dir + ".staging"
+        stage_gen_dir = join(stagedir, "gen")
+        stage_hpp_dir = join(stagedir, "rpygen")
+        generated = set()
 
-            os.makedirs(cxx_gen_dir, exist_ok=True)
-            os.makedirs(hppoutdir, exist_ok=True)
+        if not report_only:
+            shutil.rmtree(stagedir, ignore_errors=True)
+            for d in (cxx_gen_dir, hppoutdir, stage_gen_dir, stage_hpp_dir):
+                os.makedirs(d, exist_ok=True)
 
         per_header = False
         data_fname = self.cfg.generation_data
@@ -499,6 +590,9 @@ class Wrapper:
 
         processor = ConfigProcessor(tmpl_dir)
 
+        if memory is None:
+            memory = GenMemoryMonitor()
+
         if self.dev_config.only_generate is not None:
             only_generate = {n: True for n in self.dev_config.only_generate}
         else:
@@ -506,6 +600,25 @@ class Wrapper:
 
         generation_search_path = [self.root] + self._all_includes(False)
 
+        # generate an inline file that can be included + called
+        if not report_only:
+            gen_includes = [cxx_gen_dir]
+        else:
+            gen_includes = []
+
+        # Add the root to the includes (but only privately)
+        root_includes = [self.root]
+
+        # update the build extension so that build_ext works (sources are
+        # updated once they are all generated)
+        # use normpath to get rid of .. otherwise gcc is weird
+        self.extension.include_dirs = [
+            normpath(p)
+            for p in (self._all_includes(True) + gen_includes + root_includes)
+        ]
+        self.extension.library_dirs = self._all_library_dirs()
+        self.extension.libraries = self._all_library_names()
+
         for gen in self.cfg.generate:
             for name, header in gen.items():
 
@@ -526,15 +639,23 @@ class Wrapper:
                     sources.append(cpp_dst)
                     classdeps_dst = join(cxx_gen_dir, f"{name}.json")
                     classdeps[name] = classdeps_dst
+                    self.generated_sources[abspath(cpp_dst)] = (
+                        name,
+                        header,
+                        classdeps_dst,
+                    )
 
                     hpp_dst = join(
-                        hppoutdir,
+                        stage_hpp_dir,
                         "{{ cls['namespace'] | replace(':', '_') }}__{{ cls['name'] }}.hpp",
                     )
 
                     templates = [
-                        {"src": cpp_tmpl, "dst": cpp_dst},
-                        {"src": classdeps_tmpl, "dst": classdeps_dst},
+                        {"src": cpp_tmpl, "dst": join(stage_gen_dir, f"{name}.cpp")},
+                        {
+                            "src": classdeps_tmpl,
+                            "dst": join(stage_gen_dir, f"{name}.json"),
+                        },
                     ]
                     class_templates = [{"src": hpp_tmpl, "dst": hpp_dst}]
 
@@ -549,27 +670,35 @@ class Wrapper:
                     else:
                         data = self._load_generation_data(data_fname)
 
-                # for each thing, create a h2w configuration dictionary
-                cfgd = {
-                    # generation code depends on this being just one header!
-                    "headers": [header_path],
-                    "templates": templates,
-                    "class_templates": class_templates,
-                    "preprocess": True,
-                    "pp_retain_all_content": False,
-                    "pp_include_paths": pp_includes,
-                    "pp_defines": pp_defines,
-                    "vars": {"mod_fn": name},
-                }
+                with memory.header(name):
+                    self._gen_header(
+                        processor,
+                        name,
+                        header_path,
+                        templates,
+                        class_templates,
+                        pp_includes,
+                        pp_defines,
+                        data,
+                        data_fname,
+                        casters,
+                        missing_reporter,
+                    )
 
-                cfg = Config(cfgd)
-                cfg.validate()
-                cfg.root = self.incdir
+                    # The parsed header and hooks state reference each other,
+                    # so collect them now instead of letting them accumulate
+                    # across headers
+                    if per_header:
+                        data = None
+                    gc.collect()
 
-                hooks = Hooks(data, casters)
-                processor.process_config(cfg, data, hooks)
+                if not report_only:
+                    generated.update(_update_files(stage_gen_dir, cxx_gen_dir))
+                    generated.update(_update_files(stage_hpp_dir, hppoutdir))
+                    if on_generated:
+                        on_generated(cpp_dst)
 
-                hooks.report_missing(data_fname, missing_reporter)
+        memory.print_report(self.name)
 
         if only_generate:
             unused = ", ".join(sorted(only_generate))
@@ -581,29 +710,67 @@ class Wrapper:
                 print("WARNING: some items not in generation yaml for", basename(name))
                 print(contents)
 
-        # generate an inline file that can be included + called
         if not report_only:
             self._write_wrapper_hpp(cxx_gen_dir, classdeps)
-            gen_includes = [cxx_gen_dir]
-        else:
-            gen_includes = []
+            generated.add(join(cxx_gen_dir, "rpygen_wrapper.hpp"))
+            shutil.rmtree(stagedir, ignore_errors=True)
 
-        # Add the root to the includes (but only privately)
-        root_includes = [self.root]
+            # remove whatever was generated for headers that are gone now
+            if self.dev_config.only_generate is None:
+                for d in (cxx_gen_dir, hppoutdir):
+                    for fname in os.listdir(d):
+                        fname = join(d, fname)
+                        if fname not in generated:
+                            if isdir(fname):
+                                shutil.rmtree(fname, ignore_errors=True)
+                            else:
+                                os.unlink(fname)
 
-        # update the build extension so that build_ext works
         self.extension.sources = sources
-        # use normpath to get rid of .. otherwise gcc is weird
-        self.extension.include_dirs = [
-            normpath(p)
-            for p in (self._all_includes(True) + gen_includes + root_includes)
-        ]
-        self.extension.library_dirs = self._all_library_dirs()
-        self.extension.libraries = self._all_library_names()
 
         for f in glob.glob(join(glob.escape(hppoutdir), "*.hpp")):
             self._add_generated_file(f)
 
+    def _gen_header(
+        self,
+        processor: ConfigProcessor,
+        name: str,
+        header_path: str,
+        templates: List[Dict[str, str]],
+        class_templates: List[Dict[str, str]],
+        pp_includes: List[str],
+        pp_defines: List[str],
+        data: HooksDataYaml,
+        data_fname: str,
+        casters: Dict[str, str],
+        missing_reporter: MissingReporter,
+    ):
+        # Everything created while processing a single header is local to
+        # this function, so it is released as soon as the outputs for the
+        # header have been written
+
+        # for each thing, create a h2w configuration dictionary
+        cfgd = {
+            # generation code depends on this being just one header!
+            "headers": [header_path],
+            "templates": templates,
+            "class_templates": class_templates,
+            "preprocess": True,
+            "pp_retain_all_content": False,
+            "pp_include_paths": pp_includes,
+            "pp_defines": pp_defines,
+            "vars": {"mod_fn": name},
+        }
+
+        cfg = Config(cfgd)
+        cfg.validate()
+        cfg.root = self.incdir
+
+        hooks = Hooks(data, casters)
+        processor.process_config(cfg, data, hooks)
+
+        hooks.report_missing(data_fname, missing_reporter)
+
     def _write_wrapper_hpp(self, outdir, classdeps):
 
         decls = []
@@ -673,5 +840,38 @@ class Wrapper:
             .replace("##CALLS##", "\n".join(calls))
         )
 
-        with open(join(outdir, "rpygen_wrapper.hpp"), "w") as fp:
-            fp.write(content)
+        _write_if_changed(join(outdir, "rpygen_wrapper.hpp"), content)
+
+
+def _write_if_changed(fname: str, contents: str):
+    try:
+        with open(fname) as fp:
+            if fp.read() == contents:
+                return
+    except OSError:
+        pass
+
+    with open(fname, "w") as fp:
+        fp.write(contents)
+
+
+def _update_files(srcdir: str, dstdir: str) -> List[str]:
+    """
+        Moves the files in srcdir to dstdir, but leaves files in dstdir
+        alone if their contents are the same so that their modification
+        times don't change. Returns the files in dstdir.
+    """
+    updated = []
+    for name in os.listdir(srcdir):
+        src = join(srcdir, name)
+        dst = join(dstdir, name)
+        try:
+            same = filecmp.cmp(src, dst, shallow=False)
+        except OSError:
+            same = False
+        if same:
+            os.unlink(src)
+        else:
+            os.replace(src, dst)
+        updated.append(dst)
+    return updated
@@ -0,0 +1,123 @@
+import http.server
+import os
+import re
+import threading
+
+import pytest
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status: int, body: bytes = b"", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        name = self.path.lstrip("/")
+        rng = self.headers.get("Range")
+        with self.server.lock:
+            self.server.requests.append((name, rng))
+            faults = self.server.faults.get(name)
+            fault = faults.pop(0) if faults else None
+
+        if isinstance(fault, int):
+            return self._send(fault)
+        if isinstance(fault, dict):
+            return self._send(fault["status"], headers=fault.get("headers"))
+        if fault == "close":
+            self.close_connection = True
+            return
+
+        fname = os.path.join(self.server.root, *name.split("/"))
+        if not os.path.isfile(fname):
+            return self._send(404, b"not found")
+        with open(fname, "rb") as fp:
+            data = fp.read()
+
+        headers = {"ETag": '"%d"' % len(data)}
+        headers.update(self.server.extra_headers.get(name, {}))
+        status = 200
+        start, end = 0, len(data) - 1
+        if rng and self.server.ranges:
+            m = re.match(r"bytes=(\d*)-(\d*)", rng)
+            if m.group(1):
+                start = int(m.group(1))
+                if m.group(2):
+                    end = min(int(m.group(2)), end)
+            else:
+                start = max(len(data) - int(m.group(2)), 0)
+            if start >= len(data):
+                return self._send(
+                    416, headers={"Content-Range": f"bytes */{len(data)}"}
+                )
+            status = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+            headers["Accept-Ranges"] = "bytes"
+
+        body = data[start : end + 1]
+        if fault == "truncate":
+            # promise the whole body, then hang up half way through it
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(body)))
+            for k, v in headers.items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(body[: len(body) // 2])
+            self.close_connection = True
+            return
+
+        self._send(status, body, headers)
+
+
+class LocalServer(http.server.ThreadingHTTPServer):
+    """
+        HTTP/1.1 server for the files in root, with optional range support.
+        Each request can be made to fail by adding actions to faults[name]:
+        a status code, {"status": ..., "headers": {...}}, "close" to hang up
+        without a response, "truncate" to send half of the body, or None to
+        serve the request normally.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, root: str):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.root = root
+        self.ranges = True
+        self.extra_headers = {}
+        self.faults = {}
+        self.requests = []
+        self.connections = 0
+        self.lock = threading.Lock()
+
+    def handle_error(self, request, client_address):
+        # clients hang up on purpose in some tests
+        pass
+
+    def url(self, name: str) -> str:
+        return f"http://127.0.0.1:{self.server_port}/{name}"
+
+
+@pytest.fixture
+def http_server(tmp_path):
+    root = tmp_path / "repo"
+    root.mkdir()
+    server = LocalServer(str(root))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
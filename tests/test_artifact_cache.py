@@ -0,0 +1,17 @@
+from robotpy_build.artifact_cache import ArtifactCache
+
+
+def test_is_current(tmp_path):
+    cache = ArtifactCache("gcc", path=str(tmp_path / "cache"))
+    ext_path = tmp_path / "lib" / "m.so"
+    ext_path.parent.mkdir()
+    ext_path.write_bytes(b"built")
+
+    assert not cache.is_current("ab12", str(ext_path))
+    cache.store("ab12", str(ext_path))
+    assert cache.is_current("ab12", str(ext_path))
+
+    ext_path.write_bytes(b"rebuilt")
+    assert not cache.is_current("ab12", str(ext_path))
+    assert cache.restore("ab12", str(ext_path))
+    assert ext_path.read_bytes() == b"built"
@@ -0,0 +1,55 @@
+import os
+import threading
+
+import pytest
+
+from robotpy_build.compile_pool import CompileJob, CompilePool, JobServer
+from robotpy_build.incremental import DependencyTracker, ObjectDb
+
+
+@pytest.fixture
+def jobserver():
+    # make 4.3 gives recipes a non-blocking read end
+    rfd, wfd = os.pipe()
+    os.set_blocking(rfd, False)
+    yield JobServer(rfd, wfd)
+    os.close(rfd)
+    os.close(wfd)
+
+
+def test_jobserver_nonblocking(jobserver):
+    os.write(jobserver.wfd, b"+")
+    assert jobserver.acquire() == b"+"
+
+    # no tokens left, so acquire waits until one is released
+    tokens = []
+    t = threading.Thread(target=lambda: tokens.append(jobserver.acquire()))
+    t.start()
+    t.join(0.2)
+    assert t.is_alive()
+
+    jobserver.release(b"x")
+    t.join(5)
+    assert tokens == [b"x"]
+
+
+def _job(tmp_path, tracker, name, size):
+    src = tmp_path / f"{name}.cpp"
+    src.write_bytes(b" " * size)
+    return CompileJob(
+        None, str(tmp_path / f"{name}.o"), str(src), ".cpp", [], [], [], tracker
+    )
+
+
+def test_estimates_without_history(tmp_path):
+    db = ObjectDb(str(tmp_path))
+    tracker = DependencyTracker(db)
+    db.update(str(tmp_path / "slow.o"), time=20.0, size=100000)
+    db.update(str(tmp_path / "fast.o"), time=1.0, size=100000)
+
+    # in pipeline mode the pool starts before any job is submitted
+    pool = CompilePool(2, db=db)
+    slow = _job(tmp_path, tracker, "slow", 100000)
+    new = _job(tmp_path, tracker, "new", 50000)
+    assert pool._estimate(slow) == 20.0
+    assert pool._estimate(new) == pytest.approx(5.25)
@@ -0,0 +1,47 @@
+import os
+
+from robotpy_build.compiler_cache import _parse_ccache_stats_log
+
+
+def test_parse_ccache_stats_log(tmp_path):
+    fname = tmp_path / "stats.log"
+    fname.write_text(
+        # ccache 4
+        "# src/hit.cpp\n"
+        "direct_cache_miss\n"
+        "preprocessed_cache_hit\n"
+        "local_storage_read_hit\n"
+        "local_storage_hit\n"
+        "# src/miss.cpp\n"
+        "direct_cache_miss\n"
+        "preprocessed_cache_miss\n"
+        "cache_miss\n"
+        "local_storage_read_miss\n"
+        "local_storage_miss\n"
+        "local_storage_write\n"
+        "# src/direct.cpp\n"
+        "direct_cache_hit\n"
+        "local_storage_read_hit\n"
+        "local_storage_hit\n"
+        "# src/failed.cpp\n"
+        "compile_failed\n"
+        # ccache 3
+        "# src/old.cpp\n"
+        "cache_hit_direct\n"
+        "# src/old.cpp\n"
+        "cache_miss\n"
+        "# src/miss.cpp\n"
+        "direct_cache_hit\n"
+    )
+
+    stats = _parse_ccache_stats_log(str(fname))
+    assert stats == {
+        os.path.abspath("src/hit.cpp"): (1, 0),
+        os.path.abspath("src/miss.cpp"): (1, 1),
+        os.path.abspath("src/direct.cpp"): (1, 0),
+        os.path.abspath("src/old.cpp"): (1, 1),
+    }
+
+
+def test_parse_missing_ccache_stats_log(tmp_path):
+    assert _parse_ccache_stats_log(str(tmp_path / "missing.log")) == {}
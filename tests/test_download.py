@@ -0,0 +1,178 @@
+import hashlib
+import os
+import zipfile
+
+import pytest
+
+from robotpy_build import download, download_cache, http_pool
+from robotpy_build.download import ArtifactLock, download_and_extract_zip
+
+LIBS = ["linux/x86-64/shared/libx.so", "linux/x86-64/shared/liby.so"]
+
+
+@pytest.fixture
+def dl(tmp_path, monkeypatch):
+    """Isolates the download caches and the http pool"""
+    monkeypatch.setattr(
+        download_cache,
+        "_download_cache",
+        download_cache.DownloadCache(str(tmp_path / "shared")),
+    )
+    monkeypatch.setattr(ArtifactLock, "_instances", {})
+    monkeypatch.setattr(
+        http_pool, "_http_pool", http_pool.HttpPool(timeout=5, retries=0, backoff=0)
+    )
+    return tmp_path
+
+
+@pytest.fixture
+def libs_zip(http_server):
+    """
+        A platform zip where the shared libraries are a small part of the
+        archive, with its published sha1 and the X-Checksum-Sha1 header
+    """
+    fname = os.path.join(http_server.root, "libs.zip")
+    with zipfile.ZipFile(fname, "w") as z:
+        for i in range(10):
+            z.writestr(f"linux/x86-64/static/lib{i}.a", os.urandom(100000))
+        for src in LIBS:
+            z.writestr(src, os.urandom(150000))
+
+    with open(fname, "rb") as fp:
+        sha1 = hashlib.sha1(fp.read()).hexdigest()
+    with open(fname + ".sha1", "w") as fp:
+        fp.write(sha1)
+    http_server.extra_headers["libs.zip"] = {"X-Checksum-Sha1": sha1}
+    return fname
+
+
+def _to(tmp_path):
+    out = tmp_path / "out"
+    out.mkdir(exist_ok=True)
+    return {src: str(out / os.path.basename(src)) for src in LIBS}
+
+
+def _check(fname, to):
+    with zipfile.ZipFile(fname) as z:
+        for src, dst in to.items():
+            with open(dst, "rb") as fp:
+                assert fp.read() == z.read(src)
+
+
+def _zip_requests(server):
+    return [rng for name, rng in server.requests if name == "libs.zip"]
+
+
+def test_fetches_members_with_ranges(dl, http_server, libs_zip):
+    to = _to(dl)
+    cache = str(dl / "cache")
+    download_and_extract_zip(http_server.url("libs.zip"), to, cache, False)
+    _check(libs_zip, to)
+
+    # only range requests, the zip wasn't downloaded
+    requests = _zip_requests(http_server)
+    assert requests and all(requests)
+
+    # a clean build uses the files fetched before
+    for dst in to.values():
+        os.unlink(dst)
+    ArtifactLock._instances.clear()
+    http_server.requests.clear()
+    download_and_extract_zip(http_server.url("libs.zip"), to, cache, False)
+    _check(libs_zip, to)
+    assert http_server.requests == []
+
+
+def test_members_in_project_cache(dl, http_server, libs_zip, monkeypatch):
+    monkeypatch.setattr(download_cache, "_download_cache", False)
+    to = _to(dl)
+    cache = str(dl / "cache")
+    download_and_extract_zip(http_server.url("libs.zip"), to, cache, False)
+    _check(libs_zip, to)
+
+    lock = ArtifactLock.for_cache(cache)
+    for src in LIBS:
+        assert lock.is_valid(
+            download._member_url(http_server.url("libs.zip"), src),
+            download._member_fname(http_server.url("libs.zip"), src, cache),
+        )
+
+
+def test_no_range_support(dl, http_server, libs_zip):
+    http_server.ranges = False
+    to = _to(dl)
+    download_and_extract_zip(http_server.url("libs.zip"), to, str(dl / "cache"), False)
+    _check(libs_zip, to)
+    assert None in _zip_requests(http_server)
+
+
+@pytest.mark.parametrize("headers", [{}, {"X-Checksum-Sha1": "0" * 40}])
+def test_unverifiable_downloads_everything(dl, http_server, libs_zip, headers):
+    # without a matching checksum from the server, the whole zip is
+    # downloaded so that it can be verified
+    http_server.extra_headers["libs.zip"] = headers
+    to = _to(dl)
+    download_and_extract_zip(http_server.url("libs.zip"), to, str(dl / "cache"), False)
+    _check(libs_zip, to)
+    assert None in _zip_requests(http_server)
+
+
+@pytest.mark.parametrize("fault", [500, "truncate"])
+def test_failed_fetch_downloads_everything(dl, http_server, libs_zip, fault):
+    # the central directory is read, then fetching the second file fails
+    http_server.faults["libs.zip"] = [None, None, fault]
+    to = _to(dl)
+    download_and_extract_zip(http_server.url("libs.zip"), to, str(dl / "cache"), False)
+    _check(libs_zip, to)
+    assert None in _zip_requests(http_server)
+
+
+def test_failed_fetch_removes_partial_files(dl, http_server, libs_zip):
+    # the full download fails too
+    http_server.faults["libs.zip"] = [None, None, 500, 404]
+    to = _to(dl)
+    with pytest.raises(OSError):
+        download_and_extract_zip(
+            http_server.url("libs.zip"), to, str(dl / "cache"), False
+        )
+    assert not any(os.path.exists(dst) for dst in to.values())
+
+
+def test_missing_member(dl, http_server, libs_zip):
+    to = _to(dl)
+    to["linux/x86-64/shared/libz.so"] = str(dl / "out" / "libz.so")
+    with pytest.raises(KeyError):
+        download_and_extract_zip(
+            http_server.url("libs.zip"), to, str(dl / "cache"), False
+        )
+    assert not any(os.path.exists(dst) for dst in to.values())
+
+
+def _local_zip(tmp_path, sidecar):
+    fname = tmp_path / "local.zip"
+    with zipfile.ZipFile(str(fname), "w") as z:
+        z.writestr("x/h.h", "local")
+    if sidecar is not None:
+        (tmp_path / "local.zip.sha1").write_text(sidecar)
+    return fname
+
+
+def test_local_artifact_verified(tmp_path):
+    fname = _local_zip(tmp_path, None)
+    sha1 = hashlib.sha1(fname.read_bytes()).hexdigest()
+    (tmp_path / "local.zip.sha1").write_text(sha1)
+    out = download_and_extract_zip(fname.as_uri(), str(tmp_path / "out"))
+    assert open(os.path.join(out, "x", "h.h")).read() == "local"
+
+
+def test_local_artifact_corrupted(tmp_path):
+    fname = _local_zip(tmp_path, "0" * 40)
+    with pytest.raises(ValueError):
+        download_and_extract_zip(fname.as_uri(), str(tmp_path / "out"))
+    assert not os.path.exists(tmp_path / "out")
+
+
+def test_local_artifact_without_checksum(tmp_path):
+    fname = _local_zip(tmp_path, None)
+    with pytest.warns(UserWarning, match="not verified"):
+        download_and_extract_zip(fname.as_uri(), str(tmp_path / "out"))
@@ -0,0 +1,44 @@
+import hashlib
+import os
+import zipfile
+
+from robotpy_build.download_cache import DownloadCache
+
+
+def _store(cache, tmp_path, name, data, mtime):
+    fname = tmp_path / name
+    fname.write_bytes(data)
+    url = f"https://example.com/{name}"
+    stored = cache.store(url, str(fname), hashlib.sha256(data).hexdigest())
+    os.utime(stored, (mtime, mtime))
+    return stored
+
+
+def test_evict(tmp_path):
+    cache = DownloadCache(str(tmp_path / "cache"), max_size=2500)
+
+    # a zip that is extracted into the cache
+    zname = tmp_path / "h.zip"
+    with zipfile.ZipFile(str(zname), "w") as z:
+        z.writestr("inc/h.h", b"h" * 1000)
+    zdata = zname.read_bytes()
+    zstored = _store(cache, tmp_path, "h.zip", zdata, 3000)
+    cache.materialize(zstored, str(tmp_path / "out"))
+    sha256 = hashlib.sha256(zdata).hexdigest()
+    tree = tmp_path / "cache" / "extracted" / sha256[:2] / sha256
+    os.utime(str(tree) + ".json", (1000, 1000))
+
+    old = _store(cache, tmp_path, "old.zip", b"o" * 1000, 2000)
+    new = _store(cache, tmp_path, "new.zip", b"n" * 1000, 4000)
+
+    cache.evict()
+
+    # the least recently used entries are removed until it is 90% full
+    assert not tree.exists()
+    assert not os.path.exists(str(tree) + ".json")
+    assert not os.path.exists(old)
+    assert os.path.exists(zstored)
+    assert os.path.exists(new)
+
+    # files linked from the tree stay valid
+    assert (tmp_path / "out" / "inc" / "h.h").read_bytes() == b"h" * 1000
@@ -0,0 +1,98 @@
+import os
+from urllib.error import HTTPError
+
+import pytest
+
+from robotpy_build import download, http_pool
+from robotpy_build.http_pool import HttpPool
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    pool = HttpPool(timeout=5, retries=2, backoff=0)
+    monkeypatch.setattr(http_pool, "_http_pool", pool)
+    yield pool
+    pool.close()
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+    monkeypatch.setattr(http_pool.time, "sleep", delays.append)
+    monkeypatch.setattr(download.time, "sleep", delays.append)
+    return delays
+
+
+@pytest.fixture
+def data(http_server):
+    data = os.urandom(200000)
+    with open(os.path.join(http_server.root, "a.zip"), "wb") as fp:
+        fp.write(data)
+    return data
+
+
+def _get(pool, url) -> bytes:
+    with pool.request(url) as rsp:
+        return rsp.read()
+
+
+def test_reuses_connections(pool, http_server, data):
+    for _ in range(5):
+        assert _get(pool, http_server.url("a.zip")) == data
+    # error responses don't use up the connection either
+    with pytest.raises(HTTPError):
+        _get(pool, http_server.url("missing.zip"))
+    assert _get(pool, http_server.url("a.zip")) == data
+    assert http_server.connections == 1
+
+
+@pytest.mark.parametrize("fault", [503, "close"])
+def test_retries(pool, http_server, data, sleeps, fault):
+    http_server.faults["a.zip"] = [fault, fault]
+    assert _get(pool, http_server.url("a.zip")) == data
+    assert len(http_server.requests) == 3
+    assert len(sleeps) == 2
+
+
+def test_gives_up(pool, http_server, data, sleeps):
+    http_server.faults["a.zip"] = [503] * 3
+    with pytest.raises(HTTPError) as e:
+        _get(pool, http_server.url("a.zip"))
+    assert e.value.code == 503
+    assert len(http_server.requests) == 3
+
+
+def test_no_retry_for_client_errors(pool, http_server, sleeps):
+    with pytest.raises(HTTPError) as e:
+        _get(pool, http_server.url("missing.zip"))
+    assert e.value.code == 404
+    assert len(http_server.requests) == 1
+    assert sleeps == []
+
+
+def test_retry_after(pool, http_server, data, sleeps):
+    http_server.faults["a.zip"] = [{"status": 429, "headers": {"Retry-After": "3"}}]
+    assert _get(pool, http_server.url("a.zip")) == data
+    assert sleeps == [3.0]
+
+
+def test_download_resumes_interrupted_body(pool, http_server, data, sleeps, tmp_path):
+    http_server.faults["a.zip"] = ["truncate"]
+    fname = str(tmp_path / "a.zip")
+    download._download(http_server.url("a.zip"), fname, False)
+    with open(fname, "rb") as fp:
+        assert fp.read() == data
+
+    requests = [rng for name, rng in http_server.requests if name == "a.zip"]
+    assert requests[0] is None
+    assert requests[1] == "bytes=%d-" % (len(data) // 2)
+
+
+def test_download_failed_requests_not_retried_twice(
+    pool, http_server, sleeps, tmp_path
+):
+    # the pool already retried the request, _download must not retry it again
+    http_server.faults["a.zip"] = ["close"] * 10
+    with pytest.raises(OSError):
+        download._download(http_server.url("a.zip"), str(tmp_path / "a.zip"), False)
+    assert len(http_server.requests) == pool.retries + 1
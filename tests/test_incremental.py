@@ -0,0 +1,138 @@
+import os
+
+import pytest
+
+from robotpy_build.incremental import DependencyTracker, ObjectDb, parse_depfile
+
+
+def _write(path, contents=""):
+    with open(path, "w") as fp:
+        fp.write(contents)
+
+
+def _age(seconds, *paths):
+    # pushes modification times into the past so that later writes are newer
+    for path in paths:
+        st = os.stat(path)
+        os.utime(path, (st.st_atime - seconds, st.st_mtime - seconds))
+
+
+def test_parse_depfile(tmp_path):
+    fname = str(tmp_path / "a.d")
+    _write(
+        fname,
+        "build/a.o: src/a.cpp include/a.h \\\n"
+        "  include/with\\ space.h \\\n"
+        "  /usr/include/b.h\n"
+        "include/a.h:\n"
+        "/usr/include/b.h:\n",
+    )
+    assert parse_depfile(fname) == [
+        "src/a.cpp",
+        "include/a.h",
+        "include/with space.h",
+        "/usr/include/b.h",
+    ]
+
+
+def test_parse_depfile_invalid(tmp_path):
+    assert parse_depfile(str(tmp_path / "missing.d")) is None
+    fname = str(tmp_path / "a.d")
+    _write(fname, "not a rule\n")
+    assert parse_depfile(fname) is None
+
+
+class Compiler:
+    compiler_so = ["ccache", "g++", "-fPIC"]
+    linker_so = ["g++", "-shared"]
+
+
+@pytest.fixture
+def tu(tmp_path):
+    """A compiled object with a source and a header that it depends on"""
+    src = str(tmp_path / "a.cpp")
+    hdr = str(tmp_path / "a.h")
+    obj = str(tmp_path / "a.o")
+    _write(src, '#include "a.h"\n')
+    _write(hdr)
+    _write(str(tmp_path / "a.d"), f"{obj}: {src} {hdr}\n")
+    _write(obj)
+    _age(100, src, hdr)
+    _age(50, obj)
+    return obj, src, hdr
+
+
+def _tracker(tmp_path, tu, **kwargs):
+    obj, src, _ = tu
+    tracker = DependencyTracker(ObjectDb(str(tmp_path)), **kwargs)
+    tracker.record(Compiler(), obj, src, ["-O2"], ["-MMD"], 1.5, 1000)
+    return tracker
+
+
+def test_up_to_date(tmp_path, tu):
+    obj, src, _ = tu
+    tracker = _tracker(tmp_path, tu)
+    assert tracker.is_up_to_date(Compiler(), obj, src, ["-O2"], ["-MMD"])
+
+    # the launcher doesn't matter
+    compiler = Compiler()
+    compiler.compiler_so = compiler.compiler_so[1:]
+    assert tracker.is_up_to_date(compiler, obj, src, ["-O2"], ["-MMD"])
+
+
+def test_history_persists(tmp_path, tu):
+    obj, src, _ = tu
+    tracker = _tracker(tmp_path, tu)
+    tracker.db.save()
+
+    db = ObjectDb(str(tmp_path))
+    assert db.get(obj)["time"] == 1.5
+    assert db.get(obj)["rss"] == 1000
+    assert DependencyTracker(db).is_up_to_date(Compiler(), obj, src, ["-O2"], ["-MMD"])
+
+
+@pytest.mark.parametrize("changed", ["src", "hdr"])
+def test_changed_dependency(tmp_path, tu, changed):
+    obj, src, hdr = tu
+    tracker = _tracker(tmp_path, tu)
+    _write(src if changed == "src" else hdr, "// changed\n")
+    assert not tracker.is_up_to_date(Compiler(), obj, src, ["-O2"], ["-MMD"])
+
+
+def test_missing_dependency(tmp_path, tu):
+    obj, src, hdr = tu
+    tracker = _tracker(tmp_path, tu)
+    os.unlink(hdr)
+    assert not tracker.is_up_to_date(Compiler(), obj, src, ["-O2"], ["-MMD"])
+
+
+def test_missing_depfile(tmp_path, tu):
+    obj, src, _ = tu
+    tracker = _tracker(tmp_path, tu)
+    os.unlink(str(tmp_path / "a.d"))
+    assert not tracker.is_up_to_date(Compiler(), obj, src, ["-O2"], ["-MMD"])
+
+
+def test_changed_flags(tmp_path, tu):
+    obj, src, _ = tu
+    tracker = _tracker(tmp_path, tu)
+    assert not tracker.is_up_to_date(Compiler(), obj, src, ["-O0"], ["-MMD"])
+
+    compiler = Compiler()
+    compiler.compiler_so = ["clang++", "-fPIC"]
+    assert not tracker.is_up_to_date(compiler, obj, src, ["-O2"], ["-MMD"])
+
+
+def test_force(tmp_path, tu):
+    obj, src, _ = tu
+    tracker = _tracker(tmp_path, tu, force=True)
+    assert not tracker.is_up_to_date(Compiler(), obj, src, ["-O2"], ["-MMD"])
+
+
+def test_failed_compile_is_rebuilt(tmp_path, tu):
+    obj, src, _ = tu
+    tracker = _tracker(tmp_path, tu)
+    tracker.invalidate(obj)
+    assert not tracker.is_up_to_date(Compiler(), obj, src, ["-O2"], ["-MMD"])
+    # the history is kept for scheduling
+    assert tracker.db.get(obj)["time"] == 1.5
@@ -0,0 +1,104 @@
+import threading
+import time
+
+import pytest
+
+from robotpy_build.taskgraph import TaskGraph
+
+
+def _graph(order, tasks):
+    graph = TaskGraph()
+    lock = threading.Lock()
+    for name, depends in tasks.items():
+
+        def fn(name=name):
+            with lock:
+                order.append(name)
+
+        graph.add(name, fn, depends)
+    return graph
+
+
+def test_dependency_order():
+    order = []
+    graph = _graph(
+        order,
+        {
+            "gen-a": ["dl-a"],
+            "dl-a": [],
+            "dl-b": [],
+            "gen-b": ["dl-b", "gen-a"],
+            "build-a": ["gen-a"],
+            "build-b": ["gen-b"],
+        },
+    )
+    graph.run()
+
+    assert sorted(order) == sorted(graph.tasks)
+    for name, (_, depends) in graph.tasks.items():
+        for dep in depends:
+            assert order.index(dep) < order.index(name)
+    assert sorted(name for name, _, _ in graph.timings) == sorted(graph.tasks)
+
+
+def test_independent_tasks_run_together():
+    # deadlocks (and times out) unless both tasks run at the same time
+    barrier = threading.Barrier(2, timeout=5)
+    graph = TaskGraph()
+    graph.add("a", barrier.wait)
+    graph.add("b", barrier.wait)
+    graph.run()
+
+
+def test_duplicate_task():
+    graph = TaskGraph()
+    graph.add("a", lambda: None)
+    with pytest.raises(ValueError):
+        graph.add("a", lambda: None)
+
+
+def test_unknown_dependency():
+    order = []
+    graph = _graph(order, {"a": [], "b": ["missing"]})
+    with pytest.raises(ValueError, match="unknown task 'missing'"):
+        graph.run()
+    assert order == []
+
+
+def test_cycle():
+    order = []
+    graph = _graph(order, {"a": ["c"], "b": ["a"], "c": ["b"], "d": []})
+    with pytest.raises(ValueError):
+        graph.run()
+    assert order == []
+
+
+def test_failure_skips_later_tasks():
+    ran = []
+    failed = threading.Event()
+
+    def fail():
+        failed.set()
+        raise RuntimeError("first")
+
+    def slow():
+        # still running when the other task fails
+        failed.wait(5)
+        time.sleep(0.1)
+        ran.append("slow")
+
+    def fail_later():
+        raise RuntimeError("second")
+
+    graph = TaskGraph()
+    graph.add("fail", fail)
+    graph.add("slow", slow)
+    graph.add("after-fail", lambda: ran.append("after-fail"), ["fail"])
+    graph.add("after-slow", lambda: ran.append("after-slow"), ["slow"])
+    graph.add("fail-later", fail_later, ["slow"])
+
+    with pytest.raises(RuntimeError, match="first"):
+        graph.run()
+
+    # tasks that already started finish, nothing else starts
+    assert ran == ["slow"]
@@ -0,0 +1,40 @@
+import sys
+
+import pytest
+from distutils.errors import DistutilsExecError
+
+from robotpy_build.time_trace import capture_gcc_time_report, gcc_report_fname
+
+
+class Compiler:
+    dry_run = False
+
+
+def _fake_gcc(tmp_path, stderr, code=0):
+    script = tmp_path / "gcc.py"
+    script.write_text(f"import sys\nsys.stderr.write({stderr!r})\nsys.exit({code})\n")
+    obj = str(tmp_path / "a.o")
+    return [sys.executable, str(script), "-c", "a.cpp", "-o", obj], obj
+
+
+def test_gcc_time_report(tmp_path, capsys):
+    compiler = Compiler()
+    capture_gcc_time_report(compiler)
+
+    report = "Time variable   usr  sys  wall\n phase parsing : 1.0 0.1 1.2\n"
+    cmd, obj = _fake_gcc(tmp_path, "a.cpp:1: warning: x\n" + report)
+    compiler.spawn(cmd)
+
+    with open(gcc_report_fname(obj)) as fp:
+        assert fp.read() == report
+    assert capsys.readouterr().err == "a.cpp:1: warning: x\n"
+
+
+def test_gcc_time_report_failed(tmp_path, capsys):
+    compiler = Compiler()
+    capture_gcc_time_report(compiler)
+
+    cmd, _ = _fake_gcc(tmp_path, "a.cpp:1: error: x\n", 1)
+    with pytest.raises(DistutilsExecError):
+        compiler.spawn(cmd)
+    assert capsys.readouterr().err == "a.cpp:1: error: x\n"
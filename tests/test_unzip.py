@@ -0,0 +1,50 @@
+import os
+import zipfile
+
+import pytest
+
+from robotpy_build import unzip
+from robotpy_build.unzip import extract_zip
+
+
+def _tree(root):
+    result = {}
+    for dirpath, dirnames, files in os.walk(root):
+        rel = os.path.relpath(dirpath, root)
+        result[rel] = None
+        for fname in files:
+            with open(os.path.join(dirpath, fname), "rb") as fp:
+                result[os.path.join(rel, fname)] = fp.read()
+    return result
+
+
+@pytest.fixture(autouse=True)
+def small_archives(monkeypatch):
+    monkeypatch.setattr(unzip, "min_parallel_members", 2)
+
+
+@pytest.mark.parametrize(
+    "extra", [[], ["../evil.h", "/abs/x.h", "bad:name/x.h", "dots./x.h", "a//b.h"]]
+)
+def test_same_as_extractall(tmp_path, extra):
+    fname = str(tmp_path / "h.zip")
+    with zipfile.ZipFile(fname, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr("empty/", b"")
+        for i in range(200):
+            z.writestr(f"inc/sub{i % 7}/f{i}.h", f"// {i}\n" * (i + 1))
+        for name in extra:
+            z.writestr(name, name)
+
+    with zipfile.ZipFile(fname) as z:
+        z.extractall(str(tmp_path / "expected"))
+    extract_zip(fname, str(tmp_path / "actual"), jobs=4)
+
+    assert _tree(str(tmp_path / "actual")) == _tree(str(tmp_path / "expected"))
+
+
+def test_member_dir():
+    assert unzip._member_dir("to", "a/b/c.h") == os.path.join("to", "a", "b")
+    assert unzip._member_dir("to", "a/b/") == os.path.join("to", "a", "b")
+    assert unzip._member_dir("to", "c.h") == "to"
+    for name in ("../c.h", "/c.h", "a:b/c.h", "a./c.h", "a/c?.h", "a\\b/c.h"):
+        assert unzip._member_dir("to", name) is None
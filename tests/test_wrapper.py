@@ -0,0 +1,175 @@
+import hashlib
+import os
+import zipfile
+
+import pytest
+
+pytest.importorskip("header2whatever")
+
+from robotpy_build import wrapper
+
+
+def _write(path, contents):
+    with open(path, "w") as fp:
+        fp.write(contents)
+
+
+def test_update_files_keeps_unchanged(tmp_path):
+    src = tmp_path / "staging"
+    dst = tmp_path / "gen"
+    src.mkdir()
+    dst.mkdir()
+
+    _write(str(dst / "same.cpp"), "same")
+    _write(str(dst / "changed.cpp"), "old")
+    os.utime(str(dst / "same.cpp"), (0, 0))
+    os.utime(str(dst / "changed.cpp"), (0, 0))
+
+    for name, contents in [
+        ("same.cpp", "same"),
+        ("changed.cpp", "new"),
+        ("new.cpp", ""),
+    ]:
+        _write(str(src / name), contents)
+
+    updated = wrapper._update_files(str(src), str(dst))
+    assert sorted(updated) == sorted(
+        str(dst / name) for name in ("same.cpp", "changed.cpp", "new.cpp")
+    )
+    assert os.listdir(str(src)) == []
+
+    assert os.stat(str(dst / "same.cpp")).st_mtime == 0
+    assert os.stat(str(dst / "changed.cpp")).st_mtime != 0
+    assert (dst / "changed.cpp").read_text() == "new"
+    assert (dst / "new.cpp").exists()
+
+
+def test_write_if_changed(tmp_path):
+    fname = str(tmp_path / "rpygen_wrapper.hpp")
+    wrapper._write_if_changed(fname, "a")
+    os.utime(fname, (0, 0))
+    wrapper._write_if_changed(fname, "a")
+    assert os.stat(fname).st_mtime == 0
+    wrapper._write_if_changed(fname, "b")
+    assert open(fname).read() == "b"
+
+
+@pytest.fixture
+def project(tmp_path, http_server, monkeypatch):
+    """A wrapper of a maven artifact, with its own download caches"""
+    from robotpy_build import download_cache
+    from robotpy_build.download import ArtifactLock
+    from robotpy_build.pkgcfg_provider import PkgCfgProvider
+    from robotpy_build.platforms import get_platform
+    from robotpy_build.pyproject_configs import WrapperConfig
+
+    monkeypatch.setattr(
+        download_cache,
+        "_download_cache",
+        download_cache.DownloadCache(str(tmp_path / "shared")),
+    )
+    monkeypatch.setattr(ArtifactLock, "_instances", {})
+    monkeypatch.setenv("HOME", str(tmp_path / "home"))
+
+    platform = get_platform()
+
+    def _publish(version):
+        repo = os.path.join(http_server.root, "org", "x", "x-cpp", version)
+        os.makedirs(repo)
+        zips = {
+            "headers": {"x/x.h": f"// x {version}"},
+            f"{platform.os}{platform.arch}": {
+                f"{platform.os}/{platform.arch}/shared/"
+                f"{platform.libprefix}x{platform.libext}": "x"
+            },
+        }
+        for classifier, files in zips.items():
+            fname = os.path.join(repo, f"x-cpp-{version}-{classifier}.zip")
+            with zipfile.ZipFile(fname, "w") as z:
+                for name, contents in files.items():
+                    z.writestr(name, contents)
+            with open(fname, "rb") as fp:
+                _write(fname + ".sha1", hashlib.sha1(fp.read()).hexdigest())
+
+    class Setup:
+        root = str(tmp_path / "proj")
+        pypi_package = "pkg"
+        setup_kwargs = {}
+        pkgcfg = PkgCfgProvider()
+
+    Setup.platform = platform
+    os.makedirs(os.path.join(Setup.root, "pkg"))
+
+    def _wrapper(version="1.0"):
+        if not os.path.isdir(
+            os.path.join(http_server.root, "org", "x", "x-cpp", version)
+        ):
+            _publish(version)
+        cfg = WrapperConfig(
+            name="x",
+            sources=["pkg/x.cpp"],
+            maven_lib_download=dict(
+                artifact_id="x-cpp",
+                group_id="org.x",
+                repo_url=http_server.url("").rstrip("/"),
+                version=version,
+                libs=["x"],
+            ),
+        )
+        return wrapper.Wrapper("pkg", cfg, Setup)
+
+    def _build_dl(version="1.0"):
+        w = _wrapper(version)
+        w.on_build_dl(
+            str(tmp_path / "build" / "cache"), str(tmp_path / "build" / "src")
+        )
+        return w
+
+    return _build_dl
+
+
+def _mtimes(root):
+    mtimes = {}
+    for dirpath, _, files in os.walk(root):
+        for fname in files:
+            path = os.path.join(dirpath, fname)
+            mtimes[path] = os.stat(path).st_mtime_ns
+    return mtimes
+
+
+def test_build_dl_unchanged(project, http_server):
+    first = project()
+    root = first.root
+    before = _mtimes(root)
+    assert before
+
+    http_server.requests.clear()
+    second = project()
+    assert http_server.requests == []
+    assert _mtimes(root) == before
+    assert sorted(second.generated_files) == sorted(first.generated_files)
+    assert "pkgcfg.py" in second.generated_files
+    assert os.path.join("include", "x", "x.h") in second.generated_files
+
+
+def test_build_dl_new_version(project, http_server):
+    project()
+    http_server.requests.clear()
+    w = project("2.0")
+    assert any("2.0" in name for name, _ in http_server.requests)
+    with open(os.path.join(w.root, "include", "x", "x.h")) as fp:
+        assert fp.read() == "// x 2.0"
+
+
+def test_build_dl_deleted_file(project, http_server):
+    w = project()
+    lib = [f for f in w.generated_files if f.startswith("lib")][0]
+    pkgcfg = os.path.join(w.root, "pkgcfg.py")
+    os.unlink(os.path.join(w.root, lib))
+    os.utime(pkgcfg, (0, 0))
+
+    # everything is extracted and written again
+    w = project()
+    assert os.path.exists(os.path.join(w.root, lib))
+    assert lib in w.generated_files
+    assert os.stat(pkgcfg).st_mtime != 0